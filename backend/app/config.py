@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 
@@ -17,14 +17,58 @@ class Settings(BaseSettings):
     postgres_db: str = "solverai"
     postgres_user: str = "solverai"
     postgres_password: str = "solverai"
+    # Comma-separated host:port list of read replicas for read-only endpoints
+    postgres_replicas: str = ""
+    postgres_max_connections: int = 100  # server limit shared by all workers
+    postgres_statement_cache_size: int = 500  # 0 when behind pgbouncer
+    db_pool_size: int = 0  # 0 = derived from postgres_max_connections / web_concurrency
+    db_max_overflow: int = 0
+    db_pool_timeout: float = 30.0
+    web_concurrency: int = 1  # uvicorn/gunicorn worker processes
 
     # Redis Configuration
     redis_host: str = "localhost"
     redis_port: int = 6379
 
+    # Streamed /chat generations: "memory" (per worker) or "redis" (shared)
+    generation_buffer: str = "memory"
+    generation_buffer_ttl_seconds: int = 300  # resumable for this long after finishing
+
+    # /chat/ws connections
+    chat_ws_max_turns: int = 4  # generations in flight per connection
+    chat_ws_send_queue: int = 64  # frames buffered before a slow client pauses generation
+    chat_ws_cached_conversations: int = 16  # conversation windows kept per connection
+
+    # Request deadlines (clients may ask for less with X-Request-Timeout)
+    request_deadline_seconds: float = 120.0
+    deadline_rag_min_seconds: float = 5.0  # skip retrieval when less time is left
+    deadline_escalation_min_seconds: float = 15.0  # keep the small model's answer when less is left
+
     # LLM Configuration
     ollama_base_url: str = "http://127.0.0.1:11434"
     ollama_model: str = "llama3.1:8b"
+    # Comma-separated Ollama endpoints; defaults to ollama_base_url alone
+    ollama_replicas: str = ""
+    ollama_health_interval_seconds: float = 10.0
+    ollama_eject_after_failures: int = 3  # consecutive request failures
+    ollama_eject_seconds: float = 30.0  # before an ejected replica is probed again
+    ollama_affinity_slack: int = 2  # extra in-flight requests tolerated to keep a conversation on its replica
+    # Model cascade: simple turns go to a small model (empty = always ollama_model)
+    ollama_small_model: str = ""
+    cascade_max_prompt_tokens: int = 1500  # longer prompts always use ollama_model
+    cascade_score_threshold: float = 0.5  # classifier score that routes to ollama_model
+    cascade_classifier_weights: Optional[str] = None  # JSON file overriding the default weights
+    cascade_escalate: bool = True  # retry with ollama_model when the small answer fails the check
+    cascade_min_answer_chars: int = 8
+    cascade_stream_check_chars: int = 120  # streamed small answers are held back until checked
+    cascade_small_model_cost: float = 0.25  # relative to ollama_model, for savings estimates
+    ollama_num_parallel: int = 4  # requests each replica runs at once (OLLAMA_NUM_PARALLEL)
+
+    # Batch chat jobs (/batch/chat)
+    batch_llm_concurrency: int = 0  # 0 = ollama_num_parallel per Ollama replica
+    batch_chunk_size: int = 32  # items retrieved (embedded) together
+    batch_max_interactive: int = 0  # batch LLM calls wait while more chats than this are in flight
+    batch_lease_seconds: float = 60.0  # a job whose worker stops renewing for this long is taken over
     openai_api_key: Optional[str] = None
 
     # Vector Database & Documents
@@ -48,29 +92,138 @@ class Settings(BaseSettings):
         return os.path.abspath(self.audio_temp_dir)
 
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # torch | onnx | onnx-int8
+    embedding_backend: str = "torch"
+    embedding_batch_size: int = 64
+    embedding_num_threads: int = 0  # 0 = runtime default
+    embedding_cache_dir: str = "local_data/embedding_models"
+
+    @property
+    def absolute_embedding_cache_dir(self) -> str:
+        import os
+        return os.path.abspath(self.embedding_cache_dir)
 
     # Voice Settings
     whisper_model: str = "base"
+    whisper_replicas: int = 1  # independent model instances
+    whisper_cpu_threads: int = 0  # per replica, 0 = CTranslate2 default
+    whisper_num_workers: int = 1  # per replica
+    whisper_queue_size: int = 32  # pending requests before /voice returns 503
+    whisper_batch_window_ms: int = 50  # how long to wait for clips to pack together
+    whisper_batch_clip_seconds: float = 8.0  # clips up to this length may be packed
     tts_engine: str = "local"
+    tts_workers: int = 2  # pre-initialized engine processes
+    tts_cache_entries: int = 256  # cached sentences keyed by (text, voice)
+    tts_cache_max_bytes: int = 64 * 1024 * 1024
+    voice_chat_max_pending_sentences: int = 8  # /voice/chat waits for TTS once this many sentences are queued
+    # Streaming transcription (/voice/stream)
+    voice_stream_partial_interval: float = 1.0  # seconds of new audio between partials
+    voice_stream_min_silence_ms: int = 500  # trailing silence that closes a segment
+    voice_stream_max_segment_seconds: float = 15.0
+
+    # Shared model server (python -m services.model_server): when set, every
+    # API worker embeds and transcribes through this Unix socket instead of
+    # loading its own embedding and Whisper models
+    model_server_socket: str = ""
+    model_server_connections: int = 4  # per API worker process
+    model_server_timeout_seconds: float = 120.0
+    model_server_batch_window_ms: int = 10  # server waits this long to batch embedding requests together
+    model_server_max_batch_texts: int = 256
 
     # Agent Settings
     enable_search_agent: bool = True
-    enable_code_agent: bool = True
+    # Runs model-written Python as the API's user (see services/agents/sandbox.py)
+    enable_code_agent: bool = False
     enable_calendar_agent: bool = True
+    agent_max_steps: int = 4  # model calls that may request tools before it must answer
+    agent_max_parallel_tools: int = 4  # tool calls run concurrently per step
+    agent_search_timeout_seconds: float = 5.0
+    agent_code_timeout_seconds: float = 10.0
+    code_sandbox_workers: int = 2  # pre-started interpreter processes
+    code_sandbox_memory_mb: int = 256
+    code_sandbox_cpu_seconds: int = 5  # per snippet
+    code_sandbox_max_uses: int = 50  # snippets before an interpreter is replaced
+    code_sandbox_max_output_chars: int = 4000
 
     # RAG Settings
     rag_enabled: bool = True
     chunk_size: int = 500
     chunk_overlap: int = 50
+    # Query embedding and retrieval result caches (see /metrics retrieval_cache)
+    retrieval_embedding_cache_entries: int = 4096
+    retrieval_embedding_cache_max_bytes: int = 32 * 1024 * 1024
+    retrieval_result_cache_entries: int = 8192
+    retrieval_result_cache_max_bytes: int = 16 * 1024 * 1024
+
+    # Bulk ingestion
+    ingest_workers: int = 0  # 0 = one process per CPU core
+    ingest_batch_files: int = 500  # files per batched index write
+
+    # Index rebuilds (/index/rebuild)
+    index_rebuild_batch_chunks: int = 32  # chunks embedded per step
+    index_rebuild_pause_seconds: float = 0.05  # sleep between steps
+    index_rebuild_max_interactive: int = 0  # steps wait while more chats than this are in flight
+    index_rebuild_max_wait_seconds: float = 5.0  # ...but no longer than this, so a rebuild always progresses
+    index_keep_generations: int = 2  # live generation plus generations kept for rollback
+    index_job_stale_seconds: int = 600  # shared store: other nodes' jobs without progress for this long are failed
+
+    # Vector store: "faiss" (files under vector_db_path, one node) or
+    # "pgvector" (tables in the Postgres database, shared by every node)
+    vector_store: str = "faiss"
+    pgvector_hnsw_m: int = 16
+    pgvector_hnsw_ef_construction: int = 64
+    pgvector_ef_search: int = 100  # HNSW candidates per query; higher is slower but more accurate
+    pgvector_iterative_scan: str = ""  # "relaxed_order" or "strict_order" keeps filtered searches from coming up short
+    pgvector_pool_size: int = 5
+    vector_generation_poll_seconds: float = 10.0  # how often nodes check for a swap made elsewhere
+    # FAISS keeps one shard per collection; shards are opened on demand and the
+    # least recently used are closed once open shards exceed this much memory
+    vector_shard_cache_mb: int = 1024
+    vector_shard_search_workers: int = 4  # threads a query spanning several collections fans out over
 
     class Config:
         env_file = ".env"
         case_sensitive = False
         extra = "ignore"
+        # Allow model_server_* fields (pydantic reserves model_ by default)
+        protected_namespaces = ("settings_",)
 
     # Local dev uses SQLite by default; set USE_POSTGRES=true for Postgres
     use_postgres: bool = False
 
+    # SQLite profile: "production" enables WAL and tuned pragmas, and splits
+    # a single writer connection from a pool of read-only connections
+    sqlite_profile: str = "production"
+    sqlite_reader_pool_size: int = 8
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kb: int = 65536
+    sqlite_mmap_size_mb: int = 256
+    # Off by default: SQLite never enforced the models' foreign keys before,
+    # so existing databases may hold rows that violate them
+    sqlite_foreign_keys: bool = False
+
+    # Chat message persistence: "sync" commits each turn in the request,
+    # "batched" queues turns for a background writer
+    message_persistence: str = "sync"
+    message_flush_interval_ms: int = 200
+    message_flush_batch_size: int = 500
+    message_flush_max_attempts: int = 5  # failed flushes before turns are written one at a time
+
+    # Cold storage: conversations idle longer than this are moved out of the
+    # messages table into zstd-compressed NDJSON files (0 = never archive)
+    conversation_archive_dir: str = "data/conversations"
+    conversation_archive_after_days: int = 30
+    conversation_archive_interval_seconds: int = 3600
+    conversation_archive_batch_size: int = 50  # conversations per transaction
+    conversation_archive_max_batches: int = 20  # per run
+    conversation_archive_batch_pause_ms: int = 250  # between batches
+    conversation_archive_zstd_level: int = 10
+
+    @property
+    def absolute_conversation_archive_dir(self) -> str:
+        import os
+        return os.path.abspath(self.conversation_archive_dir)
+
     @property
     def database_url(self) -> str:
         """Database URL – SQLite for local dev, Postgres for production"""
@@ -82,6 +235,29 @@ class Settings(BaseSettings):
         # SQLite async via aiosqlite
         return "sqlite+aiosqlite:///./solverai.db"
 
+    @property
+    def replica_database_urls(self) -> List[str]:
+        """Async URLs of the configured Postgres read replicas"""
+        if "postgresql" not in self.database_url or not self.postgres_replicas:
+            return []
+        urls = []
+        for replica in self.postgres_replicas.split(","):
+            host, _, port = replica.strip().partition(":")
+            urls.append(
+                f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}@{host}:{port or self.postgres_port}/{self.postgres_db}"
+            )
+        return urls
+
+    @property
+    def ollama_urls(self) -> List[str]:
+        """Ollama endpoints to route across"""
+        urls = [u.strip() for u in self.ollama_replicas.split(",") if u.strip()]
+        # Workaround for localhost resolution issues with httpx/Ollama
+        return [
+            u.rstrip("/").replace("localhost", "127.0.0.1")
+            for u in urls or [self.ollama_base_url]
+        ]
+
     @property
     def redis_url(self) -> str:
         """Redis connection URL"""
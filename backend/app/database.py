@@ -1,33 +1,203 @@
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql import Select
 from config import settings
+from services.deadline import check_deadline
+from typing import Dict
+import itertools
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
-# Create async engine
+is_sqlite = "sqlite" in settings.database_url
+# Split SQLite into one writer connection and a reader pool (file databases only)
+sqlite_split = (
+    is_sqlite
+    and settings.sqlite_profile == "production"
+    and ":memory:" not in settings.database_url
+)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection"""
+
+    label = "db"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        stats = pool_metrics[self.label]
+        try:
+            connection = super()._do_get()
+        except Exception:
+            # Not a checkout, so it stays out of the wait averages
+            stats["timeouts"] += 1
+            raise
+        waited = time.perf_counter() - start
+        stats["checkouts"] += 1
+        stats["wait_seconds_total"] += waited
+        stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+        return connection
+
+
+pool_metrics: Dict[str, dict] = {}
+
+
+def _timed_pool(label: str):
+    """Pool class bound to a metrics label"""
+    pool_metrics[label] = {
+        "checkouts": 0,
+        "timeouts": 0,
+        "wait_seconds_total": 0.0,
+        "wait_seconds_max": 0.0,
+    }
+    return type(f"TimedQueuePool_{label}", (TimedQueuePool,), {"label": label})
+
+
+def _postgres_pool_kwargs() -> dict:
+    """
+    Pool sizing for one Postgres server
+
+    Unless set explicitly, each uvicorn worker gets an equal share of the
+    server's max_connections, half kept open and half as overflow.
+    """
+    if settings.db_pool_size:
+        pool_size, max_overflow = settings.db_pool_size, settings.db_max_overflow
+    else:
+        budget = max(2, settings.postgres_max_connections // max(1, settings.web_concurrency))
+        pool_size = max(1, budget // 2)
+        max_overflow = budget - pool_size
+    return {
+        "pool_pre_ping": True,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "connect_args": {
+            # SQLAlchemy's per-connection prepared statement cache
+            "prepared_statement_cache_size": settings.postgres_statement_cache_size,
+            # asyncpg's own cache; set both to 0 behind pgbouncer transaction pooling
+            "statement_cache_size": settings.postgres_statement_cache_size,
+        },
+    }
+
+
 # Create async engine
 engine_kwargs = {
     "echo": settings.debug,
     "future": True,
 }
 
-if "sqlite" not in settings.database_url:
-    engine_kwargs.update({
-        "pool_pre_ping": True,
-        "pool_size": 10,
-        "max_overflow": 20,
-    })
+if not is_sqlite:
+    engine_kwargs.update(_postgres_pool_kwargs())
+    engine_kwargs["poolclass"] = _timed_pool("primary")
+
+if sqlite_split:
+    # All writes share one connection, so SQLite never sees competing writers
+    write_engine_kwargs = {
+        **engine_kwargs,
+        "poolclass": _timed_pool("sqlite_writer"),
+        "pool_size": 1,
+        "max_overflow": 0,
+    }
+    read_engine_kwargs = {
+        **engine_kwargs,
+        "poolclass": _timed_pool("sqlite_reader"),
+        "pool_size": settings.sqlite_reader_pool_size,
+        "max_overflow": settings.sqlite_reader_pool_size,
+    }
+else:
+    write_engine_kwargs = engine_kwargs
+    read_engine_kwargs = None
 
 engine = create_async_engine(
     settings.database_url,
-    **engine_kwargs
+    **write_engine_kwargs
+)
+read_engine = (
+    create_async_engine(settings.database_url, **read_engine_kwargs)
+    if read_engine_kwargs
+    else engine
 )
 
+# Postgres read replicas, used only by get_read_db (replication lag makes
+# them unsuitable for the read-then-write path of /chat)
+replica_engines = [
+    create_async_engine(
+        url,
+        **{**engine_kwargs, "poolclass": _timed_pool(f"replica_{idx}")},
+    )
+    for idx, url in enumerate(settings.replica_database_urls)
+]
+
+
+def _apply_sqlite_pragmas(dbapi_connection, query_only: bool):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    if settings.sqlite_foreign_keys:
+        cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    # Negative cache_size is in KiB
+    cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_kb}")
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size_mb * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if query_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if sqlite_split:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_writer_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection, query_only=False)
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_reader_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection, query_only=True)
+
+
+def _check_deadline_before_read(conn, cursor, statement, parameters, context, executemany):
+    # Reads for a request that has given up are skipped; writes (e.g. a
+    # finished turn) still go through
+    if statement.lstrip()[:6].upper() == "SELECT":
+        check_deadline("database query")
+
+
+for _engine in {engine, read_engine, *replica_engines}:
+    event.listen(_engine.sync_engine, "before_cursor_execute", _check_deadline_before_read)
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to the read engine and everything else to the writer
+
+    Once a transaction has written, its later reads also go to the writer so
+    they see their own uncommitted changes. With a single engine both
+    routes are the same.
+    """
+
+    _wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if read_engine is engine:
+            return engine.sync_engine
+        if self._wrote or self._flushing or not isinstance(clause, Select):
+            self._wrote = True
+            return engine.sync_engine
+        return read_engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_write_route(session, transaction):
+    if transaction.parent is None:
+        session._wrote = False
+
+
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
-    engine,
     class_=AsyncSession,
+    sync_session_class=RoutingSession,
     expire_on_commit=False,
     autocommit=False,
     autoflush=False,
@@ -47,13 +217,153 @@ async def get_db():
             await session.close()
 
 
+_replica_sessions = itertools.cycle(
+    [
+        async_sessionmaker(
+            replica,
+            class_=AsyncSession,
+            expire_on_commit=False,
+            autoflush=False,
+        )
+        for replica in replica_engines
+    ]
+    or [None]
+)
+
+
+async def get_read_db():
+    """
+    Dependency for read-only endpoints
+
+    Round-robins over Postgres replicas when configured; otherwise behaves
+    like get_db (whose SELECTs already go to the SQLite reader pool).
+    """
+    factory = next(_replica_sessions)
+    if factory is None:
+        async for session in get_db():
+            yield session
+        return
+
+    async with factory() as session:
+        try:
+            yield session
+        finally:
+            await session.rollback()
+            await session.close()
+
+
+def get_pool_metrics() -> Dict[str, dict]:
+    """Connection pool wait-time metrics and current usage per engine"""
+    engines = {"sqlite_writer" if sqlite_split else "primary": engine}
+    if read_engine is not engine:
+        engines["sqlite_reader"] = read_engine
+    engines.update({f"replica_{idx}": e for idx, e in enumerate(replica_engines)})
+
+    metrics = {}
+    for label, eng in engines.items():
+        stats = dict(pool_metrics.get(label, {}))
+        if stats.get("checkouts"):
+            stats["wait_seconds_avg"] = stats["wait_seconds_total"] / stats["checkouts"]
+        pool = eng.pool
+        if hasattr(pool, "checkedout"):
+            stats.update(
+                {
+                    "size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "overflow": pool.overflow(),
+                }
+            )
+        metrics[label] = stats
+    return metrics
+
+
+# Columns added to models after their table was first released. create_all
+# only creates missing tables, so _sync_schema adds these to existing tables,
+# always as nullable columns without defaults; init_db backfills the ones
+# whose NULL would be wrong. Anything else missing from an existing table
+# stops startup rather than being guessed at.
+SCHEMA_ADDITIONS = {
+    # Listing summary (init_db recomputes them from the messages)
+    ("conversations", "message_count"),
+    ("conversations", "last_message_at"),
+    ("conversations", "last_message_preview"),
+    ("conversations", "token_total"),
+    # NULL = not archived
+    ("conversations", "archived_at"),
+    # NULL = embedded before index generations were tracked
+    ("documents", "index_generation"),
+    ("documents", "embedding_model"),
+    # init_db sets existing documents to 'default'
+    ("documents", "collection"),
+    # NULL = search every collection
+    ("batch_items", "collections"),
+    # NULL = no lease, so a running job is claimable by any worker
+    ("batch_jobs", "lease_owner"),
+    ("batch_jobs", "lease_expires_at"),
+}
+
+
+def _sync_schema(connection, metadata):
+    """
+    Add missing SCHEMA_ADDITIONS columns and indexes to existing tables (run via run_sync)
+
+    Returns:
+        The (table, column) pairs added
+
+    Raises:
+        RuntimeError: An existing table lacks a model column not in SCHEMA_ADDITIONS
+    """
+    inspector = inspect(connection)
+    missing = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        missing.extend((table, col) for col in table.columns if col.name not in existing)
+
+    unknown = [
+        f"{table.name}.{col.name}"
+        for table, col in missing
+        if (table.name, col.name) not in SCHEMA_ADDITIONS
+    ]
+    if unknown:
+        raise RuntimeError(
+            f"Database is missing columns {', '.join(unknown)} with no migration in "
+            "SCHEMA_ADDITIONS; add them there (with a backfill in init_db if NULL is "
+            "not a valid value) or alter the tables by hand"
+        )
+
+    added = []
+    for table, col in missing:
+        col_type = col.type.compile(dialect=connection.dialect)
+        connection.execute(
+            text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}")
+        )
+        added.append((table.name, col.name))
+        logger.info(f"Added column {table.name}.{col.name}")
+
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    return added
+
+
 async def init_db():
     """Initialize database tables"""
     from models.base import Base
-    from models import conversation, document  # noqa: F401
+    from models import batch, conversation, document, index_generation  # noqa: F401
+
+    from services.message_writer import backfill_conversation_summaries
+    from services.search_service import ensure_search_index
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(_sync_schema, Base.metadata)
+        if ("conversations", "message_count") in added:
+            await conn.run_sync(backfill_conversation_summaries)
+        if ("documents", "collection") in added:
+            await conn.execute(text("UPDATE documents SET collection = 'default'"))
+        await conn.run_sync(ensure_search_index)
 
     logger.info("Database tables created successfully")
 
@@ -61,4 +371,8 @@ async def init_db():
 async def close_db():
     """Close database connections"""
     await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
     logger.info("Database connections closed")
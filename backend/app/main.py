@@ -5,28 +5,60 @@ from fastapi import (
     UploadFile,
     File,
     Form,
-    BackgroundTasks,
+    WebSocket,
+    WebSocketDisconnect,
+    Response,
+    Header,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func, select, and_, or_
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+from dataclasses import dataclass
 import uuid
 from datetime import datetime
+import asyncio
+import base64
+import hashlib
+import json
 import logging
 import os
 
 from config import settings
-from database import init_db, close_db, get_db
+from database import (
+    AsyncSessionLocal,
+    init_db,
+    close_db,
+    get_db,
+    get_read_db,
+    get_pool_metrics,
+)
 from models.conversation import Conversation, Message
 from models.document import Document
-from services.llm_service import llm_service
-from services.rag_service import rag_service
+from services.llm_service import llm_service, SYSTEM_PROMPT
+from services.rag_service import IndexSpec, rag_service
 from services.document_service import document_service
+from services.ingestion_service import ingestion_service, SUPPORTED_EXTENSIONS
 from services.voice_service import voice_service
+from services.transcription_pool import TranscriptionQueueFull
+from services.model_client import ModelServerError, close_model_client, model_server_stats
+from services.synthesis_pool import SentenceSplitter, SynthesisUnavailable, speakable, wav_header
+from services.stage_timing import StageTimings
+from services.message_writer import message_writer
+from services.search_service import search_messages
+from services.archive_service import archive_service
+from services.batch_service import batch_service
+from services.agents import agent_runtime
+from services.deadline import DeadlineExceeded, DeadlineMiddleware, deadline_scope, without_deadline
+from services.generation_buffer import generation_manager, parse_last_event_id
+from services.index_rebuild import IndexJobRunning, index_rebuild_service
+from services.vector_store import DEFAULT_COLLECTION, validate_collection
+from models.batch import BatchJob
+from models.index_generation import IndexGeneration
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -40,11 +72,25 @@ async def lifespan(app_instance: FastAPI):
     logger.info("Starting AI Companion API...")
     await init_db()
     logger.info("Database initialized")
+    await index_rebuild_service.recover()
+    await voice_service.start()
+    await message_writer.start()
+    await archive_service.start()
+    await batch_service.start()
+    await agent_runtime.start()
 
     yield
 
     # Shutdown
     logger.info("Shutting down AI Companion API...")
+    await voice_service.shutdown()
+    await generation_manager.shutdown()
+    await archive_service.stop()
+    await batch_service.stop()
+    await index_rebuild_service.stop()
+    await agent_runtime.stop()
+    await message_writer.stop()
+    close_model_client()
     await close_db()
 
 
@@ -54,6 +100,13 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Request deadlines; added before CORS so its 504s still get CORS headers.
+# Long uploads/ingestion and followed streams are exempt
+app.add_middleware(
+    DeadlineMiddleware,
+    exempt_prefixes=("/upload", "/documents/", "/batch/", "/chat/streams/"),
+)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -64,12 +117,33 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(ModelServerError)
+async def model_server_error_handler(request, exc: ModelServerError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.exception_handler(SynthesisUnavailable)
+async def synthesis_unavailable_handler(request, exc: SynthesisUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 # Request/Response Models
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
     stream: bool = False
     document_ids: Optional[List[str]] = None
+    # Only search these collections (workspaces); all when omitted
+    collections: Optional[List[str]] = None
+    # Identifies retries of the same request (same as the Idempotency-Key header)
+    request_id: Optional[str] = None
+    # Let the model call tools (document search, Python) before answering
+    agent: bool = False
 
 
 class SourceDocument(BaseModel):
@@ -84,6 +158,7 @@ class ChatResponse(BaseModel):
     conversation_id: str
     timestamp: str
     sources: Optional[List[SourceDocument]] = None
+    tool_calls: Optional[List[dict]] = None
 
 
 class ConversationResponse(BaseModel):
@@ -106,15 +181,63 @@ class DocumentResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     ingested_at: Optional[datetime]
+    index_generation: Optional[int] = None
+    embedding_model: Optional[str] = None
+    collection: Optional[str] = None
 
     class Config:
         from_attributes = True
 
 
+class BulkIngestResponse(BaseModel):
+    total: int
+    ready: int
+    failed: int
+    skipped: int
+    document_ids: List[str]
+
+
+class BatchJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime]
+
+
+class IndexRebuildRequest(BaseModel):
+    # Default to the current settings
+    embedding_model: Optional[str] = None
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+    activate: bool = True
+
+
+class IndexGenerationResponse(BaseModel):
+    generation: int
+    status: str
+    live: bool
+    embedding_model: str
+    chunk_size: int
+    chunk_overlap: int
+    total_documents: int
+    processed_documents: int
+    failed_documents: int
+    chunk_count: int
+    error: Optional[str]
+    created_at: datetime
+    finished_at: Optional[datetime]
+    activated_at: Optional[datetime]
+    retired_at: Optional[datetime]
+
+
 class TranscriptionResponse(BaseModel):
     text: str
     language: Optional[str]
     duration_seconds: Optional[float]
+    real_time_factor: Optional[float] = None
 
 
 class SpeechRequest(BaseModel):
@@ -142,189 +265,663 @@ async def health_check():
         "services": {
             "api": "running",
             "ollama": "available" if ollama_status else "unavailable",
+            "ollama_replicas": llm_service.ollama_router.status(),
             "fallback": "openai" if settings.openai_api_key else "none",
         },
     }
 
 
-@app.post("/chat")
-async def chat(
-    request: ChatRequest,
-    db: AsyncSession = Depends(get_db),
-):
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics for capacity tuning"""
+    return {
+        "database": get_pool_metrics(),
+        "ollama": llm_service.ollama_router.status(),
+        "llm_cascade": llm_service.cascade.stats(),
+        "agents": agent_runtime.stats(),
+        "retrieval_cache": rag_service.cache_stats(),
+        "index": index_rebuild_service.stats(),
+        "model_server": await asyncio.to_thread(model_server_stats),
+    }
+
+
+@dataclass
+class ChatTurn:
+    """Everything generation needs for one chat turn"""
+    conversation_id: str
+    messages: List[dict]
+    context: Optional[str]
+    sources: List[SourceDocument]
+    backend: Optional[str]
+    timings: StageTimings
+    user_message: dict
+    new_title: Optional[str] = None
+    tool_calls: Optional[List[dict]] = None
+
+
+def source_documents(docs) -> List[SourceDocument]:
+    return [
+        SourceDocument(
+            document_id=doc.metadata.get("document_id"),
+            chunk_index=doc.metadata.get("chunk_index"),
+            source_path=doc.metadata.get("source"),
+            preview=doc.page_content[:200],
+        )
+        for doc in docs
+    ]
+
+
+async def prepare_chat_turn(
+    db: AsyncSession,
+    message: str,
+    conversation_id: Optional[str] = None,
+    document_ids: Optional[List[str]] = None,
+    collections: Optional[List[str]] = None,
+    window: Optional[List[dict]] = None,
+    retrieved: Optional[tuple] = None,
+) -> ChatTurn:
     """
-    Chat endpoint with LLM integration
+    Shared first half of a chat turn
 
-    Supports both streaming and non-streaming responses
+    Runs three independent stages concurrently: conversation/history load
+    on the DB session, RAG retrieval off the event loop, and LLM backend
+    selection. Nothing is written here: the conversation row and user
+    message are persisted with the assistant reply by `save_assistant_message`,
+    so no DB write sits in front of the first token.
+
+    Callers that keep per-connection state can pass the conversation's
+    `window` (its messages as role/content dicts) and a previous turn's
+    `retrieved` (context, sources) to skip the history and retrieval stages.
     """
-    try:
-        # Get or create conversation
-        conv_id = request.conversation_id or str(uuid.uuid4())
+    timings = StageTimings()
+    conv_id = conversation_id or str(uuid.uuid4())
 
-        # Fetch existing conversation or create new one
+    async def load_history():
+        if window is not None:
+            return window
+        await message_writer.flush_conversation(conv_id)
         result = await db.execute(
             select(Conversation).where(Conversation.id == conv_id)
         )
         conversation = result.scalar_one_or_none()
-
         if not conversation:
-            conversation = Conversation(
-                id=conv_id,
-                title=request.message[:50] + "..." if len(request.message) > 50 else request.message,
+            return None
+        if conversation.archived_at is not None:
+            history = await archive_service.rehydrate(conv_id)
+        else:
+            result = await db.execute(
+                select(Message)
+                .where(Message.conversation_id == conv_id)
+                .order_by(Message.created_at)
             )
-            db.add(conversation)
-            await db.flush()
-
-        # Get conversation history
-        result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conv_id)
-            .order_by(Message.created_at)
+            history = result.scalars().all()
+        return [{"role": msg.role, "content": msg.content} for msg in history]
+
+    async def retrieve():
+        if not settings.rag_enabled or retrieved is not None:
+            return []
+        return await asyncio.to_thread(
+            rag_service.retrieve, message, document_ids=document_ids, collections=collections
         )
-        history = result.scalars().all()
 
-        # Store user message
-        user_message = Message(
-            conversation_id=conv_id,
-            role="user",
-            content=request.message,
+    history, docs, backend = await asyncio.gather(
+        timings.run("history", load_history()),
+        timings.run("retrieval", retrieve()),
+        timings.run("backend", llm_service.select_backend()),
+    )
+
+    # Format messages for LLM (copies, since context is injected in place)
+    messages = [dict(msg) for msg in history or []]
+    messages.append({"role": "user", "content": message})
+
+    # Add system message if first message
+    if len(messages) == 1:
+        messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+
+    context, context_sources = retrieved if retrieved is not None else (None, [])
+    if docs:
+        context = "\n".join([doc.page_content for doc in docs])
+        context_sources = source_documents(docs)
+        logger.info(
+            "Retrieved %s documents for context (filtered=%s)",
+            len(docs),
+            bool(document_ids),
         )
-        db.add(user_message)
-        await db.flush()
-
-        # Format messages for LLM
-        messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in history
-        ]
-        messages.append({"role": "user", "content": request.message})
-
-        # Add system message if first message
-        if len(messages) == 1:
-            messages.insert(
-                0,
-                {
-                    "role": "system",
-                    "content": """You are SolverAI, a helpful and knowledgeable assistant.
 
-IMPORTANT FORMATTING RULES - Follow these exactly:
-1. Always put a blank line before and after headings
-2. Always put a blank line before lists
-3. Always put a blank line between paragraphs
-4. Use **bold** for key terms
-5. Use numbered lists (1. 2. 3.) for steps
-6. Use bullet points (- or *) for non-sequential items
-7. Keep responses well-organized and easy to read
+    timings.mark("prepare")
+    return ChatTurn(
+        conversation_id=conv_id,
+        messages=messages,
+        context=context,
+        sources=context_sources,
+        backend=backend,
+        timings=timings,
+        user_message={"role": "user", "content": message, "created_at": datetime.utcnow()},
+        new_title=None if history is not None else (message[:50] + "..." if len(message) > 50 else message),
+    )
 
-Example of good formatting:
 
-## Main Topic
+async def save_assistant_message(
+    db: AsyncSession,
+    turn: ChatTurn,
+    content: str,
+    cancelled: bool = False,
+    error: Optional[str] = None,
+):
+    """
+    Persist the whole turn (new conversation, user and assistant messages)
 
-Here is an introductory paragraph explaining the concept.
+    `cancelled` or `error` mark a partial reply that stopped early.
+    """
+    meta = {"sources": [source.model_dump() for source in turn.sources]}
+    if cancelled:
+        meta["cancelled"] = True
+    if error:
+        meta["error"] = error
+    if turn.tool_calls:
+        meta["tool_calls"] = turn.tool_calls
+    assistant_message = {
+        "role": "assistant",
+        "content": content,
+        "created_at": datetime.utcnow(),
+        "meta": meta,
+    }
+    await message_writer.save_turn(
+        db,
+        turn.conversation_id,
+        [turn.user_message, assistant_message],
+        title=turn.new_title,
+    )
 
-### Key Points
 
-1. **First point** - explanation here
-2. **Second point** - explanation here
-3. **Third point** - explanation here
+def chat_stream_response(generation_id: str, meta: dict, after: int = -1, headers: Optional[dict] = None):
+    """SSE response replaying a generation's tokens after `after`, then its live tail"""
+    return StreamingResponse(
+        generation_manager.sse(generation_id, after=after),
+        media_type="text/event-stream",
+        headers={
+            "X-Generation-Id": generation_id,
+            "X-Conversation-Id": meta.get("conversation_id", ""),
+            **(headers or {}),
+        },
+    )
 
-### Additional Information
 
-- Bullet point one
-- Bullet point two
+@app.post("/chat")
+async def chat(
+    request: ChatRequest,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Chat endpoint with LLM integration
 
-This is a concluding paragraph.
+    Supports both streaming and non-streaming responses. Streamed
+    generations keep running if the client disconnects: reconnect with
+    Last-Event-ID (here or at /chat/streams/{generation_id}) to receive the
+    missed tokens. Retries with the same Idempotency-Key/request_id, or of
+    the same message in a conversation whose generation is still running,
+    attach to that generation instead of starting another one.
+    """
+    try:
+        stream_key = None
+        keep_key = True
+        if request.stream:
+            stream_key = idempotency_key or request.request_id
+            if not stream_key and request.conversation_id:
+                digest = hashlib.sha256(request.message.encode()).hexdigest()[:16]
+                stream_key = f"{request.conversation_id}:{digest}"
+                keep_key = False
+
+            existing = await generation_manager.find(stream_key) if stream_key else None
+            if existing:
+                resume_id, after = parse_last_event_id(last_event_id)
+                return chat_stream_response(
+                    existing,
+                    await generation_manager.meta(existing) or {},
+                    after=after if resume_id == existing else -1,
+                )
 
-Always follow this structure with proper line breaks.""",
-                },
-            )
+        turn = await prepare_chat_turn(
+            db,
+            request.message,
+            conversation_id=request.conversation_id,
+            document_ids=request.document_ids,
+            collections=request.collections,
+        )
 
-        # Retrieve context if RAG is enabled
-        context = None
-        context_sources: List[SourceDocument] = []
-        if settings.rag_enabled:
-            docs = rag_service.retrieve(
-                request.message, document_ids=request.document_ids
+        use_agent = request.agent and agent_runtime.enabled
+
+        async def run_agent() -> str:
+            result = await agent_runtime.run(
+                turn.messages,
+                context=turn.context,
+                backend=turn.backend,
+                affinity_key=turn.conversation_id,
+                document_ids=request.document_ids,
+                collections=request.collections,
+                timings=turn.timings,
             )
-            if docs:
-                context = "\n".join([doc.page_content for doc in docs])
-                context_sources = [
-                    SourceDocument(
-                        document_id=doc.metadata.get("document_id"),
-                        chunk_index=doc.metadata.get("chunk_index"),
-                        source_path=doc.metadata.get("source"),
-                        preview=doc.page_content[:200],
-                    )
-                    for doc in docs
-                ]
-                logger.info(
-                    "Retrieved %s documents for context (filtered=%s)",
-                    len(docs),
-                    bool(request.document_ids),
-                )
+            turn.sources.extend(source_documents(result.documents))
+            turn.tool_calls = [r.trace() for r in result.tool_results]
+            return result.answer
 
         # Generate response
         if request.stream:
-            # Return streaming response
-            async def generate_stream():
-                full_response = ""
-                stream_gen = await llm_service.generate_response(messages, stream=True, context=context)
-                async for chunk in stream_gen:
-                    full_response += chunk
-                    yield f"data: {chunk}\n\n"
-
-                # Store complete response in database
-                assistant_message = Message(
-                    conversation_id=conv_id,
-                    role="assistant",
-                    content=full_response,
-                    meta={"sources": [source.model_dump() for source in context_sources]},
+            async def tokens():
+                if use_agent:
+                    # Tool steps aren't streamed; the answer arrives in one piece
+                    turn.timings.mark("first_token")
+                    yield await run_agent()
+                    return
+                stream_gen = await llm_service.generate_response(
+                    turn.messages,
+                    stream=True,
+                    context=turn.context,
+                    backend=turn.backend,
+                    affinity_key=turn.conversation_id,
                 )
-                db.add(assistant_message)
-                await db.commit()
-
-                yield "data: [DONE]\n\n"
+                async for chunk in stream_gen:
+                    if "first_token" not in turn.timings.durations:
+                        turn.timings.mark("first_token")
+                    yield chunk
+
+            async def on_complete(full_response: str, error: Optional[str]):
+                # The request's session may be gone if the client disconnected
+                async with AsyncSessionLocal() as session:
+                    await turn.timings.run(
+                        "persist",
+                        save_assistant_message(session, turn, full_response, error=error),
+                    )
+                logger.info(f"Chat stages: {turn.timings.summary()}")
 
-            return StreamingResponse(
-                generate_stream(),
-                media_type="text/event-stream",
+            meta = {"conversation_id": turn.conversation_id}
+            generation_id, reused = await generation_manager.start(
+                tokens(), on_complete, meta, key=stream_key, keep_key=keep_key
+            )
+            return chat_stream_response(
+                generation_id,
+                meta,
+                headers=None if reused else {"Server-Timing": turn.timings.server_timing()},
             )
         else:
             # Get complete response
-            llm_response = await llm_service.generate_response(messages, stream=False, context=context)
+            if use_agent:
+                llm_response = await run_agent()
+            else:
+                llm_response = await turn.timings.run(
+                    "generate",
+                    llm_service.generate_response(
+                        turn.messages,
+                        stream=False,
+                        context=turn.context,
+                        backend=turn.backend,
+                        affinity_key=turn.conversation_id,
+                    ),
+                )
 
             # Ensure we have a string response
             if not isinstance(llm_response, str):
                 raise Exception("Expected string response from LLM")
 
             # Store assistant response
-            assistant_message = Message(
-                conversation_id=conv_id,
-                role="assistant",
-                content=llm_response,
-                meta={"sources": [source.model_dump() for source in context_sources]},
+            await turn.timings.run(
+                "persist", save_assistant_message(db, turn, llm_response)
             )
-            db.add(assistant_message)
-            await db.commit()
+            logger.info(f"Chat stages: {turn.timings.summary()}")
+            response.headers["Server-Timing"] = turn.timings.server_timing()
 
             return ChatResponse(
                 response=llm_response,
-                conversation_id=conv_id,
+                conversation_id=turn.conversation_id,
                 timestamp=datetime.now().isoformat(),
-                sources=context_sources or None,
+                sources=turn.sources or None,
+                tool_calls=turn.tool_calls,
             )
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _batch_job_response(job: BatchJob) -> BatchJobResponse:
+    return BatchJobResponse(
+        job_id=job.id,
+        status=job.status,
+        total=job.total,
+        completed=job.completed,
+        failed=job.failed,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    )
+
+
+@app.post("/batch/chat", response_model=BatchJobResponse)
+async def create_batch_job(
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Queue an offline chat job
+
+    The file is JSONL with one {"message", "document_ids"?, "collections"?, "id"?}
+    object per line. Items run at lower priority than interactive chats; fetch results
+    from /batch/{job_id}/results.
+    """
+    try:
+        items = batch_service.parse_jsonl(await file.read())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = await batch_service.submit(db, items)
+    return _batch_job_response(job)
+
+
+@app.get("/batch/{job_id}", response_model=BatchJobResponse)
+async def get_batch_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Get batch job progress"""
+    job = await db.get(BatchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return _batch_job_response(job)
+
+
+@app.get("/batch/{job_id}/results")
+async def get_batch_results(
+    job_id: str,
+    follow: bool = False,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Stream finished results as JSONL in input order
+
+    With `follow=true` the response stays open and streams results as they
+    complete until the job is done.
+    """
+    if not await db.get(BatchJob, job_id):
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return StreamingResponse(
+        batch_service.stream_results(job_id, follow=follow),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get("/chat/streams/{generation_id}")
+async def resume_chat_stream(
+    generation_id: str,
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[int] = None,
+):
+    """
+    Resume a streamed generation
+
+    Replays tokens after the Last-Event-ID header (or the `after` sequence
+    number) and then follows the generation until it finishes.
+    """
+    meta = await generation_manager.meta(generation_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Generation not found or expired")
+
+    if after is None:
+        resume_id, after = parse_last_event_id(last_event_id)
+        if resume_id != generation_id:
+            after = -1
+    return chat_stream_response(generation_id, meta, after=after)
+
+
+@dataclass
+class ConversationWindow:
+    """A conversation as cached by one WebSocket connection"""
+    messages: List[dict]
+    context: Optional[str] = None
+    sources: Optional[List[SourceDocument]] = None
+
+
+class ChatConnection:
+    """
+    State for one /chat/ws connection
+
+    Turns for any number of conversations run concurrently as tasks (at most
+    `chat_ws_max_turns`, one per conversation). Their frames go through a
+    bounded queue drained by a single sender, so a slow client pauses token
+    consumption and, through it, the upstream Ollama stream. The connection
+    keeps its own DB session and, per conversation, the message window and
+    last retrieved context, so follow-up turns skip the history load (and,
+    on request, retrieval).
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.db = AsyncSessionLocal()
+        self._db_lock = asyncio.Lock()
+        self.windows: "OrderedDict[str, ConversationWindow]" = OrderedDict()
+        self.turns: dict = {}
+        self.busy_conversations: set = set()
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.chat_ws_send_queue)
+        self.closed = False
+
+    async def send(self, frame: dict):
+        if not self.closed:
+            await self._outbox.put(frame)
+
+    async def sender(self):
+        while True:
+            await self.websocket.send_json(await self._outbox.get())
+
+    @asynccontextmanager
+    async def session(self):
+        """The connection's DB session, used by one turn at a time"""
+        async with self._db_lock:
+            try:
+                yield self.db
+            finally:
+                # Release the pooled connection and drop cached rows between uses
+                await self.db.close()
+
+    def _remember(self, conversation_id: str, window: ConversationWindow):
+        self.windows[conversation_id] = window
+        self.windows.move_to_end(conversation_id)
+        while len(self.windows) > settings.chat_ws_cached_conversations:
+            self.windows.popitem(last=False)
+
+    async def start_turn(self, data: dict):
+        turn_id = str(data.get("id") or uuid.uuid4())
+        message = data.get("message")
+        conversation_id = data.get("conversation_id")
+        if not isinstance(message, str) or not message.strip():
+            await self.send({"type": "error", "id": turn_id, "detail": "Expected a non-empty 'message'"})
+        elif turn_id in self.turns:
+            await self.send({"type": "error", "id": turn_id, "detail": "Turn id already in flight"})
+        elif len(self.turns) >= settings.chat_ws_max_turns:
+            await self.send({"type": "error", "id": turn_id, "detail": "Too many turns in flight"})
+        elif conversation_id and conversation_id in self.busy_conversations:
+            await self.send(
+                {"type": "error", "id": turn_id, "detail": "Conversation already has a turn in flight"}
+            )
+        else:
+            conversation_id = conversation_id or str(uuid.uuid4())
+            self.busy_conversations.add(conversation_id)
+            task = asyncio.create_task(self._run_turn(turn_id, conversation_id, data))
+            self.turns[turn_id] = task
+            task.add_done_callback(lambda _: self._finish_turn(turn_id, conversation_id))
+
+    def _finish_turn(self, turn_id: str, conversation_id: str):
+        self.turns.pop(turn_id, None)
+        self.busy_conversations.discard(conversation_id)
+
+    def cancel_turn(self, turn_id: str):
+        task = self.turns.get(turn_id)
+        if task:
+            task.cancel()
+
+    async def _run_turn(self, turn_id: str, conversation_id: str, data: dict):
+        # Each turn gets the budget an HTTP request would
+        with deadline_scope(settings.request_deadline_seconds):
+            await self._run_turn_steps(turn_id, conversation_id, data)
+
+    async def _run_turn_steps(self, turn_id: str, conversation_id: str, data: dict):
+        cached = self.windows.get(conversation_id)
+        document_ids = data.get("document_ids")
+        collections = data.get("collections")
+        retrieved = None
+        if data.get("reuse_context") and cached and cached.sources is not None:
+            retrieved = (cached.context, cached.sources)
+
+        answer = ""
+        turn = None
+        try:
+            if cached is not None:
+                turn = await prepare_chat_turn(
+                    self.db,
+                    data["message"],
+                    conversation_id=conversation_id,
+                    document_ids=document_ids,
+                    collections=collections,
+                    window=cached.messages,
+                    retrieved=retrieved,
+                )
+            else:
+                async with self.session() as db:
+                    turn = await prepare_chat_turn(
+                        db,
+                        data["message"],
+                        conversation_id=conversation_id,
+                        document_ids=document_ids,
+                        collections=collections,
+                        retrieved=retrieved,
+                    )
+            # Persisted messages only; the system prompt is re-added by the LLM call
+            window = [dict(msg) for msg in turn.messages if msg["role"] != "system"]
+
+            await self.send(
+                {
+                    "type": "start",
+                    "id": turn_id,
+                    "conversation_id": conversation_id,
+                    "sources": [source.model_dump() for source in turn.sources] or None,
+                }
+            )
+            stream = await llm_service.generate_response(
+                turn.messages,
+                stream=True,
+                context=turn.context,
+                backend=turn.backend,
+                affinity_key=conversation_id,
+            )
+            try:
+                async for token in stream:
+                    if not answer:
+                        turn.timings.mark("first_token")
+                    answer += token
+                    await self.send({"type": "token", "id": turn_id, "text": token})
+            finally:
+                # Closing the generator closes the HTTP stream, so Ollama stops generating
+                await stream.aclose()
+        except asyncio.CancelledError:
+            if answer:
+                await self._save_partial(turn, window, answer, cancelled=True)
+            logger.info(f"Chat turn {turn_id} cancelled after {len(answer)} chars")
+            await self.send({"type": "cancelled", "id": turn_id})
+            return
+        except Exception as e:
+            logger.error(f"Error in chat turn {turn_id}: {e}")
+            if answer:
+                await self._save_partial(turn, window, answer, error=str(e) or type(e).__name__)
+            await self.send({"type": "error", "id": turn_id, "detail": str(e)})
+            return
+
+        # A reply that streamed past the turn's deadline is still saved
+        with without_deadline():
+            async with self.session() as db:
+                await turn.timings.run("persist", save_assistant_message(db, turn, answer))
+        window.append({"role": "assistant", "content": answer})
+        self._remember(conversation_id, ConversationWindow(window, turn.context, turn.sources))
+        logger.info(f"Chat stages: {turn.timings.summary()}")
+        await self.send({"type": "done", "id": turn_id, "conversation_id": conversation_id})
+
+    async def _save_partial(self, turn: ChatTurn, window: List[dict], answer: str, **flags):
+        """Save a reply that stopped early and keep it in the cached window"""
+        try:
+            with without_deadline():
+                async with self.session() as db:
+                    await save_assistant_message(db, turn, answer, **flags)
+        except Exception as e:
+            logger.error(f"Saving partial reply for {turn.conversation_id} failed: {e}")
+            return
+        window.append({"role": "assistant", "content": answer})
+        self._remember(turn.conversation_id, ConversationWindow(window, turn.context, turn.sources))
+
+    async def close(self):
+        """Abort in-flight turns (saving their partial replies) and release the session"""
+        self.closed = True
+        for task in list(self.turns.values()):
+            task.cancel()
+        await asyncio.gather(*self.turns.values(), return_exceptions=True)
+        await self.db.close()
+
+
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Multiplexed chat over one WebSocket
+
+    The client sends JSON frames:
+      {"type": "chat", "id"?, "message", "conversation_id"?, "document_ids"?,
+       "collections"?, "reuse_context"?} starts a turn; {"type": "cancel", "id"} aborts one.
+    Every server frame carries the turn id: "start" (with conversation_id and
+    sources), "token" (text), then "done", "cancelled" or "error". Turns run
+    concurrently across conversations; a cancelled turn keeps the partial
+    reply it already sent.
+    """
+    await websocket.accept()
+    connection = ChatConnection(websocket)
+    sender = asyncio.create_task(connection.sender())
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                data = json.loads(message.get("text") or "")
+            except json.JSONDecodeError:
+                await connection.send({"type": "error", "detail": "Expected a JSON text frame"})
+                continue
+            if not isinstance(data, dict):
+                await connection.send({"type": "error", "detail": "Expected a JSON object"})
+            elif data.get("type") == "chat":
+                await connection.start_turn(data)
+            elif data.get("type") == "cancel":
+                connection.cancel_turn(str(data.get("id")))
+            else:
+                await connection.send({"type": "error", "detail": f"Unknown frame type {data.get('type')!r}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        logger.info("Chat socket client disconnected")
+        await connection.close()
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+
 @app.post("/upload", response_model=DocumentResponse)
 async def upload_document(
     file: UploadFile = File(...),
+    collection: Optional[str] = Form(None),
     db: AsyncSession = Depends(get_db),
 ):
-    """Upload a document for RAG ingestion"""
+    """Upload a document for RAG ingestion into a collection (default: "default")"""
+    try:
+        collection = validate_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     allowed_types = {"application/pdf", "text/plain"}
     ext = os.path.splitext(file.filename.lower())[-1]
     if file.content_type not in allowed_types and ext not in {".pdf", ".txt"}:
@@ -343,6 +940,7 @@ async def upload_document(
         stored_filename=stored_filename,
         storage_path=storage_path,
         content_type=file.content_type,
+        collection=collection,
         status="pending",
     )
     db.add(document)
@@ -357,10 +955,13 @@ async def upload_document(
         document.status = "processing"
         await db.commit()
 
-        chunks = await rag_service.ingest_file(saved_path, document.id)
+        chunks = await rag_service.ingest_file(saved_path, document.id, collection)
+        stamp = rag_service.index_stamp()
         document.chunk_count = chunks
         document.status = "ready"
         document.ingested_at = datetime.utcnow()
+        document.index_generation = stamp["index_generation"]
+        document.embedding_model = stamp["embedding_model"]
         document.error = None
         await db.commit()
     except Exception as e:
@@ -374,12 +975,117 @@ async def upload_document(
     return document
 
 
+@app.post("/documents/bulk", response_model=BulkIngestResponse)
+async def bulk_ingest_documents(
+    files: Optional[List[UploadFile]] = File(None),
+    directory: Optional[str] = Form(None),
+    recursive: bool = Form(True),
+    collection: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Ingest many documents at once
+
+    Accepts either uploaded files or a directory on the server (which must be
+    inside the documents directory). Already-registered paths are skipped.
+    All documents go into one collection (default: "default").
+    """
+    try:
+        collection = validate_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not files and not directory:
+        raise HTTPException(
+            status_code=400, detail="Provide files or a server-side directory"
+        )
+
+    items = []
+    if directory:
+        # Resolved first, so a symlink can't lead out of the documents directory
+        documents_dir = os.path.realpath(settings.absolute_documents_dir)
+        root = os.path.realpath(os.path.join(documents_dir, directory))
+        if os.path.commonpath([root, documents_dir]) != documents_dir:
+            raise HTTPException(
+                status_code=400,
+                detail="Directory must be inside the documents directory",
+            )
+        try:
+            discovered = await asyncio.to_thread(
+                ingestion_service.discover_files, root, recursive=recursive
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for item in discovered:
+            target = os.path.realpath(item["storage_path"])
+            if os.path.commonpath([target, documents_dir]) != documents_dir:
+                logger.warning(f"Skipping {item['storage_path']}: links outside the documents directory")
+                continue
+            items.append(item)
+
+    for file in files or []:
+        ext = os.path.splitext(file.filename.lower())[-1]
+        if ext not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported file format: {file.filename}. Only PDF and TXT are supported.",
+            )
+        document_id = str(uuid.uuid4())
+        stored_filename = document_service.build_stored_filename(document_id, file.filename)
+        saved_path, size_bytes = await document_service.save_upload(file, stored_filename)
+        items.append(
+            {
+                "id": document_id,
+                "original_filename": file.filename,
+                "stored_filename": stored_filename,
+                "storage_path": saved_path,
+                "content_type": file.content_type,
+                "size_bytes": size_bytes,
+            }
+        )
+
+    new_items = await ingestion_service.filter_new(db, items)
+    try:
+        counts = await ingestion_service.ingest(db, new_items, collection=collection)
+    except Exception as e:
+        logger.error(f"Error in bulk ingestion: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return BulkIngestResponse(
+        total=len(items),
+        ready=counts["ready"],
+        failed=counts["error"],
+        skipped=len(items) - len(new_items),
+        document_ids=[item["id"] for item in new_items],
+    )
+
+
+@app.get("/conversations/search")
+async def search_conversations(
+    q: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Full-text search over all messages, returning ranked snippets"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query is required")
+    try:
+        return await search_messages(db, q, limit=min(limit, 100), cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+
 @app.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: str,
     db: AsyncSession = Depends(get_db),
 ):
     """Get a specific conversation with all messages"""
+    # Read from the primary: the flush below and any rehydration write there,
+    # and a replica may not have caught up yet
+    await message_writer.flush_conversation(conversation_id)
     result = await db.execute(
         select(Conversation).where(Conversation.id == conversation_id)
     )
@@ -389,12 +1095,15 @@ async def get_conversation(
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     # Get messages
-    result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.created_at)
-    )
-    messages = result.scalars().all()
+    if conversation.archived_at is not None:
+        messages = await archive_service.rehydrate(conversation_id)
+    else:
+        result = await db.execute(
+            select(Message)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.created_at)
+        )
+        messages = result.scalars().all()
 
     return ConversationResponse(
         conversation_id=conversation.id,
@@ -416,29 +1125,72 @@ async def get_conversation(
 async def list_conversations(
     limit: int = 20,
     offset: int = 0,
-    db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """List all conversations"""
-    result = await db.execute(
-        select(Conversation)
-        .order_by(Conversation.updated_at.desc())
-        .limit(limit)
-        .offset(offset)
+    """
+    List conversations, most recently active first
+
+    Reads only the maintained summary columns. Pass `next_cursor` back as
+    `cursor` for keyset pagination (`offset` still works but scans).
+    """
+    stmt = (
+        select(
+            Conversation.id,
+            Conversation.title,
+            Conversation.created_at,
+            Conversation.updated_at,
+            Conversation.message_count,
+            Conversation.last_message_at,
+            Conversation.last_message_preview,
+            Conversation.token_total,
+            Conversation.archived_at,
+        )
+        .order_by(Conversation.last_message_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
     )
-    conversations = result.scalars().all()
+    if cursor:
+        try:
+            last_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            last_at = datetime.fromisoformat(last_at)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(
+            or_(
+                Conversation.last_message_at < last_at,
+                and_(Conversation.last_message_at == last_at, Conversation.id < last_id),
+            )
+        )
+    else:
+        stmt = stmt.offset(offset)
+
+    rows = (await db.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = base64.urlsafe_b64encode(
+            json.dumps([last.last_message_at.isoformat(), last.id]).encode()
+        ).decode()
 
     return {
         "conversations": [
             {
-                "conversation_id": conv.id,
-                "title": conv.title,
-                "created_at": conv.created_at.isoformat(),
-                "updated_at": conv.updated_at.isoformat(),
+                "conversation_id": row.id,
+                "title": row.title,
+                "created_at": row.created_at.isoformat(),
+                "updated_at": row.updated_at.isoformat(),
+                "message_count": row.message_count or 0,
+                "last_message_at": row.last_message_at.isoformat() if row.last_message_at else None,
+                "last_message_preview": row.last_message_preview,
+                "token_total": row.token_total or 0,
+                "archived": row.archived_at is not None,
             }
-            for conv in conversations
+            for row in rows
         ],
         "limit": limit,
         "offset": offset,
+        "next_cursor": next_cursor,
     }
 
 
@@ -448,6 +1200,7 @@ async def delete_conversation(
     db: AsyncSession = Depends(get_db),
 ):
     """Delete a conversation"""
+    await message_writer.flush_conversation(conversation_id)
     result = await db.execute(
         select(Conversation).where(Conversation.id == conversation_id)
     )
@@ -458,22 +1211,40 @@ async def delete_conversation(
 
     await db.delete(conversation)
     await db.commit()
+    archive_service.remove(conversation_id)
 
     return {"message": "Conversation deleted successfully"}
 
 
 @app.get("/documents", response_model=List[DocumentResponse])
 async def list_documents(
-    db: AsyncSession = Depends(get_db),
+    collection: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """List all uploaded documents"""
-    result = await db.execute(
-        select(Document).order_by(Document.created_at.desc())
-    )
+    """List uploaded documents, optionally of one collection"""
+    query = select(Document).order_by(Document.created_at.desc())
+    if collection:
+        query = query.where(Document.collection == collection)
+    result = await db.execute(query)
     docs = result.scalars().all()
     return docs
 
 
+@app.get("/collections")
+async def list_collections(db: AsyncSession = Depends(get_read_db)):
+    """Collections with their document counts and how many are in the live index"""
+    result = await db.execute(
+        select(Document.collection, func.count(Document.id))
+        .group_by(Document.collection)
+        .order_by(Document.collection)
+    )
+    indexed = await asyncio.to_thread(rag_service.collection_sizes)
+    return [
+        {"name": name, "documents": count, "indexed_documents": indexed.get(name, 0)}
+        for name, count in result.all()
+    ]
+
+
 @app.delete("/documents/{document_id}")
 async def delete_document_entry(
     document_id: str,
@@ -515,11 +1286,16 @@ async def reingest_document(
         await db.commit()
 
         rag_service.remove_document(document_id)
-        chunks = await rag_service.ingest_file(document.storage_path, document_id)
+        chunks = await rag_service.ingest_file(
+            document.storage_path, document_id, document.collection or DEFAULT_COLLECTION
+        )
+        stamp = rag_service.index_stamp()
 
         document.chunk_count = chunks
         document.status = "ready"
         document.ingested_at = datetime.utcnow()
+        document.index_generation = stamp["index_generation"]
+        document.embedding_model = stamp["embedding_model"]
         document.updated_at = datetime.utcnow()
         document.error = None
         await db.commit()
@@ -533,6 +1309,106 @@ async def reingest_document(
     return document
 
 
+def _index_generation_response(row: IndexGeneration) -> IndexGenerationResponse:
+    return IndexGenerationResponse(
+        generation=row.id,
+        status=row.status,
+        live=row.id == rag_service.index_generation,
+        embedding_model=row.embedding_model,
+        chunk_size=row.chunk_size,
+        chunk_overlap=row.chunk_overlap,
+        total_documents=row.total_documents or 0,
+        processed_documents=row.processed_documents or 0,
+        failed_documents=row.failed_documents or 0,
+        chunk_count=row.chunk_count or 0,
+        error=row.error,
+        created_at=row.created_at,
+        finished_at=row.finished_at,
+        activated_at=row.activated_at,
+        retired_at=row.retired_at,
+    )
+
+
+@app.post("/index/rebuild", response_model=IndexGenerationResponse)
+async def rebuild_index(request: IndexRebuildRequest):
+    """
+    Re-embed all ready documents into a new index generation in the background
+
+    The live index keeps serving until the new generation is built and
+    swapped in (unless `activate` is false); poll
+    /index/generations/{generation} for progress.
+    """
+    default = IndexSpec.from_settings()
+    spec = IndexSpec(
+        request.embedding_model or default.embedding_model,
+        request.chunk_size or default.chunk_size,
+        default.chunk_overlap if request.chunk_overlap is None else request.chunk_overlap,
+    )
+    if spec.chunk_size <= 0 or not 0 <= spec.chunk_overlap < spec.chunk_size:
+        raise HTTPException(
+            status_code=400, detail="chunk_overlap must be at least 0 and less than chunk_size"
+        )
+    try:
+        row = await index_rebuild_service.start_build(spec, activate=request.activate)
+    except IndexJobRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _index_generation_response(row)
+
+
+@app.get("/index/generations", response_model=List[IndexGenerationResponse])
+async def list_index_generations(
+    db: AsyncSession = Depends(get_read_db),
+):
+    """List index generations, newest first"""
+    result = await db.execute(select(IndexGeneration).order_by(IndexGeneration.id.desc()))
+    return [_index_generation_response(row) for row in result.scalars().all()]
+
+
+@app.get("/index/generations/{generation}", response_model=IndexGenerationResponse)
+async def get_index_generation(
+    generation: int,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Get an index generation's build progress and status"""
+    row = await db.get(IndexGeneration, generation)
+    if not row:
+        raise HTTPException(status_code=404, detail="Index generation not found")
+    return _index_generation_response(row)
+
+
+@app.post("/index/generations/{generation}/activate", response_model=IndexGenerationResponse)
+async def activate_index_generation(generation: int):
+    """Swap a ready generation in, first re-syncing documents changed since it was live"""
+    try:
+        row = await index_rebuild_service.start_activation(generation)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (IndexJobRunning, ValueError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _index_generation_response(row)
+
+
+@app.post("/index/rollback", response_model=IndexGenerationResponse)
+async def rollback_index():
+    """Swap back to the generation most recently replaced"""
+    try:
+        row = await index_rebuild_service.rollback()
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (IndexJobRunning, ValueError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _index_generation_response(row)
+
+
+@app.post("/index/cancel")
+async def cancel_index_job():
+    """Cancel the running rebuild or activation; the live index is unaffected"""
+    generation = await index_rebuild_service.cancel()
+    if generation is None:
+        raise HTTPException(status_code=404, detail="No index job is running")
+    return {"message": "Index job cancelled", "generation": generation}
+
+
 @app.post("/voice/transcribe", response_model=TranscriptionResponse)
 async def transcribe_audio(
     audio: UploadFile = File(...),
@@ -551,36 +1427,219 @@ async def transcribe_audio(
         with open(tmp_path, "wb") as f:
             f.write(contents)
 
-        text, detected_language, duration = await voice_service.transcribe(
-            tmp_path, language=language
-        )
+        result = await voice_service.transcribe(tmp_path, language=language)
         return TranscriptionResponse(
-            text=text,
-            language=language or detected_language,
-            duration_seconds=duration,
+            text=result.text,
+            language=language or result.language,
+            duration_seconds=result.duration,
+            real_time_factor=result.real_time_factor,
         )
+    except TranscriptionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     finally:
         voice_service.cleanup_audio(tmp_path)
 
 
-@app.post("/voice/speak")
-async def synthesize_speech(
-    request: SpeechRequest,
-    background_tasks: BackgroundTasks,
+@app.websocket("/voice/stream")
+async def stream_transcription(
+    websocket: WebSocket,
+    language: Optional[str] = None,
+    sample_rate: int = 16000,
 ):
-    """Convert text to speech locally"""
-    if not request.text.strip():
-        raise HTTPException(status_code=400, detail="Text is required for speech")
+    """
+    Streaming speech-to-text
 
-    audio_path = await voice_service.synthesize(
-        request.text.strip(), voice=request.voice
-    )
+    The client sends binary frames of 16-bit mono PCM as it records and a
+    text frame {"type": "end"} when done. The server pushes
+    {"type": "partial" | "final", "text", "start", "end"} messages and
+    {"type": "done"} after the last final transcript.
+    """
+    await websocket.accept()
+    transcriber = voice_service.create_stream(language=language, sample_rate=sample_rate)
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes"):
+                transcriber.feed(message["bytes"])
+                try:
+                    events = await transcriber.step()
+                except (TranscriptionQueueFull, DeadlineExceeded, ModelServerError) as e:
+                    # Audio stays buffered and is retried on a later step
+                    events = [{"type": "error", "detail": str(e)}]
+                for event in events:
+                    await websocket.send_json(event)
+            elif message.get("text"):
+                try:
+                    data = json.loads(message["text"])
+                except json.JSONDecodeError:
+                    continue
+                if data.get("type") == "end":
+                    for event in await transcriber.finish():
+                        await websocket.send_json(event)
+                    await websocket.send_json({"type": "done"})
+                    await websocket.close()
+                    break
+    except WebSocketDisconnect:
+        logger.info("Voice stream client disconnected")
+
+
+@app.post("/voice/chat")
+async def voice_chat(
+    audio: UploadFile = File(...),
+    conversation_id: Optional[str] = Form(None),
+    language: Optional[str] = Form(None),
+    voice: Optional[str] = Form(None),
+    document_ids: Optional[List[str]] = Form(None),
+    collections: Optional[List[str]] = Form(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    One voice turn: transcribe, chat and speak in a single pipelined stream
+
+    Returns server-sent events with JSON payloads:
+    {"type": "transcript"}, then interleaved {"type": "token"} and
+    {"type": "audio"} (a base64 WAV per sentence, in order), then
+    {"type": "done"}. Each sentence is sent to TTS as soon as the LLM
+    finishes it; a sentence TTS fails on is sent as {"type":
+    "speech_error"} with its text instead. The turn is persisted exactly
+    like /chat, including a partial reply if the stream stops early.
+    """
+    if audio.content_type and not audio.content_type.startswith("audio/"):
+        raise HTTPException(status_code=400, detail="File must be an audio format")
+
+    tmp_path = os.path.join(settings.absolute_audio_dir, f"voice_chat_{uuid.uuid4()}.tmp")
+    os.makedirs(settings.absolute_audio_dir, exist_ok=True)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(await audio.read())
+        transcription = await voice_service.transcribe(tmp_path, language=language)
+    except TranscriptionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    finally:
+        voice_service.cleanup_audio(tmp_path)
+
+    if not transcription.text:
+        raise HTTPException(status_code=400, detail="No speech detected")
+
+    try:
+        turn = await prepare_chat_turn(
+            db,
+            transcription.text,
+            conversation_id=conversation_id,
+            document_ids=document_ids,
+            collections=collections,
+        )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in voice chat endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-    background_tasks.add_task(voice_service.cleanup_audio, audio_path)
+    def event(payload: dict) -> str:
+        return f"data: {json.dumps(payload)}\n\n"
+
+    def audio_event(rendered) -> str:
+        params, frames = rendered
+        wav = wav_header(params, len(frames)) + frames
+        return event({"type": "audio", "data": base64.b64encode(wav).decode("ascii")})
+
+    async def generate_stream():
+        yield event(
+            {
+                "type": "transcript",
+                "text": transcription.text,
+                "language": transcription.language,
+                "conversation_id": turn.conversation_id,
+            }
+        )
+
+        splitter = SentenceSplitter()
+        pending: List[Tuple[str, asyncio.Task]] = []
+
+        def schedule(sentence: Optional[str]):
+            text = speakable(sentence or "")
+            if text:
+                pending.append(
+                    (text, asyncio.create_task(voice_service.synthesis_pool.render(text, voice)))
+                )
+
+        async def next_audio() -> str:
+            text, task = pending.pop(0)
+            try:
+                return audio_event(await task)
+            except Exception as e:
+                # The reply goes on without this sentence's audio
+                logger.warning(f"Speech synthesis failed for a sentence: {e}")
+                return event({"type": "speech_error", "text": text, "detail": str(e)})
+
+        full_response = ""
+        saved = False
+        error = None
+        try:
+            stream_gen = await llm_service.generate_response(
+                turn.messages,
+                stream=True,
+                context=turn.context,
+                backend=turn.backend,
+                affinity_key=turn.conversation_id,
+            )
+            async for chunk in stream_gen:
+                full_response += chunk
+                yield event({"type": "token", "text": chunk})
+                for sentence in splitter.feed(chunk):
+                    schedule(sentence)
+                # Emit finished audio in order without waiting on the LLM,
+                # unless TTS has fallen too far behind
+                while pending and (
+                    pending[0][1].done() or len(pending) > settings.voice_chat_max_pending_sentences
+                ):
+                    yield await next_audio()
+            schedule(splitter.flush())
+
+            with without_deadline():
+                await save_assistant_message(db, turn, full_response)
+            saved = True
+
+            while pending:
+                yield await next_audio()
+            yield event({"type": "done", "sources": [s.model_dump() for s in turn.sources]})
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            logger.error(f"Error in voice chat stream: {e}")
+            yield event({"type": "error", "detail": error})
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if not saved and full_response:
+                # Keep what was generated before the stream broke off or the client left
+                try:
+                    with without_deadline():
+                        await asyncio.shield(
+                            save_assistant_message(
+                                db, turn, full_response, cancelled=error is None, error=error
+                            )
+                        )
+                except Exception as e:
+                    logger.error(f"Saving partial voice reply failed: {e}")
+
+    return StreamingResponse(generate_stream(), media_type="text/event-stream")
+
+
+@app.post("/voice/speak")
+async def synthesize_speech(request: SpeechRequest):
+    """Convert text to speech locally, streaming audio sentence by sentence"""
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text is required for speech")
 
+    # Fail with 503 before streaming if the TTS engine isn't available
+    await voice_service.synthesis_pool.start()
     filename = f"synthesis_{uuid.uuid4()}.wav"
-    return FileResponse(
-        audio_path,
+    return StreamingResponse(
+        voice_service.synthesize_stream(request.text.strip(), voice=request.voice),
         media_type="audio/wav",
-        filename=filename,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -1,4 +1,6 @@
 from .conversation import Conversation, Message
 from .document import Document
+from .batch import BatchJob, BatchItem
+from .index_generation import IndexGeneration
 
-__all__ = ["Conversation", "Message", "Document"]
+__all__ = ["Conversation", "Message", "Document", "BatchJob", "BatchItem", "IndexGeneration"]
@@ -0,0 +1,55 @@
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Integer, JSON, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+import uuid
+from .base import Base
+
+
+class BatchJob(Base):
+    __tablename__ = "batch_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    status = Column(String, default="queued")  # queued, running, completed
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    # Worker currently processing the job; another worker may take it over
+    # once the lease expires without being renewed
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    # Relationship
+    items = relationship("BatchItem", back_populates="job", cascade="all, delete-orphan")
+
+    def __repr__(self):
+        return f"<BatchJob(id={self.id}, status={self.status})>"
+
+
+class BatchItem(Base):
+    __tablename__ = "batch_items"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, ForeignKey("batch_jobs.id", ondelete="CASCADE"), nullable=False)
+    position = Column(Integer, nullable=False)  # line number in the submitted JSONL
+    custom_id = Column(String, nullable=True)  # optional "id" from the input line
+    prompt = Column(Text, nullable=False)
+    document_ids = Column(JSON, nullable=True)
+    collections = Column(JSON, nullable=True)
+    status = Column(String, default="pending")  # pending, completed, error
+    response = Column(Text, nullable=True)
+    sources = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    # Relationship
+    job = relationship("BatchJob", back_populates="items")
+
+    __table_args__ = (
+        Index("ix_batch_items_job_position", "job_id", "position", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<BatchItem(job_id={self.job_id}, position={self.position}, status={self.status})>"
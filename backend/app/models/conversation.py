@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Integer, JSON
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Integer, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
@@ -14,9 +14,23 @@ class Conversation(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     meta = Column(JSON, default={})
 
+    # Summary maintained on every message write (see MessageWriter)
+    message_count = Column(Integer, default=0)
+    last_message_at = Column(DateTime, default=datetime.utcnow)
+    last_message_preview = Column(String, nullable=True)
+    token_total = Column(Integer, default=0)  # estimated tokens across messages
+
+    # Set while the messages live in cold storage (see ArchiveService)
+    archived_at = Column(DateTime, nullable=True)
+
     # Relationship
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
+    # Keyset pagination for GET /conversations
+    __table_args__ = (
+        Index("ix_conversations_last_message_at_id", "last_message_at", "id"),
+    )
+
     def __repr__(self):
         return f"<Conversation(id={self.id}, title={self.title})>"
 
@@ -27,6 +27,11 @@ class Document(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     ingested_at = Column(DateTime, nullable=True)
+    # Workspace the document belongs to; each collection is its own index shard
+    collection = Column(String, nullable=False, default="default", index=True)
+    # Index generation and embedding model the current chunks were embedded into
+    index_generation = Column(Integer, nullable=True)
+    embedding_model = Column(String, nullable=True)
 
     def __repr__(self):
         return f"<Document(id={self.id}, file={self.original_filename}, status={self.status})>"
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, DateTime, Text, Integer, Boolean
+from datetime import datetime
+from .base import Base
+
+
+class IndexGeneration(Base):
+    __tablename__ = "index_generations"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # generation number
+    status = Column(String, default="building")  # building, ready, activating, active, failed, cancelled, pruned
+    embedding_model = Column(String, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    chunk_overlap = Column(Integer, nullable=False)
+    activate_when_built = Column(Boolean, default=True)
+    total_documents = Column(Integer, default=0)
+    processed_documents = Column(Integer, default=0)
+    failed_documents = Column(Integer, default=0)
+    chunk_count = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    activated_at = Column(DateTime, nullable=True)
+    retired_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<IndexGeneration(id={self.id}, status={self.status}, model={self.embedding_model})>"
@@ -0,0 +1,3 @@
+from services.agents.runtime import AgentResult, agent_runtime
+
+__all__ = ["AgentResult", "agent_runtime"]
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from config import settings
+from services.agents.sandbox import SandboxPool
+from services.agents.tools import CodeTool, SearchTool, Tool
+from services.llm_service import llm_service
+from services.stage_timing import StageTimings
+
+logger = logging.getLogger(__name__)
+
+TOOL_PROMPT = """
+
+You can call these tools:
+{tools}
+
+To call tools, reply with only a JSON object and nothing else:
+{{"tool_calls": [{{"name": "<tool>", "arguments": {{...}}}}]}}
+All calls in one reply run at the same time, so only group calls that don't depend on each other's results. Tool results come back in the next message. When you can answer, reply with the answer as plain text."""
+
+FINAL_PROMPT = "Answer the question now using the tool results above, without calling any more tools."
+
+_FENCED_JSON = re.compile(r"```(?:json)?\s*(\{.*\})\s*```", re.DOTALL)
+
+
+@dataclass
+class ToolCall:
+    name: str
+    arguments: dict
+
+
+@dataclass
+class ToolResult:
+    name: str
+    arguments: dict
+    output: str
+    seconds: float
+    error: Optional[str] = None
+    documents: list = field(default_factory=list)
+
+    def trace(self) -> dict:
+        return {
+            "name": self.name,
+            "arguments": self.arguments,
+            "seconds": round(self.seconds, 3),
+            "error": self.error,
+        }
+
+
+@dataclass
+class AgentResult:
+    answer: str
+    tool_results: List[ToolResult]
+    steps: int
+
+    @property
+    def documents(self) -> list:
+        return [doc for result in self.tool_results for doc in result.documents]
+
+
+class ToolMetrics:
+    """Call counts and latency percentiles for one tool"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=1000)
+
+    def record(self, seconds: float, error: bool = False, timed_out: bool = False):
+        self.calls += 1
+        self.errors += error
+        self.timeouts += timed_out
+        self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else None,
+        }
+
+
+def parse_tool_calls(reply: str) -> Optional[List[ToolCall]]:
+    """Tool calls in a model reply, or None if the reply is an answer"""
+    text = reply.strip()
+    fenced = _FENCED_JSON.search(text)
+    if fenced:
+        text = fenced.group(1)
+    if not text.startswith("{"):
+        return None
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(payload, dict) or not isinstance(payload.get("tool_calls"), list):
+        return None
+
+    calls = []
+    for call in payload["tool_calls"]:
+        if isinstance(call, dict) and isinstance(call.get("name"), str):
+            arguments = call.get("arguments")
+            calls.append(ToolCall(call["name"], arguments if isinstance(arguments, dict) else {}))
+    return calls or None
+
+
+class AgentRuntime:
+    """
+    Tool-using agent loop for chat turns
+
+    Each step asks the model for either an answer or a JSON list of tool
+    calls. The calls from one step run concurrently, each under its tool's
+    timeout, and their results are fed back for the next step; after
+    `agent_max_steps` steps the model is asked to answer. Tools are enabled
+    by the ENABLE_*_AGENT settings; the code tool's sandboxes are started
+    with the app so calls don't pay interpreter startup.
+    """
+
+    def __init__(self):
+        self.sandbox_pool = SandboxPool()
+        self.tools: Dict[str, Tool] = {}
+        if settings.enable_search_agent and settings.rag_enabled:
+            self.tools["search"] = SearchTool()
+        if settings.enable_code_agent:
+            self.tools["python"] = CodeTool(self.sandbox_pool)
+        self.metrics = {name: ToolMetrics() for name in self.tools}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.tools)
+
+    async def start(self):
+        if "python" in self.tools:
+            try:
+                await self.sandbox_pool.start()
+            except Exception as e:
+                logger.error(f"Code sandboxes unavailable: {e}")
+
+    async def stop(self):
+        await self.sandbox_pool.shutdown()
+
+    def _system_prompt(self) -> str:
+        tools = "\n".join(f"- {tool.name}: {tool.description}" for tool in self.tools.values())
+        return TOOL_PROMPT.format(tools=tools)
+
+    async def call_tool(
+        self,
+        call: ToolCall,
+        document_ids: Optional[List[str]] = None,
+        collections: Optional[List[str]] = None,
+    ) -> ToolResult:
+        """Run one tool call under its timeout; failures become results the model can read"""
+        started = time.perf_counter()
+        tool = self.tools.get(call.name)
+        if tool is None:
+            return ToolResult(call.name, call.arguments, "", 0.0, error=f"Unknown tool {call.name!r}")
+
+        timed_out = False
+        try:
+            output, documents = await asyncio.wait_for(
+                tool.run(call.arguments, document_ids=document_ids, collections=collections), tool.timeout
+            )
+            result = ToolResult(call.name, call.arguments, output, 0.0, documents=documents)
+        except asyncio.TimeoutError:
+            timed_out = True
+            result = ToolResult(call.name, call.arguments, "", 0.0, error=f"Timed out after {tool.timeout:g}s")
+        except Exception as e:
+            result = ToolResult(call.name, call.arguments, "", 0.0, error=str(e))
+
+        result.seconds = time.perf_counter() - started
+        self.metrics[call.name].record(result.seconds, error=result.error is not None, timed_out=timed_out)
+        logger.info(f"Tool {call.name} took {result.seconds * 1000:.0f}ms (error={result.error})")
+        return result
+
+    async def run(
+        self,
+        messages: List[Dict[str, str]],
+        context: Optional[str] = None,
+        backend: Optional[str] = None,
+        affinity_key: Optional[str] = None,
+        document_ids: Optional[List[str]] = None,
+        collections: Optional[List[str]] = None,
+        timings: Optional[StageTimings] = None,
+    ) -> AgentResult:
+        """
+        Run the agent loop for one turn
+
+        Args:
+            messages: Conversation messages ending with the user's message
+            context: Pre-retrieved RAG context, injected on the first step
+            backend: Backend from select_backend()
+            affinity_key: Passed through to the LLM for replica affinity
+            document_ids: Restricts the search tool to these documents
+            collections: Restricts the search tool to these collections
+            timings: Receives llm_<step> and tools_<step> stages
+
+        Returns:
+            The final answer and every tool call made
+        """
+        timings = timings or StageTimings()
+        messages = [dict(msg) for msg in messages]
+        system = next((msg for msg in messages if msg["role"] == "system"), None)
+        if system is None:
+            system = {"role": "system", "content": "You are a helpful AI assistant."}
+            messages.insert(0, system)
+        system["content"] += self._system_prompt()
+
+        tool_results: List[ToolResult] = []
+        for step in range(1, settings.agent_max_steps + 1):
+            reply = await timings.run(
+                f"llm_{step}",
+                llm_service.generate_response(
+                    messages,
+                    stream=False,
+                    # Injected into the system message in place, so only once
+                    context=context if step == 1 else None,
+                    backend=backend,
+                    affinity_key=affinity_key,
+                ),
+            )
+            calls = parse_tool_calls(reply)
+            if calls is None:
+                return AgentResult(reply, tool_results, step)
+
+            calls = calls[: settings.agent_max_parallel_tools]
+            results = await timings.run(
+                f"tools_{step}",
+                asyncio.gather(*[self.call_tool(call, document_ids, collections) for call in calls]),
+            )
+            tool_results.extend(results)
+            messages.append({"role": "assistant", "content": reply})
+            messages.append(
+                {
+                    "role": "user",
+                    "content": "Tool results:\n\n" + "\n\n".join(
+                        f"{r.name}({json.dumps(r.arguments)}):\n{r.error or r.output}"
+                        for r in results
+                    ),
+                }
+            )
+
+        messages.append({"role": "user", "content": FINAL_PROMPT})
+        reply = await timings.run(
+            "llm_final",
+            llm_service.generate_response(
+                messages, stream=False, backend=backend, affinity_key=affinity_key
+            ),
+        )
+        return AgentResult(reply, tool_results, settings.agent_max_steps + 1)
+
+    def stats(self) -> dict:
+        return {
+            "tools": {name: metrics.stats() for name, metrics in self.metrics.items()},
+            "sandboxes": self.sandbox_pool.status() if "python" in self.tools else None,
+        }
+
+
+agent_runtime = AgentRuntime()
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+
+
+@dataclass
+class ExecutionResult:
+    stdout: str
+    error: Optional[str]
+    seconds: float
+
+
+def _worker_limits() -> str:
+    """Resource limits passed to sandbox_worker.py, which applies them to itself"""
+    return json.dumps(
+        {
+            "memory_bytes": settings.code_sandbox_memory_mb * 1024 * 1024,
+            # Hard CPU cap for the process lifetime; the worker moves the soft limit per call
+            "cpu_seconds": settings.code_sandbox_cpu_seconds * (settings.code_sandbox_max_uses + 1),
+        }
+    )
+
+
+class Sandbox:
+    """One warm interpreter process and its scratch directory"""
+
+    def __init__(self, process: asyncio.subprocess.Process, workdir: str):
+        self.process = process
+        self.workdir = workdir
+        self.uses = 0
+
+    async def kill(self):
+        if self.process.returncode is None:
+            self.process.kill()
+        await self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class SandboxPool:
+    """
+    Pre-started, resource-limited Python interpreters for the code tool
+
+    `code_sandbox_workers` interpreters are spawned at startup and wait for
+    snippets on stdin, so a call pays no interpreter startup. Each runs in
+    its own scratch directory with an empty environment, memory, CPU, file
+    size and process limits, and is replaced after a timeout, a crash or
+    `code_sandbox_max_uses` snippets. This limits resource use; it is not a
+    security boundary against hostile code. Snippets run as the API's user
+    and can read anything it can (settings, the database, documents), which
+    is why the code tool is off unless `enable_code_agent` is set.
+    """
+
+    def __init__(self):
+        self.size = max(1, settings.code_sandbox_workers)
+        self._idle: Optional[asyncio.Queue] = None
+        self._spawning: Set[asyncio.Task] = set()
+        self._sandboxes: List[Sandbox] = []
+        self.executions = 0
+        self.restarts = 0
+
+    async def start(self):
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        await asyncio.gather(*[self._spawn() for _ in range(self.size)])
+        logger.info(f"Started {self.size} code sandboxes")
+
+    async def shutdown(self):
+        # Let replacements finish starting so none is left running
+        await asyncio.gather(*self._spawning, return_exceptions=True)
+        await asyncio.gather(*[sandbox.kill() for sandbox in self._sandboxes])
+        self._sandboxes = []
+        self._idle = None
+
+    async def _spawn(self):
+        workdir = tempfile.mkdtemp(prefix="sandbox_")
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-I", WORKER_PATH, _worker_limits(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=workdir,
+            env={},
+            # No preexec_fn: running Python between fork and exec can deadlock
+            # in a threaded process, so the worker sets its own rlimits
+            start_new_session=True,
+        )
+        sandbox = Sandbox(process, workdir)
+        # Wait for the ready line so a pooled sandbox is fully started
+        if not await process.stdout.readline():
+            await sandbox.kill()
+            raise RuntimeError("Code sandbox failed to start")
+        self._sandboxes.append(sandbox)
+        self._idle.put_nowait(sandbox)
+
+    async def _respawn(self, sandbox: Sandbox):
+        await sandbox.kill()
+        try:
+            await self._spawn()
+        except Exception as e:
+            logger.error(f"Could not restart code sandbox: {e}")
+
+    def _replace(self, sandbox: Sandbox):
+        if sandbox in self._sandboxes:
+            self._sandboxes.remove(sandbox)
+        self.restarts += 1
+        task = asyncio.create_task(self._respawn(sandbox))
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    async def execute(self, code: str, timeout: float) -> ExecutionResult:
+        """
+        Run a snippet on an idle sandbox
+
+        Args:
+            code: Python source; its printed output is returned
+            timeout: Wall-clock seconds before the sandbox is killed
+
+        Returns:
+            Captured stdout/stderr and the traceback if it raised
+        """
+        await self.start()
+        sandbox = await self._idle.get()
+        started = time.perf_counter()
+        reusable = False
+        try:
+            request = {
+                "code": code,
+                "cpu_seconds": settings.code_sandbox_cpu_seconds,
+                "max_output": settings.code_sandbox_max_output_chars,
+            }
+            sandbox.process.stdin.write((json.dumps(request) + "\n").encode())
+            await sandbox.process.stdin.drain()
+            try:
+                line = await asyncio.wait_for(sandbox.process.stdout.readline(), timeout)
+            except asyncio.TimeoutError:
+                return ExecutionResult("", f"Timed out after {timeout:g}s", time.perf_counter() - started)
+            if not line:
+                return ExecutionResult(
+                    "", "Sandbox exited (CPU or memory limit exceeded?)", time.perf_counter() - started
+                )
+
+            reply = json.loads(line)
+            sandbox.uses += 1
+            self.executions += 1
+            reusable = sandbox.uses < settings.code_sandbox_max_uses
+            return ExecutionResult(reply["stdout"], reply["error"], time.perf_counter() - started)
+        finally:
+            # Anything else (timeout, crash, cancellation mid-run) discards the process
+            if reusable:
+                self._idle.put_nowait(sandbox)
+            else:
+                self._replace(sandbox)
+
+    def status(self) -> dict:
+        return {
+            "workers": self.size,
+            "idle": self._idle.qsize() if self._idle else 0,
+            "executions": self.executions,
+            "restarts": self.restarts,
+        }
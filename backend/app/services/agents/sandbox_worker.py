@@ -0,0 +1,79 @@
+"""
+Code sandbox interpreter
+
+Started by SandboxPool and kept warm between calls. Applies the resource
+limits given as a JSON argument to itself before reading anything, then
+reads one JSON request per line from stdin, runs the snippet in fresh
+globals and writes one JSON reply per line. Must not import anything from
+the app.
+"""
+
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import traceback
+
+
+def _cpu_seconds_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _limit_cpu(seconds: int):
+    # RLIMIT_CPU counts the whole process lifetime, so the soft limit is
+    # moved forward before each snippet; SIGXCPU ends the process
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(_cpu_seconds_used()) + seconds + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _apply_limits(limits: dict):
+    memory = limits["memory_bytes"]
+    cpu = limits["cpu_seconds"]
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (1024 * 1024, 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+
+def main():
+    _apply_limits(json.loads(sys.argv[1]))
+
+    # Keep the protocol channels private so snippets can't read or write them
+    requests = os.fdopen(os.dup(0), "r")
+    channel = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    sys.stdin = io.StringIO()
+
+    channel.write(json.dumps({"ready": True}) + "\n")
+    channel.flush()
+
+    for line in requests:
+        request = json.loads(line)
+        _limit_cpu(request["cpu_seconds"])
+        output = io.StringIO()
+        error = None
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                exec(compile(request["code"], "<snippet>", "exec"), {"__name__": "__main__"})
+        except BaseException:
+            error = traceback.format_exc(limit=-2)
+
+        limit = request["max_output"]
+        stdout = output.getvalue()
+        if len(stdout) > limit:
+            stdout = stdout[:limit] + f"\n... ({len(stdout) - limit} more characters)"
+        channel.write(json.dumps({"stdout": stdout, "error": error}) + "\n")
+        channel.flush()
+
+
+if __name__ == "__main__":
+    main()
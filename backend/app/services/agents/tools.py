@@ -0,0 +1,90 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from config import settings
+from services.agents.sandbox import SandboxPool
+from services.rag_service import rag_service
+
+
+class Tool:
+    """
+    A capability the agent model can call
+
+    Subclasses set `name`, `description` (shown to the model, including the
+    expected arguments) and `timeout`, and implement `run`.
+    """
+
+    name: str
+    description: str
+    timeout: float
+
+    async def run(
+        self,
+        arguments: dict,
+        document_ids: Optional[List[str]] = None,
+        collections: Optional[List[str]] = None,
+    ) -> Tuple[str, list]:
+        """
+        Returns:
+            (text shown to the model, retrieved documents to cite as sources)
+        """
+        raise NotImplementedError
+
+
+class SearchTool(Tool):
+    """Semantic search over the uploaded documents (the RAG index)"""
+
+    name = "search"
+    description = 'Search the user\'s documents. Arguments: {"query": "<what to look for>"}'
+
+    def __init__(self):
+        self.timeout = settings.agent_search_timeout_seconds
+
+    async def run(
+        self,
+        arguments: dict,
+        document_ids: Optional[List[str]] = None,
+        collections: Optional[List[str]] = None,
+    ) -> Tuple[str, list]:
+        query = arguments.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("'query' must be a non-empty string")
+        docs = await asyncio.to_thread(
+            rag_service.retrieve, query, document_ids=document_ids, collections=collections
+        )
+        if not docs:
+            return "No matching documents.", []
+        text = "\n\n".join(
+            f"[{i}] {doc.metadata.get('source', 'unknown')}:\n{doc.page_content}"
+            for i, doc in enumerate(docs, start=1)
+        )
+        return text, docs
+
+
+class CodeTool(Tool):
+    """Python execution in a pre-warmed, resource-limited sandbox"""
+
+    name = "python"
+    description = (
+        'Run Python 3 code and get what it prints (standard library only). '
+        'Arguments: {"code": "<source>"}'
+    )
+
+    def __init__(self, pool: SandboxPool):
+        self.pool = pool
+        self.timeout = settings.agent_code_timeout_seconds
+
+    async def run(
+        self,
+        arguments: dict,
+        document_ids: Optional[List[str]] = None,
+        collections: Optional[List[str]] = None,
+    ) -> Tuple[str, list]:
+        code = arguments.get("code")
+        if not isinstance(code, str) or not code.strip():
+            raise ValueError("'code' must be a non-empty string")
+        # The sandbox enforces its own (slightly shorter) timeout so it is recycled cleanly
+        result = await self.pool.execute(code, timeout=max(0.1, self.timeout - 0.5))
+        if result.error:
+            return f"{result.stdout}\n{result.error}".strip(), []
+        return result.stdout or "(no output)", []
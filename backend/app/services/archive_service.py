@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import zstandard
+from sqlalchemy import delete, select, update
+
+from config import settings
+from database import AsyncSessionLocal
+from models.conversation import Conversation, Message
+from services.message_writer import insert_ignore, message_writer
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveService:
+    """
+    Cold storage for idle conversations
+
+    Conversations whose last message is older than the configured threshold
+    have their messages written to `<archive dir>/<id>.ndjson.zst` and removed
+    from the messages table. The conversation row stays behind as a stub
+    (title and summary columns, `archived_at` set) so listings are unchanged.
+    Reading or chatting in an archived conversation restores its messages
+    first via `rehydrate`, and restored conversations are not archived again
+    until they have also gone unopened for the threshold.
+    """
+
+    def __init__(self):
+        self.archive_dir = settings.absolute_conversation_archive_dir
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._task: Optional[asyncio.Task] = None
+
+    def archive_path(self, conversation_id: str) -> str:
+        return os.path.join(self.archive_dir, f"{conversation_id}.ndjson.zst")
+
+    async def start(self):
+        if settings.conversation_archive_after_days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Conversation archiver started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.archive_idle()
+            except Exception as e:
+                logger.error(f"Error archiving conversations: {e}")
+            await asyncio.sleep(settings.conversation_archive_interval_seconds)
+
+    async def archive_idle(self, older_than: Optional[timedelta] = None) -> int:
+        """
+        Archive conversations idle for longer than `older_than`
+
+        Works in batches of `conversation_archive_batch_size` with a pause in
+        between, and stops after `conversation_archive_max_batches` so one run
+        never monopolizes the disk or the SQLite writer.
+
+        Returns:
+            Number of conversations archived
+        """
+        if older_than is None:
+            older_than = timedelta(days=settings.conversation_archive_after_days)
+        cutoff = datetime.utcnow() - older_than
+        pause = settings.conversation_archive_batch_pause_ms / 1000
+
+        archived = 0
+        for batch_number in range(settings.conversation_archive_max_batches):
+            if batch_number:
+                await asyncio.sleep(pause)
+            # Shielded so stop() can't cancel a batch halfway through
+            done, exhausted = await asyncio.shield(self._archive_batch(cutoff))
+            archived += done
+            if exhausted:
+                break
+
+        if archived:
+            logger.info(f"Archived {archived} idle conversations")
+        return archived
+
+    async def _archive_batch(self, cutoff: datetime):
+        """Archive one batch; returns (archived, no more candidates)"""
+        batch_size = settings.conversation_archive_batch_size
+        async with AsyncSessionLocal() as session:
+            candidates = (
+                await session.execute(
+                    select(Conversation.id, Conversation.last_message_at)
+                    .where(
+                        Conversation.archived_at.is_(None),
+                        Conversation.last_message_at < cutoff,
+                        # Rehydration bumps updated_at without adding messages
+                        Conversation.updated_at < cutoff,
+                    )
+                    .order_by(Conversation.last_message_at)
+                    .limit(batch_size)
+                )
+            ).all()
+            candidates = [c for c in candidates if not message_writer.has_pending(c.id)]
+            if not candidates:
+                return 0, True
+
+            messages = (
+                await session.execute(
+                    select(Message)
+                    .where(Message.conversation_id.in_([c.id for c in candidates]))
+                    .order_by(Message.created_at, Message.id)
+                )
+            ).scalars().all()
+            by_conversation: Dict[str, List[Message]] = {}
+            for message in messages:
+                by_conversation.setdefault(message.conversation_id, []).append(message)
+
+            # Files are written before the transaction starts so the SQLite
+            # writer is never held across disk I/O
+            for candidate in candidates:
+                records = [_to_record(m) for m in by_conversation.get(candidate.id, [])]
+                await asyncio.to_thread(_write_archive, self.archive_path(candidate.id), records)
+
+            now = datetime.utcnow()
+            archived = 0
+            for candidate in candidates:
+                # Skip conversations that received a message since they were selected
+                result = await session.execute(
+                    update(Conversation)
+                    .where(
+                        Conversation.id == candidate.id,
+                        Conversation.archived_at.is_(None),
+                        Conversation.last_message_at == candidate.last_message_at,
+                    )
+                    .values(archived_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount != 1:
+                    os.remove(self.archive_path(candidate.id))
+                    continue
+                rows = by_conversation.get(candidate.id)
+                if rows:
+                    await session.execute(
+                        delete(Message)
+                        .where(
+                            Message.conversation_id == candidate.id,
+                            Message.id <= max(m.id for m in rows),
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+                archived += 1
+
+            await session.commit()
+        return archived, len(candidates) < batch_size
+
+    async def rehydrate(self, conversation_id: str) -> List[Message]:
+        """
+        Move an archived conversation's messages back into the messages table
+
+        Safe to call concurrently: archived_at is cleared in the same
+        transaction that restores the rows, so only one caller does the work.
+        A missing or unreadable archive is logged and the conversation is
+        restored without those messages (an unreadable file is kept aside as
+        `<archive>.corrupt`) rather than failing every read.
+
+        Returns:
+            All of the conversation's messages, oldest first
+        """
+        async with AsyncSessionLocal() as session:
+            claimed = await session.execute(
+                update(Conversation)
+                .where(
+                    Conversation.id == conversation_id,
+                    Conversation.archived_at.is_not(None),
+                )
+                .values(archived_at=None, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            if claimed.rowcount:
+                path = self.archive_path(conversation_id)
+                try:
+                    records = await asyncio.to_thread(_read_archive, path)
+                except FileNotFoundError:
+                    logger.error(
+                        f"Archive of conversation {conversation_id} is missing; "
+                        "restoring it without the archived messages"
+                    )
+                    records = []
+                except (zstandard.ZstdError, ValueError) as e:
+                    logger.error(
+                        f"Archive of conversation {conversation_id} is unreadable ({e}); "
+                        f"restoring it without the archived messages, file kept as {path}.corrupt"
+                    )
+                    os.replace(path, f"{path}.corrupt")
+                    records = []
+                if records:
+                    await session.execute(
+                        insert_ignore(Message),
+                        [_from_record(r, conversation_id) for r in records],
+                    )
+                await session.commit()
+                if os.path.exists(path):
+                    os.remove(path)
+                logger.info(
+                    f"Rehydrated conversation {conversation_id} ({len(records)} messages)"
+                )
+
+            result = await session.execute(
+                select(Message)
+                .where(Message.conversation_id == conversation_id)
+                .order_by(Message.created_at)
+            )
+            return result.scalars().all()
+
+    def remove(self, conversation_id: str):
+        """Delete the archive file of a deleted conversation, if any"""
+        path = self.archive_path(conversation_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _to_record(message: Message) -> dict:
+    return {
+        "id": message.id,
+        "role": message.role,
+        "content": message.content,
+        "created_at": message.created_at.isoformat() if message.created_at else None,
+        "meta": message.meta or {},
+    }
+
+
+def _from_record(record: dict, conversation_id: str) -> dict:
+    return {
+        "id": record["id"],
+        "conversation_id": conversation_id,
+        "role": record["role"],
+        "content": record["content"],
+        "created_at": (
+            datetime.fromisoformat(record["created_at"]) if record["created_at"] else None
+        ),
+        "meta": record["meta"],
+    }
+
+
+def _write_archive(path: str, records: List[dict]):
+    """Write records as zstd-compressed NDJSON, atomically and durably"""
+    tmp_path = f"{path}.tmp"
+    compressor = zstandard.ZstdCompressor(level=settings.conversation_archive_zstd_level)
+    with open(tmp_path, "wb") as f:
+        with compressor.stream_writer(f, closefd=False) as writer:
+            for record in records:
+                writer.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_archive(path: str) -> List[dict]:
+    with open(path, "rb") as f:
+        data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    records = [json.loads(line) for line in data.splitlines() if line]
+    # Fail here rather than halfway through the insert
+    for record in records:
+        missing = {"id", "role", "content", "created_at", "meta"} - record.keys()
+        if missing:
+            raise ValueError(f"record without {', '.join(sorted(missing))}")
+    return records
+
+
+archive_service = ArchiveService()
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, Dict, List, Optional
+
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from models.batch import BatchItem, BatchJob
+from services.llm_service import SYSTEM_PROMPT, llm_service
+from services.rag_service import rag_service
+
+logger = logging.getLogger(__name__)
+
+
+class BatchService:
+    """
+    Offline chat jobs submitted as JSONL
+
+    A single background task works through queued jobs in submission order.
+    Items are processed in chunks: retrieval for a chunk uses one batched
+    embedding pass, then LLM calls run at `batch_llm_concurrency` as
+    background requests that yield to interactive chats. Each result is
+    committed as soon as it is generated, so a restart only redoes the items
+    that were in flight.
+
+    Every API worker runs this task. A job is claimed with a lease that its
+    worker renews while processing, so only one worker works on it; a job
+    left behind by a crashed worker is taken over once its lease expires.
+    """
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def concurrency(self) -> int:
+        if settings.batch_llm_concurrency > 0:
+            return settings.batch_llm_concurrency
+        return settings.ollama_num_parallel * len(llm_service.ollama_router.replicas)
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Batch chat worker started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @staticmethod
+    def parse_jsonl(content: bytes) -> List[Dict]:
+        """
+        Parse submitted lines of {"message" | "prompt", "document_ids"?, "collections"?, "id"?}
+
+        Raises:
+            ValueError: On malformed lines, naming the line number
+        """
+        items = []
+        for line_number, line in enumerate(content.decode("utf-8").splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+            if not isinstance(record, dict):
+                raise ValueError(f"Line {line_number}: expected a JSON object")
+            prompt = record.get("message") or record.get("prompt")
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError(f"Line {line_number}: expected a non-empty 'message' or 'prompt'")
+            document_ids = record.get("document_ids")
+            if document_ids is not None and not isinstance(document_ids, list):
+                raise ValueError(f"Line {line_number}: 'document_ids' must be a list")
+            collections = record.get("collections")
+            if collections is not None and not isinstance(collections, list):
+                raise ValueError(f"Line {line_number}: 'collections' must be a list")
+            items.append(
+                {
+                    "position": len(items),
+                    "custom_id": str(record["id"]) if record.get("id") is not None else None,
+                    "prompt": prompt,
+                    "document_ids": document_ids,
+                    "collections": collections,
+                }
+            )
+        if not items:
+            raise ValueError("No prompts found")
+        return items
+
+    async def submit(self, db: AsyncSession, items: List[Dict]) -> BatchJob:
+        """Store a job and its items and wake the worker"""
+        job = BatchJob(total=len(items))
+        db.add(job)
+        await db.flush()
+        await db.execute(insert(BatchItem), [{"job_id": job.id, **item} for item in items])
+        await db.commit()
+        if self._wakeup:
+            self._wakeup.set()
+        logger.info(f"Queued batch job {job.id} with {len(items)} items")
+        return job
+
+    async def _run(self):
+        while True:
+            try:
+                job_id = await self._claim_next_job()
+                if job_id is None:
+                    self._wakeup.clear()
+                    # Also wake up to take over jobs whose lease ran out
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), settings.batch_lease_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in batch worker: {e}")
+                await asyncio.sleep(5)
+
+    def _claimable(self, now: datetime):
+        """Jobs nobody holds: queued, or running under an expired (or pre-lease) lease"""
+        return or_(
+            BatchJob.status == "queued",
+            and_(
+                BatchJob.status == "running",
+                or_(BatchJob.lease_expires_at.is_(None), BatchJob.lease_expires_at < now),
+            ),
+        )
+
+    async def _claim_next_job(self) -> Optional[str]:
+        """
+        Claim the oldest unfinished job not leased by another worker
+
+        The claim is a conditional UPDATE, so when workers race for the same
+        job only one of them sees a row change.
+        """
+        async with AsyncSessionLocal() as session:
+            now = datetime.utcnow()
+            candidates = (
+                await session.execute(
+                    select(BatchJob.id)
+                    .where(self._claimable(now))
+                    .order_by(BatchJob.created_at)
+                    .limit(5)
+                )
+            ).scalars().all()
+            for job_id in candidates:
+                result = await session.execute(
+                    update(BatchJob)
+                    .where(BatchJob.id == job_id, self._claimable(now))
+                    .values(
+                        status="running",
+                        lease_owner=self.worker_id,
+                        lease_expires_at=now + timedelta(seconds=settings.batch_lease_seconds),
+                    )
+                )
+                await session.commit()
+                if result.rowcount == 1:
+                    return job_id
+        return None
+
+    async def _renew_lease(self, job_id: str) -> bool:
+        """Extend this worker's lease on a job; False if another worker has taken it"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job_id, BatchJob.lease_owner == self.worker_id)
+                .values(
+                    lease_expires_at=datetime.utcnow()
+                    + timedelta(seconds=settings.batch_lease_seconds)
+                )
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    async def _release_lease(self, job_id: str):
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job_id, BatchJob.lease_owner == self.worker_id)
+                .values(lease_owner=None, lease_expires_at=None)
+            )
+            await session.commit()
+
+    async def _process_job(self, job_id: str):
+        work = asyncio.create_task(self._process_items(job_id))
+        try:
+            while True:
+                done, _ = await asyncio.wait({work}, timeout=settings.batch_lease_seconds / 3)
+                if done:
+                    break
+                if not await self._renew_lease(job_id):
+                    logger.warning(f"Lost the lease on batch job {job_id}, stopping")
+                    work.cancel()
+                    await asyncio.gather(work, return_exceptions=True)
+                    return
+        except asyncio.CancelledError:
+            # Shutting down: hand the job to another worker right away
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            await asyncio.shield(self._release_lease(job_id))
+            raise
+        work.result()
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job_id, BatchJob.lease_owner == self.worker_id)
+                .values(
+                    status="completed",
+                    finished_at=datetime.utcnow(),
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            await session.commit()
+        logger.info(f"Batch job {job_id} completed")
+
+    async def _process_items(self, job_id: str):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_position = -1
+        while True:
+            backend = await llm_service.select_backend()
+            if backend is None:
+                # Don't burn through the job failing every item
+                logger.warning(f"No LLM backend available, batch job {job_id} waiting")
+                await asyncio.sleep(30)
+                continue
+
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(BatchItem)
+                    .where(
+                        BatchItem.job_id == job_id,
+                        BatchItem.status == "pending",
+                        BatchItem.position > last_position,
+                    )
+                    .order_by(BatchItem.position)
+                    .limit(settings.batch_chunk_size)
+                )
+                chunk = result.scalars().all()
+            if not chunk:
+                break
+            last_position = chunk[-1].position
+
+            docs_per_item = [[] for _ in chunk]
+            if settings.rag_enabled:
+                docs_per_item = await asyncio.to_thread(
+                    rag_service.retrieve_batch,
+                    [item.prompt for item in chunk],
+                    document_ids=[item.document_ids for item in chunk],
+                    collections=[item.collections for item in chunk],
+                )
+
+            async def run_item(item: BatchItem, docs):
+                async with semaphore:
+                    await self._run_item(item, docs, backend)
+
+            await asyncio.gather(*[run_item(item, docs) for item, docs in zip(chunk, docs_per_item)])
+
+    async def _run_item(self, item: BatchItem, docs, backend: Optional[str]):
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": item.prompt},
+        ]
+        context = "\n".join(doc.page_content for doc in docs) if docs else None
+        sources = [
+            {
+                "document_id": doc.metadata.get("document_id"),
+                "chunk_index": doc.metadata.get("chunk_index"),
+                "source_path": doc.metadata.get("source"),
+                "preview": doc.page_content[:200],
+            }
+            for doc in docs
+        ]
+
+        try:
+            response = await llm_service.generate_response(
+                messages, stream=False, context=context, backend=backend, background=True
+            )
+            values = {"status": "completed", "response": response, "sources": sources}
+            counter = BatchJob.completed
+        except Exception as e:
+            logger.error(f"Batch item {item.job_id}/{item.position} failed: {e}")
+            values = {"status": "error", "error": str(e)}
+            counter = BatchJob.failed
+        values["completed_at"] = datetime.utcnow()
+
+        async with AsyncSessionLocal() as session:
+            # Only the first result for an item is recorded and counted
+            result = await session.execute(
+                update(BatchItem)
+                .where(BatchItem.id == item.id, BatchItem.status == "pending")
+                .values(**values)
+            )
+            if result.rowcount == 1:
+                await session.execute(
+                    update(BatchJob)
+                    .where(BatchJob.id == item.job_id)
+                    .values({counter: counter + 1})
+                )
+            await session.commit()
+
+    async def stream_results(
+        self, job_id: str, follow: bool = False
+    ) -> AsyncGenerator[str, None]:
+        """
+        Yield finished items as JSONL lines in input order
+
+        Without `follow`, every item finished so far is returned. With
+        `follow`, lines are emitted strictly in order as items finish, until
+        the job completes.
+        """
+        page_size = 500
+        next_position = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                # Read before the items so a job seen as completed has all its rows
+                status = (
+                    await session.execute(select(BatchJob.status).where(BatchJob.id == job_id))
+                ).scalar_one_or_none()
+                rows = (
+                    await session.execute(
+                        select(BatchItem)
+                        .where(
+                            BatchItem.job_id == job_id,
+                            BatchItem.position >= next_position,
+                            BatchItem.status != "pending",
+                        )
+                        .order_by(BatchItem.position)
+                        .limit(page_size)
+                    )
+                ).scalars().all()
+
+            emitted = 0
+            for row in rows:
+                if follow and row.position != next_position:
+                    break
+                yield json.dumps(
+                    {
+                        "id": row.custom_id,
+                        "position": row.position,
+                        "status": row.status,
+                        "response": row.response,
+                        "sources": row.sources,
+                        "error": row.error,
+                    }
+                ) + "\n"
+                next_position = row.position + 1
+                emitted += 1
+
+            if emitted == page_size:
+                continue
+            if not follow or status in (None, "completed"):
+                return
+            await asyncio.sleep(1)
+
+batch_service = BatchService()
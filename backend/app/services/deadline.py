@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Optional, Sequence, TypeVar
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before a stage could start or finish"""
+
+
+class Deadline:
+    """Absolute expiry time for one request"""
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+# Copied into tasks and to_thread calls, so every stage of a request sees it
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def time_left(default: float) -> float:
+    """Seconds left in the current request, capped at `default` (e.g. a client timeout)"""
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return max(0.001, min(default, deadline.remaining()))
+
+
+def has_budget(seconds: float) -> bool:
+    """Whether an optional stage needing about `seconds` still fits"""
+    deadline = _current.get()
+    return deadline is None or deadline.remaining() >= seconds
+
+
+def check_deadline(stage: str):
+    """Raise DeadlineExceeded instead of starting `stage` for a request that has given up"""
+    deadline = _current.get()
+    if deadline is not None and deadline.expired:
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
+
+
+async def within_deadline(awaitable: Awaitable[T], stage: str) -> T:
+    """Await `awaitable`, cancelling it when the current request's deadline passes"""
+    deadline = _current.get()
+    if deadline is None:
+        return await awaitable
+    check_deadline(stage)
+    try:
+        return await asyncio.wait_for(awaitable, deadline.remaining())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Request deadline exceeded during {stage}")
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Run a unit of work (e.g. one WebSocket turn) under its own deadline"""
+    token = _current.set(Deadline(seconds))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def without_deadline():
+    """Start background work from a request without inheriting its deadline"""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class DeadlineMiddleware:
+    """
+    Request deadlines and disconnect cancellation for HTTP requests
+
+    Each request gets a deadline of `request_deadline_seconds`, or less if
+    the client sends a smaller X-Request-Timeout. The handler runs as a task
+    that is cancelled when the client disconnects, or when the deadline
+    passes before a response has started (answered with 504). Paths under
+    `exempt_prefixes` (long uploads, followed streams) get neither.
+    """
+
+    def __init__(self, app, exempt_prefixes: Sequence[str] = ()):
+        self.app = app
+        self.exempt_prefixes = tuple(exempt_prefixes)
+
+    def _budget(self, scope) -> float:
+        budget = settings.request_deadline_seconds
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-timeout":
+                try:
+                    budget = min(budget, max(0.0, float(value)))
+                except ValueError:
+                    pass
+        return budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_prefixes):
+            return await self.app(scope, receive, send)
+
+        deadline = Deadline(self._budget(scope))
+        response_started = False
+        response_complete = False
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def tracked_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                response_complete = True
+            await send(message)
+
+        async def pump():
+            # The only reader of `receive`, so a disconnect is seen while the handler works
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        token = _current.set(deadline)
+        try:
+            handler = asyncio.create_task(self.app(scope, messages.get, tracked_send))
+            listener = asyncio.create_task(pump())
+        finally:
+            _current.reset(token)
+
+        try:
+            while not handler.done():
+                await asyncio.wait(
+                    {handler, listener},
+                    timeout=None if response_started else deadline.remaining(),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if handler.done():
+                    break
+                if listener.done():
+                    if response_complete:
+                        # Only background tasks left; the disconnect is the normal end
+                        await asyncio.wait({handler})
+                        break
+                    logger.info(f"Client disconnected, cancelling {scope['path']}")
+                    handler.cancel()
+                    await asyncio.gather(handler, return_exceptions=True)
+                    return
+                if deadline.expired and not response_started:
+                    logger.warning(f"Deadline of {deadline.budget:g}s exceeded for {scope['path']}")
+                    handler.cancel()
+                    await asyncio.gather(handler, return_exceptions=True)
+                    await _send_timeout(send)
+                    return
+            handler.result()
+        finally:
+            listener.cancel()
+            if not handler.done():
+                handler.cancel()
+            await asyncio.gather(handler, listener, return_exceptions=True)
+
+
+async def _send_timeout(send):
+    body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,248 @@
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBackend(Embeddings):
+    """
+    Base class for batched embedding backends
+
+    Subclasses implement `_encode_batch`, which turns a list of texts into a
+    2D float array. Batching, the output buffer and L2 normalization are
+    handled here so every backend returns the same float32 layout.
+    """
+
+    def __init__(self, model_name: str, batch_size: int, normalize: bool = True):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.normalize = normalize
+        self.dimension: int = 0
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts into a single (n, dim) float32 buffer
+
+        The buffer is allocated once after the first batch and every further
+        batch is written into it in place.
+        """
+        count = len(texts)
+        if count == 0:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        out = None
+        for start in range(0, count, self.batch_size):
+            batch = self._encode_batch(texts[start:start + self.batch_size])
+            if out is None:
+                self.dimension = batch.shape[1]
+                out = np.empty((count, self.dimension), dtype=np.float32)
+            out[start:start + batch.shape[0]] = batch
+
+        if self.normalize:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            np.maximum(norms, 1e-12, out=norms)
+            out /= norms
+        return out
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+
+class TorchEmbeddingBackend(EmbeddingBackend):
+    """sentence-transformers running on PyTorch"""
+
+    def __init__(self, model_name: str, batch_size: int, num_threads: int = 0, normalize: bool = True):
+        super().__init__(model_name, batch_size, normalize)
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=False,
+            show_progress_bar=False,
+        )
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """
+    ONNX Runtime backend with optional int8 dynamic quantization
+
+    The model is exported to ONNX once and cached under
+    `embedding_cache_dir`; the quantized variant is derived from that export.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int,
+        num_threads: int = 0,
+        quantize: bool = False,
+        normalize: bool = True,
+    ):
+        super().__init__(model_name, batch_size, normalize)
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise RuntimeError(
+                "ONNX embedding backend requires onnxruntime, optimum and transformers"
+            ) from e
+
+        model_dir = os.path.join(
+            settings.absolute_embedding_cache_dir,
+            model_name.replace("/", "__"),
+        )
+        model_path = self._ensure_onnx_model(model_dir, quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = min(getattr(self.tokenizer, "model_max_length", 512), 512)
+
+    def _ensure_onnx_model(self, model_dir: str, quantize: bool) -> str:
+        model_path = os.path.join(model_dir, "model.onnx")
+        if not os.path.exists(model_path):
+            from optimum.exporters.onnx import main_export
+
+            logger.info(f"Exporting {self.model_name} to ONNX in {model_dir}")
+            main_export(self.model_name, output=model_dir, task="feature-extraction")
+
+        if not quantize:
+            return model_path
+
+        quantized_path = os.path.join(model_dir, "model.int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            logger.info(f"Quantizing {model_path} to int8")
+            quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feeds = {
+            name: value.astype(np.int64)
+            for name, value in encoded.items()
+            if name in self.input_names
+        }
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        # Mean pooling over non-padding tokens
+        mask = encoded["attention_mask"].astype(np.float32)[:, :, None]
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.maximum(mask.sum(axis=1), 1e-9)
+        return (summed / counts).astype(np.float32, copy=False)
+
+
+class RemoteEmbeddingBackend(EmbeddingBackend):
+    """
+    Embeds through the shared model server (`model_server_socket`)
+
+    The server holds the only copy of the model; it batches these texts with
+    other workers' requests and normalizes the output, so they are sent in
+    a single call.
+    """
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name, batch_size=1)
+        from services.model_client import get_model_client
+
+        self.client = get_model_client()
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        out = self.client.embed(self.model_name, list(texts))
+        self.dimension = out.shape[1]
+        return out
+
+
+def build_embedding_backend(model_name: str) -> EmbeddingBackend:
+    """Load `model_name` in this process with the runtime selected by `embedding_backend`"""
+    backend = settings.embedding_backend.lower()
+    kwargs = {
+        "batch_size": settings.embedding_batch_size,
+        "num_threads": settings.embedding_num_threads,
+    }
+    logger.info(f"Loading embedding model {model_name} ({backend})")
+    if backend == "torch":
+        return TorchEmbeddingBackend(model_name, **kwargs)
+    if backend == "onnx":
+        return OnnxEmbeddingBackend(model_name, **kwargs)
+    if backend == "onnx-int8":
+        return OnnxEmbeddingBackend(model_name, quantize=True, **kwargs)
+    raise ValueError(
+        f"Unknown embedding backend '{settings.embedding_backend}'. "
+        "Use 'torch', 'onnx' or 'onnx-int8'."
+    )
+
+
+_backend_lock = threading.Lock()
+_backend_instances: Dict[str, EmbeddingBackend] = {}
+
+
+def get_embedding_backend(model_name: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Build (once per model) an embedding backend of the type selected in settings
+
+    With `model_server_socket` set the model is not loaded here; the backend
+    forwards to the shared model server instead.
+
+    Args:
+        model_name: Model to load; defaults to `embedding_model`. Index
+            rebuilds pass the model of the generation they build.
+    """
+    model_name = model_name or settings.embedding_model
+    with _backend_lock:
+        instance = _backend_instances.get(model_name)
+        if instance is not None:
+            return instance
+
+        if settings.model_server_socket:
+            instance = RemoteEmbeddingBackend(model_name)
+        else:
+            instance = build_embedding_backend(model_name)
+        _backend_instances[model_name] = instance
+        return instance
+
+
+def release_embedding_backends(keep: Set[str]):
+    """Drop loaded models not in `keep` (e.g. the previous model after an index swap)"""
+    with _backend_lock:
+        for model_name in list(_backend_instances):
+            if model_name not in keep:
+                del _backend_instances[model_name]
@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from services.deadline import without_deadline
+
+logger = logging.getLogger(__name__)
+
+# (sequence number, token, error); the final event has no token and carries the error, if any
+BufferEvent = Tuple[int, Optional[str], Optional[str]]
+
+# A running generation marks itself alive this often; readers give up on one
+# not marked for HEARTBEAT_STALE_SECONDS (its worker died)
+HEARTBEAT_SECONDS = 5.0
+HEARTBEAT_STALE_SECONDS = 30.0
+SHUTDOWN_TIMEOUT_SECONDS = 30.0
+
+
+class MemoryTokenBuffer:
+    """Token buffers in this process's memory; reconnects must reach the same worker"""
+
+    class _Entry:
+        def __init__(self, meta: Dict[str, str]):
+            self.meta = meta
+            self.tokens: List[str] = []
+            self.done = False
+            self.error: Optional[str] = None
+            self.changed = asyncio.Condition()
+
+    def __init__(self):
+        self._entries: Dict[str, "MemoryTokenBuffer._Entry"] = {}
+        self._keys: Dict[str, Tuple[str, float]] = {}
+
+    async def create(self, generation_id: str, meta: Dict[str, str]):
+        self._entries[generation_id] = self._Entry(meta)
+
+    async def claim(self, key: str, generation_id: str, ttl: float) -> Optional[str]:
+        """Bind an idempotency key to a generation; returns the existing one if taken"""
+        now = time.monotonic()
+        existing = self._keys.get(key)
+        if existing and existing[1] > now and existing[0] in self._entries:
+            return existing[0]
+        self._keys[key] = (generation_id, now + ttl)
+        return None
+
+    async def lookup(self, key: str) -> Optional[str]:
+        existing = self._keys.get(key)
+        if existing and existing[1] > time.monotonic() and existing[0] in self._entries:
+            return existing[0]
+        return None
+
+    async def release(self, key: str):
+        self._keys.pop(key, None)
+
+    async def discard(self, generation_id: str):
+        self._entries.pop(generation_id, None)
+
+    async def heartbeat(self, generation_id: str):
+        # The producer runs in this process, so readers never outlive it
+        pass
+
+    async def meta(self, generation_id: str) -> Optional[Dict[str, str]]:
+        entry = self._entries.get(generation_id)
+        return entry.meta if entry else None
+
+    async def append(self, generation_id: str, sequence: int, token: str):
+        entry = self._entries[generation_id]
+        async with entry.changed:
+            entry.tokens.append(token)
+            entry.changed.notify_all()
+
+    async def finish(self, generation_id: str, sequence: int, error: Optional[str] = None):
+        entry = self._entries[generation_id]
+        async with entry.changed:
+            entry.done = True
+            entry.error = error
+            entry.changed.notify_all()
+        asyncio.get_running_loop().call_later(
+            settings.generation_buffer_ttl_seconds, self._expire, generation_id
+        )
+
+    def _expire(self, generation_id: str):
+        self._entries.pop(generation_id, None)
+        for key in [k for k, (gid, _) in self._keys.items() if gid == generation_id]:
+            del self._keys[key]
+
+    async def read(self, generation_id: str, after: int) -> AsyncIterator[BufferEvent]:
+        entry = self._entries.get(generation_id)
+        position = after + 1
+        if entry is None:
+            # Expired between the caller's meta() check and now
+            yield position, None, "Generation expired"
+            return
+        while True:
+            async with entry.changed:
+                await entry.changed.wait_for(lambda: len(entry.tokens) > position or entry.done)
+                tokens = entry.tokens[position:]
+                done, error = entry.done, entry.error
+            for token in tokens:
+                yield position, token, None
+                position += 1
+            if done and position >= len(entry.tokens):
+                yield position, None, error
+                return
+
+
+class RedisTokenBuffer:
+    """
+    Token buffers in Redis streams, shared by all workers
+
+    Each generation is a stream `generation:<id>:events` whose entry ids are
+    the token sequence numbers, so a reconnect on any worker reads from the
+    last id it saw with XREAD BLOCK. The producing worker stamps a heartbeat
+    in the meta hash, which readers check when the stream goes quiet.
+    """
+
+    # Replace a key whose generation has expired, in one step so two
+    # retries can't both see it stale and both start a generation
+    _CLAIM_SCRIPT = """
+    local existing = redis.call('GET', KEYS[1])
+    if existing and redis.call('EXISTS', ARGV[3] .. existing .. ARGV[4]) == 1 then
+        return existing
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return false
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.ttl = settings.generation_buffer_ttl_seconds
+        self._claim = self.redis.register_script(self._CLAIM_SCRIPT)
+
+    @staticmethod
+    def _events(generation_id: str) -> str:
+        return f"generation:{generation_id}:events"
+
+    @staticmethod
+    def _meta(generation_id: str) -> str:
+        return f"generation:{generation_id}:meta"
+
+    async def create(self, generation_id: str, meta: Dict[str, str]):
+        await self.redis.hset(
+            self._meta(generation_id), mapping={**meta, "heartbeat": str(time.time())}
+        )
+        await self.redis.expire(self._meta(generation_id), self.ttl)
+
+    async def claim(self, key: str, generation_id: str, ttl: float) -> Optional[str]:
+        existing = await self._claim(
+            keys=[f"generation:key:{key}"],
+            args=[generation_id, max(1, int(ttl)), "generation:", ":meta"],
+        )
+        return existing or None
+
+    async def lookup(self, key: str) -> Optional[str]:
+        existing = await self.redis.get(f"generation:key:{key}")
+        if existing and await self.redis.exists(self._meta(existing)):
+            return existing
+        return None
+
+    async def release(self, key: str):
+        await self.redis.delete(f"generation:key:{key}")
+
+    async def discard(self, generation_id: str):
+        await self.redis.delete(self._meta(generation_id))
+
+    async def heartbeat(self, generation_id: str):
+        await self.redis.hset(self._meta(generation_id), "heartbeat", str(time.time()))
+        # Long generations keep their early tokens
+        await self.redis.expire(self._meta(generation_id), self.ttl)
+        await self.redis.expire(self._events(generation_id), self.ttl)
+
+    async def meta(self, generation_id: str) -> Optional[Dict[str, str]]:
+        return await self.redis.hgetall(self._meta(generation_id)) or None
+
+    async def append(self, generation_id: str, sequence: int, token: str):
+        # Stream ids start at 1-0 since 0-0 is not a valid entry id
+        name = self._events(generation_id)
+        await self.redis.xadd(name, {"t": token}, id=f"{sequence + 1}-0")
+        if sequence == 0:
+            await self.redis.expire(name, self.ttl)
+
+    async def finish(self, generation_id: str, sequence: int, error: Optional[str] = None):
+        name = self._events(generation_id)
+        await self.redis.xadd(name, {"done": "1", "error": error or ""}, id=f"{sequence + 1}-0")
+        await self.redis.expire(name, self.ttl)
+        await self.redis.expire(self._meta(generation_id), self.ttl)
+
+    async def read(self, generation_id: str, after: int) -> AsyncIterator[BufferEvent]:
+        name = self._events(generation_id)
+        last_id = f"{after + 1}-0"
+        sequence = after
+        while True:
+            response = await self.redis.xread({name: last_id}, block=15000, count=500)
+            if not response:
+                heartbeat = await self.redis.hget(self._meta(generation_id), "heartbeat")
+                if heartbeat is None or time.time() - float(heartbeat) > HEARTBEAT_STALE_SECONDS:
+                    # The producing worker died before finishing the stream
+                    yield sequence + 1, None, "Generation was interrupted"
+                    return
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    sequence = int(entry_id.split("-")[0]) - 1
+                    if fields.get("done"):
+                        yield sequence, None, fields.get("error") or None
+                        return
+                    yield sequence, fields["t"], None
+
+
+class GenerationManager:
+    """
+    Streamed generations that outlive their HTTP connection
+
+    Each generation runs as its own task and appends tokens to a buffer
+    (in memory or Redis, kept for `generation_buffer_ttl_seconds` after it
+    finishes). Clients read from any position, so a dropped SSE connection
+    can resume with Last-Event-ID, and retries carrying the same idempotency
+    key attach to the running generation instead of starting a new one.
+    """
+
+    def __init__(self):
+        if settings.generation_buffer == "redis":
+            self.buffer = RedisTokenBuffer(settings.redis_url)
+        else:
+            self.buffer = MemoryTokenBuffer()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def find(self, key: str) -> Optional[str]:
+        """Running or recently finished generation for an idempotency key"""
+        return await self.buffer.lookup(key)
+
+    async def start(
+        self,
+        tokens: AsyncIterator[str],
+        on_complete: Callable[[str, Optional[str]], Awaitable[None]],
+        meta: Dict[str, str],
+        key: Optional[str] = None,
+        keep_key: bool = True,
+    ) -> Tuple[str, bool]:
+        """
+        Start a generation in the background unless `key` is already running
+
+        Args:
+            tokens: The token stream; only consumed if a new generation starts
+            on_complete: Called with the full text and None once the stream
+                ends, or with the partial text and the error if it breaks off
+            meta: Stored with the buffer (e.g. conversation_id)
+            key: Idempotency key for de-duplicating retries
+            keep_key: Keep the key bound for the buffer TTL after the
+                generation finishes, rather than only while it runs
+
+        Returns:
+            (generation_id, whether an existing generation was reused)
+        """
+        generation_id = str(uuid.uuid4())
+        # Created before claiming, so the key never points at a generation
+        # that looks expired to a concurrent retry
+        await self.buffer.create(generation_id, meta)
+        if key:
+            existing = await self.buffer.claim(
+                key, generation_id, settings.generation_buffer_ttl_seconds
+            )
+            if existing:
+                await self.buffer.discard(generation_id)
+                logger.info(f"Retry attached to running generation {existing}")
+                return existing, True
+
+        self._tasks[generation_id] = asyncio.create_task(
+            self._run(generation_id, tokens, on_complete, key, keep_key)
+        )
+        return generation_id, False
+
+    async def _run(self, generation_id, tokens, on_complete, key, keep_key):
+        full_response = ""
+        sequence = 0
+        error = None
+        cancelled = False
+        heartbeat = asyncio.create_task(self._heartbeat(generation_id))
+        try:
+            async for token in tokens:
+                full_response += token
+                await self.buffer.append(generation_id, sequence, token)
+                sequence += 1
+        except Exception as e:
+            logger.error(f"Generation {generation_id} failed: {e}")
+            error = str(e) or type(e).__name__
+        except asyncio.CancelledError:
+            # Shutdown stopped waiting; the partial reply is still saved
+            cancelled = True
+            error = "Generation cancelled at shutdown"
+        try:
+            # Saving must not fail because the starting request's deadline passed
+            if error is None or full_response:
+                with without_deadline():
+                    await on_complete(full_response, error)
+        except Exception as e:
+            logger.error(f"Saving generation {generation_id} failed: {e}")
+            error = error or str(e)
+        finally:
+            heartbeat.cancel()
+            # A failed generation may be retried from scratch
+            if key and (error or not keep_key):
+                await self.buffer.release(key)
+            await self.buffer.finish(generation_id, sequence, error)
+            self._tasks.pop(generation_id, None)
+        if cancelled:
+            raise asyncio.CancelledError()
+
+    async def _heartbeat(self, generation_id: str):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self.buffer.heartbeat(generation_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat for generation {generation_id} failed: {e}")
+
+    async def meta(self, generation_id: str) -> Optional[Dict[str, str]]:
+        return await self.buffer.meta(generation_id)
+
+    async def sse(self, generation_id: str, after: int = -1) -> AsyncGenerator[str, None]:
+        """
+        SSE events for a generation starting after sequence number `after`
+
+        Event ids are `<generation_id>:<sequence>` so Last-Event-ID alone is
+        enough to resume.
+        """
+        async for sequence, token, error in self.buffer.read(generation_id, after):
+            if token is not None:
+                yield f"id: {generation_id}:{sequence}\ndata: {token}\n\n"
+            elif error:
+                yield f"event: error\ndata: {error}\n\n"
+            else:
+                yield "data: [DONE]\n\n"
+
+    async def shutdown(self):
+        """Let running generations finish so their replies are saved, up to a limit"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*self._tasks.values(), return_exceptions=True),
+                SHUTDOWN_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Cancelled generations still running after {SHUTDOWN_TIMEOUT_SECONDS:g}s"
+            )
+
+
+def parse_last_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """Split a Last-Event-ID of the form `<generation_id>:<sequence>`"""
+    if not value or ":" not in value:
+        return None, -1
+    generation_id, _, sequence = value.rpartition(":")
+    try:
+        return generation_id, int(sequence)
+    except ValueError:
+        return None, -1
+
+
+generation_manager = GenerationManager()
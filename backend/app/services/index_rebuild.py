@@ -0,0 +1,478 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from config import settings
+from database import AsyncSessionLocal
+from models.document import Document
+from models.index_generation import IndexGeneration
+from services.deadline import without_deadline
+from services.llm_service import llm_service
+from services.rag_service import IndexBuilder, IndexSpec, rag_service
+from services.vector_store import DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+
+class IndexJobRunning(Exception):
+    """Another rebuild or activation is already in progress"""
+
+
+def _stamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class IndexRebuildService:
+    """
+    Background re-embedding into a new index generation, with blue/green swap
+
+    A rebuild embeds every ready document from its stored file into a new
+    generation (embedding model, chunk size and overlap as requested) while
+    the live index keeps serving. Work is done `index_rebuild_batch_chunks`
+    chunks at a time, each step waiting while interactive chats are in
+    flight and pausing afterwards. Before the swap, documents that changed
+    in the meantime are re-synced until a pass finds none while no bulk
+    ingestion is in flight; the swap then happens without yielding to the
+    event loop. Replaced generations stay on disk (`index_keep_generations`)
+    and can be activated again, which reconciles them the same way.
+
+    One job (a build or an activation) runs at a time. With a shared vector
+    store (pgvector) every node polls the live pointer and follows swaps
+    made elsewhere; the node that swapped then re-syncs documents other
+    nodes embedded into the old generation before they noticed.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._follower: Optional[asyncio.Task] = None
+        self._starting = False
+        self.generation: Optional[int] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._starting or (self._task is not None and not self._task.done())
+
+    async def recover(self):
+        """Settle jobs interrupted by a restart and record the live generation"""
+        now = datetime.utcnow()
+        live = rag_service.index_generation
+        shared = rag_service.backend.shared
+        async with AsyncSessionLocal() as session:
+            query = select(IndexGeneration).where(
+                IndexGeneration.status.in_(["building", "activating"])
+            )
+            if shared:
+                # Jobs still making progress belong to other nodes
+                stale = now - timedelta(seconds=settings.index_job_stale_seconds)
+                query = query.where(IndexGeneration.updated_at < stale)
+            for row in (await session.execute(query)).scalars().all():
+                if row.status == "building" and row.id != live:
+                    row.status = "failed"
+                    row.error = "Interrupted by a restart"
+                    row.finished_at = now
+                    rag_service.delete_generation(row.id)
+                else:
+                    row.status = "ready"
+
+            await session.execute(
+                update(IndexGeneration)
+                .where(IndexGeneration.status == "active", IndexGeneration.id != live)
+                .values(status="ready", retired_at=now)
+            )
+            row = await session.get(IndexGeneration, live)
+            if row is None:
+                spec = rag_service.spec
+                row = IndexGeneration(
+                    id=live,
+                    embedding_model=spec.embedding_model,
+                    chunk_size=spec.chunk_size,
+                    chunk_overlap=spec.chunk_overlap,
+                    activated_at=now,
+                )
+                session.add(row)
+            row.status = "active"
+            await session.commit()
+
+        if shared and self._follower is None:
+            with without_deadline():
+                self._follower = asyncio.create_task(self._follow())
+
+    async def stop(self):
+        for task in (self._task, self._follower):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._follower = None
+
+    async def _follow(self):
+        """Serve the generation another node made live (shared backends)"""
+        while True:
+            await asyncio.sleep(settings.vector_generation_poll_seconds)
+            try:
+                live = await asyncio.to_thread(rag_service.backend.read_current)
+                if live == rag_service.index_generation or self.busy:
+                    continue
+                builder = await asyncio.to_thread(rag_service.load_builder, live)
+                rag_service.adopt(builder)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not follow the live index generation: {e}")
+
+    def _start(self, job, generation: int):
+        with without_deadline():
+            self._task = asyncio.create_task(job)
+        self.generation = generation
+
+    async def start_build(self, spec: IndexSpec, activate: bool = True) -> IndexGeneration:
+        """
+        Start building a new generation
+
+        Args:
+            spec: Embedding model and chunking for the new generation
+            activate: Swap it in when built (otherwise it stays "ready")
+
+        Raises:
+            IndexJobRunning: If a build or activation is in progress
+        """
+        if self.busy:
+            raise IndexJobRunning(f"Index job for generation {self.generation} is still running")
+        self._starting = True
+        try:
+            async with AsyncSessionLocal() as session:
+                latest = (await session.execute(select(func.max(IndexGeneration.id)))).scalar() or 0
+                row = IndexGeneration(
+                    id=max(latest, rag_service.index_generation) + 1,
+                    status="building",
+                    embedding_model=spec.embedding_model,
+                    chunk_size=spec.chunk_size,
+                    chunk_overlap=spec.chunk_overlap,
+                    activate_when_built=activate,
+                )
+                session.add(row)
+                await session.commit()
+            self._start(self._build(row.id, spec, activate), row.id)
+        finally:
+            self._starting = False
+        logger.info(f"Started building index generation {row.id} ({spec.embedding_model})")
+        return row
+
+    async def start_activation(self, generation: int) -> IndexGeneration:
+        """
+        Reconcile a ready generation with the current documents and swap it in
+
+        Raises:
+            IndexJobRunning: If a build or activation is in progress
+            LookupError: If the generation doesn't exist
+            ValueError: If the generation isn't ready
+        """
+        if self.busy:
+            raise IndexJobRunning(f"Index job for generation {self.generation} is still running")
+        self._starting = True
+        try:
+            async with AsyncSessionLocal() as session:
+                row = await session.get(IndexGeneration, generation)
+                if row is None:
+                    raise LookupError(f"Index generation {generation} not found")
+                if row.status != "ready":
+                    raise ValueError(
+                        f"Index generation {generation} is {row.status}; only ready generations can be activated"
+                    )
+                row.status = "activating"
+                await session.commit()
+            self._start(self._activate(generation), generation)
+        finally:
+            self._starting = False
+        logger.info(f"Activating index generation {generation}")
+        return row
+
+    async def rollback(self) -> IndexGeneration:
+        """
+        Activate the generation most recently replaced
+
+        Raises:
+            LookupError: If no replaced generation is still on disk
+        """
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(IndexGeneration.id)
+                .where(IndexGeneration.status == "ready", IndexGeneration.retired_at.is_not(None))
+                .order_by(IndexGeneration.retired_at.desc())
+                .limit(1)
+            )
+            generation = result.scalar_one_or_none()
+        if generation is None:
+            raise LookupError("No previous index generation to roll back to")
+        return await self.start_activation(generation)
+
+    async def cancel(self) -> Optional[int]:
+        """Cancel the running job; returns its generation, or None if idle"""
+        if not self.busy or self._task is None:
+            return None
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        return self.generation
+
+    async def _update(self, generation: int, **values):
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(IndexGeneration).where(IndexGeneration.id == generation).values(**values)
+            )
+            await session.commit()
+
+    async def _ready_documents(self) -> Dict[str, Tuple[str, Optional[str], str]]:
+        """document_id -> (storage_path, ingested_at stamp, collection) for every ready document"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Document.id, Document.storage_path, Document.ingested_at, Document.collection)
+                .where(Document.status == "ready")
+                .order_by(Document.created_at)
+            )
+            return {
+                row.id: (row.storage_path, _stamp(row.ingested_at), row.collection or DEFAULT_COLLECTION)
+                for row in result
+            }
+
+    async def _throttle(self):
+        """Yield to chat traffic: wait (bounded) while chats are in flight, then pause"""
+        try:
+            await asyncio.wait_for(
+                llm_service.ollama_router.wait_for_quiet(settings.index_rebuild_max_interactive),
+                settings.index_rebuild_max_wait_seconds,
+            )
+        except asyncio.TimeoutError:
+            pass
+        if settings.index_rebuild_pause_seconds > 0:
+            await asyncio.sleep(settings.index_rebuild_pause_seconds)
+
+    async def _embed_document(
+        self, builder: IndexBuilder, document_id: str, path: str, collection: str
+    ) -> int:
+        """Embed one stored document into `builder` a step at a time; returns its chunk count"""
+        chunks = await asyncio.to_thread(builder.load_chunks, path, document_id, collection)
+        step = max(1, settings.index_rebuild_batch_chunks)
+        try:
+            for start in range(0, len(chunks), step):
+                await self._throttle()
+                await asyncio.to_thread(builder.add_chunks, chunks[start:start + step])
+        except BaseException:
+            # Never leave half a document in the generation
+            await asyncio.to_thread(builder.remove_document, document_id)
+            raise
+        return len(chunks)
+
+    async def _build(self, generation: int, spec: IndexSpec, activate: bool):
+        # Started before documents are read, so nothing changed during the build is missed
+        rag_service.track_changes()
+        built = False
+        try:
+            builder = await asyncio.to_thread(rag_service.new_builder, generation, spec)
+            documents = await self._ready_documents()
+            await self._update(generation, total_documents=len(documents))
+
+            failed = chunk_count = 0
+            last_update = time.monotonic()
+            for position, (document_id, (path, stamp, collection)) in enumerate(documents.items(), start=1):
+                builder.documents[document_id] = stamp
+                try:
+                    chunk_count += await self._embed_document(builder, document_id, path, collection)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"Rebuild of generation {generation} skipped {path}: {e}")
+                if position == len(documents) or time.monotonic() - last_update >= 1.0:
+                    await self._update(
+                        generation,
+                        processed_documents=position,
+                        failed_documents=failed,
+                        chunk_count=chunk_count,
+                    )
+                    last_update = time.monotonic()
+
+            await asyncio.to_thread(builder.save)
+            built = True
+            await self._update(generation, status="ready", finished_at=datetime.utcnow())
+            logger.info(
+                f"Built index generation {generation}: {len(documents)} documents "
+                f"({failed} failed), {chunk_count} chunks"
+            )
+            if activate:
+                await self._update(generation, status="activating")
+                await self._swap(builder)
+        except asyncio.CancelledError:
+            logger.info(f"Index job for generation {generation} cancelled")
+            if not built:
+                await self._update(generation, status="cancelled", finished_at=datetime.utcnow())
+                rag_service.delete_generation(generation)
+            elif generation != rag_service.index_generation:
+                # Otherwise it was cancelled while settling, after the swap
+                await self._update(generation, status="ready")
+            raise
+        except Exception as e:
+            logger.error(f"Index job for generation {generation} failed: {e}")
+            if generation == rag_service.index_generation:
+                await self._update(generation, error=str(e))
+            elif built:
+                await self._update(generation, status="ready", error=str(e))
+            else:
+                await self._update(generation, status="failed", error=str(e), finished_at=datetime.utcnow())
+                rag_service.delete_generation(generation)
+        finally:
+            rag_service.stop_tracking()
+
+    async def _activate(self, generation: int):
+        rag_service.track_changes()
+        try:
+            builder = await asyncio.to_thread(rag_service.load_builder, generation)
+            await self._swap(builder)
+        except asyncio.CancelledError:
+            logger.info(f"Activation of index generation {generation} cancelled")
+            if generation != rag_service.index_generation:
+                await self._update(generation, status="ready")
+            raise
+        except Exception as e:
+            logger.error(f"Activation of index generation {generation} failed: {e}")
+            if generation == rag_service.index_generation:
+                await self._update(generation, error=str(e))
+            else:
+                await self._update(generation, status="ready", error=str(e))
+        finally:
+            rag_service.stop_tracking()
+
+    async def _swap(self, builder: IndexBuilder):
+        """Bring `builder` up to date with the documents, then make it live"""
+        while True:
+            while rag_service.mutations:
+                await asyncio.sleep(0.2)
+            changed = rag_service.take_changes()
+            documents = await self._ready_documents()
+            stale = changed | (set(builder.documents) - set(documents)) | {
+                document_id
+                for document_id, (_, stamp, _) in documents.items()
+                if document_id not in builder.documents or builder.documents[document_id] != stamp
+            }
+
+            if stale:
+                logger.info(f"Re-syncing {len(stale)} changed documents into generation {builder.generation}")
+                for document_id in stale:
+                    await asyncio.to_thread(builder.remove_document, document_id)
+                    builder.documents.pop(document_id, None)
+                    if document_id not in documents:
+                        continue
+                    path, stamp, collection = documents[document_id]
+                    builder.documents[document_id] = stamp
+                    try:
+                        await self._embed_document(builder, document_id, path, collection)
+                    except Exception as e:
+                        logger.warning(f"Re-sync of {path} into generation {builder.generation} failed: {e}")
+                continue
+
+            await asyncio.to_thread(builder.save)
+            if not rag_service.quiescent:
+                continue
+
+            # Nothing below yields until the swap is done
+            retired = rag_service.index_generation
+            live_ids = rag_service.live_document_ids()
+            rag_service.activate(
+                builder,
+                {document_id: stamp for document_id, (_, stamp, _) in documents.items() if document_id in live_ids},
+            )
+            break
+
+        await self._record_swap(builder, retired)
+        if rag_service.backend.shared:
+            await self._settle(builder)
+
+    async def _record_swap(self, builder: IndexBuilder, retired: int):
+        now = datetime.utcnow()
+        embedded = sorted(builder.document_ids())
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(IndexGeneration)
+                .where(IndexGeneration.id == retired)
+                .values(status="ready", retired_at=now)
+            )
+            await session.execute(
+                update(IndexGeneration)
+                .where(IndexGeneration.id == builder.generation)
+                .values(status="active", activated_at=now, error=None)
+            )
+            for start in range(0, len(embedded), 500):
+                await session.execute(
+                    update(Document)
+                    .where(Document.id.in_(embedded[start:start + 500]))
+                    .values(index_generation=builder.generation, embedding_model=builder.spec.embedding_model)
+                )
+
+            # Keep the newest inactive generations for rollback, delete the rest
+            result = await session.execute(
+                select(IndexGeneration)
+                .where(IndexGeneration.status == "ready")
+                .order_by(func.coalesce(IndexGeneration.retired_at, IndexGeneration.finished_at).desc())
+            )
+            for row in result.scalars().all()[max(0, settings.index_keep_generations - 1):]:
+                rag_service.delete_generation(row.id)
+                row.status = "pruned"
+                logger.info(f"Pruned index generation {row.id}")
+            await session.commit()
+
+    async def _settle(self, builder: IndexBuilder):
+        """
+        Re-sync documents other nodes embedded into the retired generation
+
+        Their uploads land in whatever generation they serve until their
+        next poll, so wait for every node to follow, then embed documents
+        still stamped with another generation into the live one.
+        """
+        await asyncio.sleep(2 * settings.vector_generation_poll_seconds)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Document.id, Document.storage_path, Document.ingested_at, Document.collection).where(
+                    Document.status == "ready",
+                    Document.index_generation != builder.generation,
+                )
+            )
+            stale = {
+                row.id: (row.storage_path, _stamp(row.ingested_at), row.collection or DEFAULT_COLLECTION)
+                for row in result
+            }
+        if not stale:
+            return
+
+        logger.info(f"Re-syncing {len(stale)} documents ingested on other nodes during the swap")
+        synced = []
+        for document_id, (path, stamp, collection) in stale.items():
+            await asyncio.to_thread(builder.remove_document, document_id)
+            try:
+                await self._embed_document(builder, document_id, path, collection)
+            except Exception as e:
+                logger.warning(f"Re-sync of {path} into generation {builder.generation} failed: {e}")
+                continue
+            builder.documents[document_id] = stamp
+            synced.append(document_id)
+        await asyncio.to_thread(builder.save)
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(Document)
+                .where(Document.id.in_(synced))
+                .values(index_generation=builder.generation, embedding_model=builder.spec.embedding_model)
+            )
+            await session.commit()
+
+    def stats(self) -> dict:
+        return {
+            "vector_store": settings.vector_store,
+            "live_generation": rag_service.index_generation,
+            "embedding_model": rag_service.spec.embedding_model,
+            "job_generation": self.generation if self.busy else None,
+            **rag_service.backend.stats(),
+        }
+
+
+index_rebuild_service = IndexRebuildService()
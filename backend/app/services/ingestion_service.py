@@ -0,0 +1,169 @@
+import logging
+import mimetypes
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.document import Document
+from services.rag_service import IngestPool, rag_service
+from services.vector_store import DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {".pdf", ".txt"}
+
+
+class IngestionService:
+    """Bulk document ingestion shared by the /documents/bulk API and the CLI"""
+
+    def discover_files(self, directory: str, recursive: bool = True) -> List[Dict]:
+        """Find PDF/TXT files under a directory and describe them as ingest items"""
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            raise ValueError(f"Directory not found: {directory}")
+
+        paths = []
+        if recursive:
+            for root, _, filenames in os.walk(directory):
+                paths.extend(os.path.join(root, name) for name in filenames)
+        else:
+            paths = [
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if os.path.isfile(os.path.join(directory, name))
+            ]
+
+        items = []
+        for path in sorted(paths):
+            if os.path.splitext(path.lower())[-1] not in SUPPORTED_EXTENSIONS:
+                continue
+            items.append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "original_filename": os.path.basename(path),
+                    "stored_filename": os.path.relpath(path, directory),
+                    "storage_path": path,
+                    "content_type": mimetypes.guess_type(path)[0],
+                    "size_bytes": os.path.getsize(path),
+                }
+            )
+        return items
+
+    async def filter_new(self, db: AsyncSession, items: List[Dict]) -> List[Dict]:
+        """Drop items whose storage path is already registered as a Document"""
+        result = await db.execute(select(Document.storage_path))
+        known = set(result.scalars().all())
+        return [item for item in items if item["storage_path"] not in known]
+
+    async def ingest(
+        self,
+        db: AsyncSession,
+        items: List[Dict],
+        workers: Optional[int] = None,
+        batch_files: Optional[int] = None,
+        collection: str = DEFAULT_COLLECTION,
+    ) -> Dict[str, int]:
+        """
+        Register and ingest files in batches into one collection
+
+        Each batch is one multi-row INSERT of Document rows, one fan-out of
+        parsing/embedding across processes, one index write and one bulk
+        status UPDATE.
+
+        Returns:
+            Counts of ready and failed documents
+        """
+        batch_files = batch_files or settings.ingest_batch_files
+        counts = {"ready": 0, "error": 0}
+        if not items:
+            return counts
+
+        # One set of worker processes for every batch
+        with rag_service.ingest_pool(len(items), workers) as pool:
+            for start in range(0, len(items), batch_files):
+                await self._ingest_batch(
+                    db, items[start:start + batch_files], pool, collection, counts
+                )
+                logger.info(
+                    f"Bulk ingestion progress: {min(start + batch_files, len(items))}/{len(items)} files"
+                )
+
+        return counts
+
+    async def _ingest_batch(
+        self,
+        db: AsyncSession,
+        batch: List[Dict],
+        pool: IngestPool,
+        collection: str,
+        counts: Dict[str, int],
+    ):
+        """Register, ingest and mark one batch of files"""
+        now = datetime.utcnow()
+
+        await db.execute(
+            insert(Document),
+            [
+                {
+                    **item,
+                    "collection": collection,
+                    "status": "processing",
+                    "chunk_count": 0,
+                    "meta": {},
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for item in batch
+            ],
+        )
+        await db.commit()
+
+        try:
+            results = await rag_service.ingest_files_bulk(
+                [(item["storage_path"], item["id"], collection) for item in batch],
+                pool=pool,
+            )
+        except Exception as e:
+            # Don't leave the batch stuck in "processing"
+            logger.error(f"Error ingesting batch of {len(batch)} files: {e}")
+            failed = datetime.utcnow()
+            await db.execute(
+                update(Document),
+                [
+                    {"id": item["id"], "status": "error", "error": str(e), "updated_at": failed}
+                    for item in batch
+                ],
+            )
+            await db.commit()
+            counts["error"] += len(batch)
+            raise
+
+        finished = datetime.utcnow()
+        stamp = rag_service.index_stamp()
+        updates = []
+        for item in batch:
+            chunk_count, error = results.get(item["id"], (0, "Not processed"))
+            updates.append(
+                {
+                    "id": item["id"],
+                    "status": "error" if error else "ready",
+                    "chunk_count": chunk_count,
+                    "error": error,
+                    "ingested_at": None if error else finished,
+                    "index_generation": None if error else stamp["index_generation"],
+                    "embedding_model": None if error else stamp["embedding_model"],
+                    "updated_at": finished,
+                }
+            )
+            counts["error" if error else "ready"] += 1
+
+        await db.execute(update(Document), updates)
+        await db.commit()
+
+
+ingestion_service = IngestionService()
@@ -0,0 +1,93 @@
+"""
+Helpers that run inside bulk-ingestion worker processes
+
+Kept separate from rag_service so spawned workers only import the
+loaders, splitter and embedding backend, not the FAISS index singleton.
+"""
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+
+from config import settings
+from services.vector_store.base import DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+_text_splitter: Optional[RecursiveCharacterTextSplitter] = None
+_embeddings = None
+
+
+def build_text_splitter(
+    chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None
+) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size or settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap if chunk_overlap is None else chunk_overlap,
+    )
+
+
+def load_chunks(
+    file_path: str,
+    document_id: str,
+    text_splitter: RecursiveCharacterTextSplitter,
+    collection: str = DEFAULT_COLLECTION,
+) -> List[Document]:
+    """Load a PDF/TXT file and split it into chunks tagged with document metadata"""
+    if file_path.lower().endswith(".pdf"):
+        documents = PyPDFLoader(file_path).load()
+    elif file_path.lower().endswith(".txt"):
+        documents = TextLoader(file_path).load()
+    else:
+        raise ValueError("Unsupported file format. Only PDF and TXT are supported.")
+
+    chunks = text_splitter.split_documents(documents)
+    for idx, chunk in enumerate(chunks):
+        if chunk.metadata is None:
+            chunk.metadata = {}
+        chunk.metadata.update(
+            {
+                "document_id": document_id,
+                "collection": collection,
+                "source": file_path,
+                "chunk_index": idx,
+            }
+        )
+    return chunks
+
+
+def init_worker(
+    num_threads: int,
+    embedding_model: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+):
+    """
+    Process pool initializer: load the splitter and embedding model once
+
+    The model and chunking default to settings; the parent passes those of
+    the live index generation.
+    """
+    global _text_splitter, _embeddings
+    from services.embedding_service import get_embedding_backend
+
+    if num_threads > 0:
+        settings.embedding_num_threads = num_threads
+    _text_splitter = build_text_splitter(chunk_size, chunk_overlap)
+    _embeddings = get_embedding_backend(embedding_model)
+
+
+def parse_and_embed(
+    file_path: str, document_id: str, collection: str = DEFAULT_COLLECTION
+) -> Tuple[List[str], List[dict], Optional[np.ndarray]]:
+    """Parse, chunk and embed one file; returns (texts, metadatas, vectors)"""
+    chunks = load_chunks(file_path, document_id, _text_splitter, collection)
+    if not chunks:
+        return [], [], None
+
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    return texts, metadatas, _embeddings.embed_documents(texts)
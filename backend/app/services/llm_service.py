@@ -1,40 +1,80 @@
 import logging
-from typing import List, Dict, AsyncGenerator, Optional
+from typing import TYPE_CHECKING, List, Dict, AsyncGenerator, Optional, Set
 import httpx
 from config import settings
+from services.deadline import check_deadline, has_budget, time_left, within_deadline
+from services.ollama_router import OllamaRouter
+
+if TYPE_CHECKING:
+    from services.model_cascade import RouteDecision
 
 logger = logging.getLogger(__name__)
 
 
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) without a tokenizer"""
+    return (len(text) + 3) // 4
+
+
+SYSTEM_PROMPT = """You are SolverAI, a helpful and knowledgeable assistant.
+
+IMPORTANT FORMATTING RULES - Follow these exactly:
+1. Always put a blank line before and after headings
+2. Always put a blank line before lists
+3. Always put a blank line between paragraphs
+4. Use **bold** for key terms
+5. Use numbered lists (1. 2. 3.) for steps
+6. Use bullet points (- or *) for non-sequential items
+7. Keep responses well-organized and easy to read
+
+Example of good formatting:
+
+## Main Topic
+
+Here is an introductory paragraph explaining the concept.
+
+### Key Points
+
+1. **First point** - explanation here
+2. **Second point** - explanation here
+3. **Third point** - explanation here
+
+### Additional Information
+
+- Bullet point one
+- Bullet point two
+
+This is a concluding paragraph.
+
+Always follow this structure with proper line breaks."""
+
+
 class LLMService:
     """Service for interacting with LLMs (Ollama local or OpenAI cloud)"""
 
     def __init__(self):
-        self.ollama_base_url = settings.ollama_base_url
-        # Workaround for localhost resolution issues with httpx/Ollama
-        if "localhost" in self.ollama_base_url:
-            self.ollama_base_url = self.ollama_base_url.replace("localhost", "127.0.0.1")
-        self.ollama_model = "llama3.1:8b" # Force model name
+        self.ollama_router = OllamaRouter(settings.ollama_urls)
+        self.ollama_model = settings.ollama_model
+        from services.model_cascade import ModelCascade
+        self.cascade = ModelCascade()
         self.openai_api_key = settings.openai_api_key
         self.use_ollama = True  # Default to local
         import os
         self.mock_mode = os.getenv("LLM_MOCK_MODE", "false").lower() == "true"
 
     async def check_ollama_availability(self) -> bool:
-        """Check if Ollama is available"""
-        try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.ollama_base_url}/api/tags")
-                return response.status_code == 200
-        except Exception as e:
-            logger.warning(f"Ollama not available: {e}")
-            return False
+        """Check if any Ollama replica serving the model is available"""
+        await self.ollama_router.refresh()
+        return self.ollama_router.available(self.ollama_model)
 
     async def generate_response(
         self,
         messages: List[Dict[str, str]],
         stream: bool = False,
         context: Optional[str] = None,
+        backend: Optional[str] = None,
+        affinity_key: Optional[str] = None,
+        background: bool = False,
     ):
         """
         Generate a response from the LLM
@@ -42,6 +82,11 @@ class LLMService:
         Args:
             messages: List of message dicts with 'role' and 'content'
             stream: Whether to stream the response
+            backend: Backend from select_backend(); probed here if omitted
+            affinity_key: Usually the conversation id; keeps a conversation
+                on the same Ollama replica so its prompt cache is reused
+            background: Low-priority (batch) request; waits for interactive
+                Ollama traffic to drain. Non-streaming only
 
         Returns:
             Complete response string or async generator for streaming
@@ -62,8 +107,11 @@ class LLMService:
             else:
                 messages.insert(0, {"role": "system", "content": "You are a helpful AI assistant." + context_prompt})
 
+        if backend is None:
+            backend = await self.select_backend()
+
         # Check for mock mode
-        if self.mock_mode:
+        if backend == "mock":
             logger.info("Using Mock LLM")
             mock_response = "This is a mock response from SolverAI."
             if stream:
@@ -75,13 +123,21 @@ class LLMService:
                 return mock_stream()
             return mock_response
 
-        # Check Ollama availability
-        ollama_available = await self.check_ollama_availability()
-
-        if ollama_available:
-            logger.info(f"Using Ollama with model: {self.ollama_model}")
-            return await self._generate_ollama(messages, stream)
-        elif self.openai_api_key:
+        if backend == "ollama":
+            # Routing stage: pick the cheapest model likely to handle the turn
+            decision = self.cascade.route(
+                messages,
+                context,
+                small_available=(
+                    self.cascade.enabled
+                    and self.ollama_router.available(self.cascade.small_model)
+                ),
+            )
+            logger.info(f"Using Ollama with model: {decision.model}")
+            return await self._generate_ollama(
+                messages, decision, stream, affinity_key, background
+            )
+        elif backend == "openai":
             logger.info("Ollama unavailable, falling back to OpenAI")
             return await self._generate_openai(messages, stream)
         else:
@@ -89,17 +145,123 @@ class LLMService:
                 "No LLM available. Ollama is down and no OpenAI API key configured."
             )
 
+    async def select_backend(self) -> Optional[str]:
+        """
+        Pick the backend for a request: 'mock', 'ollama', 'openai' or None
+
+        Separate from generation so callers can probe it concurrently with
+        other work before the prompt is ready.
+        """
+        if self.mock_mode:
+            return "mock"
+        if await self.check_ollama_availability():
+            return "ollama"
+        if self.openai_api_key:
+            return "openai"
+        return None
+
     async def _generate_ollama(
         self,
         messages: List[Dict[str, str]],
+        decision: "RouteDecision",
         stream: bool = False,
+        affinity_key: Optional[str] = None,
+        background: bool = False,
     ) -> str | AsyncGenerator[str, None]:
-        """Generate response using Ollama"""
+        """Generate response using Ollama with the model chosen by the cascade"""
 
         if stream:
-            return self._stream_ollama(messages)
+            return self._stream_cascade(messages, decision, affinity_key)
         else:
-            return await self._complete_ollama(messages)
+            return await self._complete_cascade(messages, decision, affinity_key, background)
+
+    def _should_escalate(self, decision: "RouteDecision") -> bool:
+        # A second, larger generation wouldn't fit in what is left of the request
+        return (
+            decision.small
+            and settings.cascade_escalate
+            and has_budget(settings.deadline_escalation_min_seconds)
+        )
+
+    async def _complete_cascade(
+        self,
+        messages: List[Dict[str, str]],
+        decision: "RouteDecision",
+        affinity_key: Optional[str] = None,
+        background: bool = False,
+    ) -> str:
+        """Complete with the routed model, escalating if the answer fails the check"""
+        answer = await self._complete_ollama(messages, decision.model, affinity_key, background)
+        escalated = self._should_escalate(decision) and not self.cascade.acceptable(answer)
+        if escalated:
+            logger.info(f"{decision.model} answer failed the quality check, escalating")
+            answer = await self._complete_ollama(
+                messages, self.ollama_model, affinity_key, background
+            )
+        self.cascade.record(decision, answer, escalated)
+        return answer
+
+    async def _stream_cascade(
+        self,
+        messages: List[Dict[str, str]],
+        decision: "RouteDecision",
+        affinity_key: Optional[str] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream with the routed model
+
+        When escalation is possible the first `cascade_stream_check_chars` of
+        the small model's answer are held back and checked; on failure they
+        are discarded and the large model streams the answer instead.
+        """
+        answer = ""
+        if not self._should_escalate(decision):
+            stream = self._stream_ollama(messages, decision.model, affinity_key)
+            try:
+                async for chunk in stream:
+                    answer += chunk
+                    yield chunk
+            finally:
+                # Close the upstream request now if our consumer stops early
+                await stream.aclose()
+            self.cascade.record(decision, answer)
+            return
+
+        small_stream = self._stream_ollama(messages, decision.model, affinity_key)
+        released = False
+        escalated = False
+        try:
+            async for chunk in small_stream:
+                answer += chunk
+                if released:
+                    yield chunk
+                elif len(answer) >= settings.cascade_stream_check_chars:
+                    if not self.cascade.acceptable(answer, final=False):
+                        escalated = True
+                        break
+                    released = True
+                    yield answer
+        finally:
+            await small_stream.aclose()
+
+        if not released and not escalated:
+            # The whole answer fit in the held-back prefix
+            if self.cascade.acceptable(answer):
+                yield answer
+            else:
+                escalated = True
+
+        if escalated:
+            logger.info(f"{decision.model} answer failed the quality check, escalating")
+            answer = ""
+            large_stream = self._stream_ollama(messages, self.ollama_model, affinity_key)
+            try:
+                async for chunk in large_stream:
+                    answer += chunk
+                    yield chunk
+            finally:
+                await large_stream.aclose()
+        self.cascade.record(decision, answer, escalated)
 
     def _format_prompt(self, messages: List[Dict[str, str]]) -> str:
         """Format messages into Llama 3 prompt format"""
@@ -116,55 +278,113 @@ class LLMService:
         prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
         return prompt
 
-    async def _complete_ollama(self, messages: List[Dict[str, str]]) -> str:
+    @staticmethod
+    def _is_replica_failure(error: Exception) -> bool:
+        """Connection problems and 5xx count against a replica; 4xx don't"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code >= 500
+        return isinstance(error, httpx.TransportError)
+
+    async def _complete_ollama(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        affinity_key: Optional[str] = None,
+        background: bool = False,
+    ) -> str:
         """Get complete response from Ollama using /api/generate"""
         prompt = self._format_prompt(messages)
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            payload = {
-                "model": self.ollama_model,
-                "prompt": prompt,
-                "stream": False,
-            }
-
-            response = await client.post(
-                f"{self.ollama_base_url}/api/generate",
-                json=payload,
-            )
-            response.raise_for_status()
-
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+        }
+
+        # Failed replicas are skipped and the request retried on the next one
+        tried: Set[str] = set()
+        while True:
+            async with self.ollama_router.lease(
+                model, affinity_key, exclude=tried, background=background
+            ) as replica:
+                try:
+                    async with httpx.AsyncClient(timeout=time_left(120.0)) as client:
+                        response = await within_deadline(
+                            client.post(f"{replica.url}/api/generate", json=payload),
+                            "generation",
+                        )
+                        response.raise_for_status()
+                except Exception as e:
+                    if not self._is_replica_failure(e):
+                        raise
+                    # A timeout caused by the request's own deadline isn't the replica's fault
+                    check_deadline("retrying generation")
+                    logger.warning(f"Ollama replica {replica.url} failed: {e}")
+                    self.ollama_router.report_failure(replica)
+                    tried.add(replica.url)
+                    continue
+
+            self.ollama_router.report_success(replica)
             data = response.json()
             return data["response"]
 
     async def _stream_ollama(
-        self, messages: List[Dict[str, str]]
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        affinity_key: Optional[str] = None,
     ) -> AsyncGenerator[str, None]:
         """Stream response from Ollama using /api/generate"""
         prompt = self._format_prompt(messages)
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            payload = {
-                "model": self.ollama_model,
-                "prompt": prompt,
-                "stream": True,
-            }
-
-            async with client.stream(
-                "POST",
-                f"{self.ollama_base_url}/api/generate",
-                json=payload,
-            ) as response:
-                response.raise_for_status()
-
-                async for line in response.aiter_lines():
-                    if line.strip():
-                        import json
-                        try:
-                            chunk = json.loads(line)
-                            if "response" in chunk:
-                                content = chunk["response"]
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+        }
+
+        # Retry on another replica only while nothing has been yielded yet
+        tried: Set[str] = set()
+        while True:
+            started = False
+            async with self.ollama_router.lease(
+                model, affinity_key, exclude=tried
+            ) as replica:
+                try:
+                    async with httpx.AsyncClient(timeout=time_left(120.0)) as client:
+                        async with client.stream(
+                            "POST",
+                            f"{replica.url}/api/generate",
+                            json=payload,
+                        ) as response:
+                            response.raise_for_status()
+
+                            async for line in response.aiter_lines():
+                                # The deadline covers the wait for the first token; a
+                                # reply already streaming runs to the end (each read
+                                # still has its own timeout)
+                                if not started:
+                                    check_deadline("first token")
+                                if line.strip():
+                                    import json
+                                    try:
+                                        chunk = json.loads(line)
+                                        if "response" in chunk:
+                                            content = chunk["response"]
+                                            if content:
+                                                started = True
+                                                yield content
+                                    except json.JSONDecodeError:
+                                        continue
+                except Exception as e:
+                    if started or not self._is_replica_failure(e):
+                        raise
+                    check_deadline("retrying generation")
+                    logger.warning(f"Ollama replica {replica.url} failed: {e}")
+                    self.ollama_router.report_failure(replica)
+                    tried.add(replica.url)
+                    continue
+
+            self.ollama_router.report_success(replica)
+            return
 
     async def _generate_openai(
         self,
@@ -180,7 +400,7 @@ class LLMService:
 
     async def _complete_openai(self, messages: List[Dict[str, str]]) -> str:
         """Get complete response from OpenAI"""
-        async with httpx.AsyncClient(timeout=120.0) as client:
+        async with httpx.AsyncClient(timeout=time_left(120.0)) as client:
             headers = {
                 "Authorization": f"Bearer {self.openai_api_key}",
                 "Content-Type": "application/json",
@@ -192,10 +412,13 @@ class LLMService:
                 "stream": False,
             }
 
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
+            response = await within_deadline(
+                client.post(
+                    "https://api.openai.com/v1/chat/completions",
+                    headers=headers,
+                    json=payload,
+                ),
+                "generation",
             )
             response.raise_for_status()
 
@@ -206,7 +429,7 @@ class LLMService:
         self, messages: List[Dict[str, str]]
     ) -> AsyncGenerator[str, None]:
         """Stream response from OpenAI"""
-        async with httpx.AsyncClient(timeout=120.0) as client:
+        async with httpx.AsyncClient(timeout=time_left(120.0)) as client:
             headers = {
                 "Authorization": f"Bearer {self.openai_api_key}",
                 "Content-Type": "application/json",
@@ -226,7 +449,10 @@ class LLMService:
             ) as response:
                 response.raise_for_status()
 
+                started = False
                 async for line in response.aiter_lines():
+                    if not started:
+                        check_deadline("first token")
                     if line.startswith("data: "):
                         data = line[6:]
                         if data.strip() == "[DONE]":
@@ -236,6 +462,7 @@ class LLMService:
                         try:
                             chunk = json.loads(data)
                             if chunk["choices"][0]["delta"].get("content"):
+                                started = True
                                 yield chunk["choices"][0]["delta"]["content"]
                         except json.JSONDecodeError:
                             continue
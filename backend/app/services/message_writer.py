@@ -0,0 +1,314 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, func, insert, text, update
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal, engine
+from models.conversation import Conversation, Message
+from services.llm_service import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 200
+
+
+def insert_ignore(model):
+    """INSERT that skips rows whose primary key already exists"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
+class MessageWriter:
+    """
+    Persistence for chat turns
+
+    In "sync" mode a turn is written and committed on the request's session,
+    as before. In "batched" mode turns are queued and an async writer task
+    stores them with multi-row INSERTs in one transaction per flush interval
+    (or sooner once the batch size is reached). Readers call
+    `flush_conversation` first so they always see their own writes.
+
+    A failed flush is retried with backoff; after
+    `message_flush_max_attempts` failures in a row the turns are written one
+    at a time, so a single row the database rejects is logged and dropped
+    instead of blocking every later turn.
+    """
+
+    def __init__(self):
+        self.mode = settings.message_persistence
+        self._pending: List[Dict] = []
+        # Turns per conversation that are queued or being written, until committed
+        self._pending_conversations: Dict[str, int] = {}
+        self._failures = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def batched(self) -> bool:
+        return self.mode == "batched"
+
+    async def start(self):
+        if self.batched and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Batched message writer started")
+
+    async def stop(self):
+        """Stop the writer task and flush everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def save_turn(
+        self,
+        db: AsyncSession,
+        conversation_id: str,
+        messages: List[Dict],
+        title: Optional[str] = None,
+    ):
+        """
+        Persist the messages of one turn
+
+        Args:
+            conversation_id: Conversation the messages belong to
+            messages: Dicts with role, content, created_at and optional meta
+            title: Set only when the conversation is new and must be created
+        """
+        now = datetime.utcnow()
+        if not self.batched:
+            summary = summarize_messages(messages)
+            if title is not None:
+                db.add(
+                    Conversation(
+                        id=conversation_id,
+                        title=title,
+                        created_at=now,
+                        updated_at=now,
+                        message_count=summary["count"],
+                        last_message_at=summary["last_at"],
+                        last_message_preview=summary["preview"],
+                        token_total=summary["tokens"],
+                    )
+                )
+            else:
+                await db.execute(
+                    apply_summary_statement().where(Conversation.id == conversation_id),
+                    {
+                        "b_count": summary["count"],
+                        "b_tokens": summary["tokens"],
+                        "b_last_at": summary["last_at"],
+                        "b_preview": summary["preview"],
+                        "b_updated_at": now,
+                    },
+                )
+            for message in messages:
+                db.add(Message(conversation_id=conversation_id, **message))
+            await db.commit()
+            return
+
+        self._pending.append(
+            {
+                "conversation_id": conversation_id,
+                "title": title,
+                "messages": messages,
+                "updated_at": now,
+            }
+        )
+        self._pending_conversations[conversation_id] = (
+            self._pending_conversations.get(conversation_id, 0) + 1
+        )
+        if len(self._pending) >= settings.message_flush_batch_size and self._wakeup:
+            self._wakeup.set()
+
+    def has_pending(self, conversation_id: str) -> bool:
+        return conversation_id in self._pending_conversations
+
+    async def flush_conversation(self, conversation_id: str):
+        """Make queued writes for a conversation visible before reading it"""
+        if self.has_pending(conversation_id):
+            await self.flush()
+
+    async def _run(self):
+        interval = settings.message_flush_interval_ms / 1000
+        while True:
+            # Back off while flushes keep failing
+            timeout = interval * 2 ** min(self._failures, 6)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Shielded so stop() can't cancel a write halfway through
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+
+            try:
+                await self._write(batch)
+                self._failures = 0
+                self._settled(batch)
+                return
+            except Exception as e:
+                self._failures += 1
+                if self._failures < settings.message_flush_max_attempts:
+                    logger.error(
+                        f"Error flushing {len(batch)} queued turns "
+                        f"(attempt {self._failures}), will retry: {e}"
+                    )
+                    self._pending = batch + self._pending
+                    return
+                logger.error(
+                    f"Error flushing {len(batch)} queued turns {self._failures} times, "
+                    f"writing them one at a time: {e}"
+                )
+
+            retry = []
+            for turn in batch:
+                try:
+                    await self._write([turn])
+                except Exception as e:
+                    if _is_connection_error(e):
+                        retry.append(turn)
+                        continue
+                    logger.error(
+                        f"Dropping queued turn for conversation {turn['conversation_id']} "
+                        f"({len(turn['messages'])} messages) that cannot be written: {e}"
+                    )
+                self._settled([turn])
+            self._pending = retry + self._pending
+            self._failures = self._failures if retry else 0
+
+    def _settled(self, batch: List[Dict]):
+        """Turns that are committed (or dropped) no longer hold back readers"""
+        for turn in batch:
+            cid = turn["conversation_id"]
+            remaining = self._pending_conversations.get(cid, 0) - 1
+            if remaining > 0:
+                self._pending_conversations[cid] = remaining
+            else:
+                self._pending_conversations.pop(cid, None)
+
+    async def _write(self, batch: List[Dict]):
+        new_conversations = {}
+        summaries: Dict[str, Dict] = {}
+        rows = []
+        for turn in batch:
+            cid = turn["conversation_id"]
+            if turn["title"] is not None and cid not in new_conversations:
+                new_conversations[cid] = {
+                    "id": cid,
+                    "title": turn["title"],
+                    "meta": {},
+                    "created_at": turn["updated_at"],
+                    "updated_at": turn["updated_at"],
+                    "message_count": 0,
+                    "token_total": 0,
+                    "last_message_at": turn["updated_at"],
+                }
+
+            summary = summarize_messages(turn["messages"])
+            merged = summaries.setdefault(
+                cid, {"b_cid": cid, "b_count": 0, "b_tokens": 0}
+            )
+            merged["b_count"] += summary["count"]
+            merged["b_tokens"] += summary["tokens"]
+            merged["b_last_at"] = summary["last_at"]
+            merged["b_preview"] = summary["preview"]
+            merged["b_updated_at"] = turn["updated_at"]
+
+            rows.extend(
+                {"conversation_id": cid, "meta": {}, **message}
+                for message in turn["messages"]
+            )
+
+        async with AsyncSessionLocal() as session:
+            if new_conversations:
+                await session.execute(
+                    insert_ignore(Conversation), list(new_conversations.values())
+                )
+            if rows:
+                await session.execute(insert(Message), rows)
+            await session.execute(
+                apply_summary_statement().where(Conversation.id == bindparam("b_cid")),
+                list(summaries.values()),
+            )
+            await session.commit()
+
+        logger.info(f"Flushed {len(rows)} messages from {len(batch)} turns")
+
+
+def _is_connection_error(error: Exception) -> bool:
+    """Whether a failed write may succeed later, as opposed to a rejected row"""
+    if isinstance(error, OperationalError):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def summarize_messages(messages: List[Dict]) -> Dict:
+    """Summary deltas for a group of messages, in chronological order"""
+    last = messages[-1]
+    return {
+        "count": len(messages),
+        "tokens": sum(estimate_tokens(m["content"]) for m in messages),
+        "last_at": last["created_at"],
+        "preview": last["content"][:PREVIEW_LENGTH],
+    }
+
+
+def apply_summary_statement():
+    """UPDATE adding summary deltas to a conversation row (bind params b_*)"""
+    table = Conversation.__table__
+    return update(table).values(
+        message_count=func.coalesce(table.c.message_count, 0) + bindparam("b_count"),
+        token_total=func.coalesce(table.c.token_total, 0) + bindparam("b_tokens"),
+        last_message_at=bindparam("b_last_at"),
+        last_message_preview=bindparam("b_preview"),
+        updated_at=bindparam("b_updated_at"),
+    )
+
+
+def backfill_conversation_summaries(connection):
+    """Compute summaries for conversations created before they existed (run_sync)"""
+    connection.execute(
+        text(
+            f"""
+            UPDATE conversations SET
+                message_count = (
+                    SELECT count(*) FROM messages m WHERE m.conversation_id = conversations.id
+                ),
+                token_total = (
+                    SELECT coalesce(sum(length(m.content)), 0) / 4
+                    FROM messages m WHERE m.conversation_id = conversations.id
+                ),
+                last_message_at = coalesce(
+                    (SELECT max(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id),
+                    created_at
+                ),
+                last_message_preview = (
+                    SELECT substr(m.content, 1, {PREVIEW_LENGTH}) FROM messages m
+                    WHERE m.conversation_id = conversations.id
+                    ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+                )
+            WHERE message_count IS NULL
+            """
+        )
+    )
+    logger.info("Backfilled conversation summaries")
+
+
+message_writer = MessageWriter()
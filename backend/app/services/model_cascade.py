@@ -0,0 +1,182 @@
+import json
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import settings
+from services.llm_service import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Logistic-regression weights over the features in `extract_features`.
+# Overridable with CASCADE_CLASSIFIER_WEIGHTS (a JSON file with the same keys)
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    "bias": -1.6,
+    "log_tokens": 0.45,
+    "reasoning_terms": 1.1,
+    "code": 1.8,
+    "math": 0.9,
+    "questions": 0.35,
+    "list_request": 0.6,
+    "smalltalk": -2.0,
+}
+
+_REASONING = re.compile(
+    r"\b(why|explain|compare|analy[sz]e|design|implement|prove|derive|debug|"
+    r"optimi[sz]e|evaluate|trade-?offs?|step[- ]by[- ]step|architecture|difference)\b",
+    re.I,
+)
+_CODE = re.compile(r"```|\bdef |\bclass |\bfunction\b|\bimport |[{};]\s*$|Traceback", re.I | re.M)
+_MATH = re.compile(r"\d+\s*[-+*/^=]\s*\d+|\b(integral|equation|probability|matrix)\b", re.I)
+_LIST_REQUEST = re.compile(r"\b(list|outline|plan|steps|pros and cons)\b", re.I)
+_SMALLTALK = re.compile(
+    r"^\s*(hi|hello|hey|thanks|thank you|ok|okay|cool|great|bye|good (morning|night))\b",
+    re.I,
+)
+_UNCERTAIN = re.compile(
+    r"\b(i('m| am) not sure|i don'?t know|i cannot|i can'?t (help|answer)|"
+    r"as an ai|i('m| am) unable|i do not have (enough )?information)\b",
+    re.I,
+)
+
+
+def extract_features(text: str) -> Dict[str, float]:
+    """Cheap text features of a user turn for the difficulty classifier"""
+    return {
+        "log_tokens": math.log1p(estimate_tokens(text)),
+        "reasoning_terms": min(len(_REASONING.findall(text)), 3),
+        "code": 1.0 if _CODE.search(text) else 0.0,
+        "math": 1.0 if _MATH.search(text) else 0.0,
+        "questions": min(text.count("?"), 3),
+        "list_request": 1.0 if _LIST_REQUEST.search(text) else 0.0,
+        "smalltalk": 1.0 if _SMALLTALK.match(text) and len(text) < 60 else 0.0,
+    }
+
+
+def load_weights() -> Dict[str, float]:
+    weights = dict(DEFAULT_WEIGHTS)
+    if settings.cascade_classifier_weights:
+        with open(settings.cascade_classifier_weights) as f:
+            weights.update(json.load(f))
+    return weights
+
+
+@dataclass
+class RouteDecision:
+    model: str
+    reason: str
+    score: float
+    prompt_tokens: int
+
+    @property
+    def small(self) -> bool:
+        return self.model != settings.ollama_model
+
+
+class ModelCascade:
+    """
+    Picks the Ollama model for a turn and checks small-model answers
+
+    Turns go to `ollama_small_model` unless RAG context is present, the
+    prompt is long, or the classifier scores the latest user message at or
+    above `cascade_score_threshold`. Small-model answers that fail
+    `acceptable` are regenerated with `ollama_model`.
+    """
+
+    def __init__(self):
+        self.small_model = settings.ollama_small_model
+        self.large_model = settings.ollama_model
+        self.weights = load_weights()
+        self.counts = {"small": 0, "large": 0, "escalated": 0}
+        # In large-model token equivalents, see `record`
+        self.estimated_savings = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.small_model) and self.small_model != self.large_model
+
+    def score(self, text: str) -> float:
+        """Probability-like difficulty score of a user message"""
+        features = extract_features(text)
+        z = self.weights["bias"] + sum(
+            self.weights.get(name, 0.0) * value for name, value in features.items()
+        )
+        return 1 / (1 + math.exp(-z))
+
+    def route(
+        self,
+        messages: List[Dict[str, str]],
+        context: Optional[str] = None,
+        small_available: bool = True,
+    ) -> RouteDecision:
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        if not self.enabled:
+            return RouteDecision(self.large_model, "cascade disabled", 1.0, prompt_tokens)
+
+        last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        score = self.score(last_user)
+        if context:
+            reason = "rag context"
+        elif prompt_tokens > settings.cascade_max_prompt_tokens:
+            reason = "long prompt"
+        elif score >= settings.cascade_score_threshold:
+            reason = "classifier"
+        elif not small_available:
+            reason = "small model unavailable"
+        else:
+            return RouteDecision(self.small_model, "simple turn", score, prompt_tokens)
+        return RouteDecision(self.large_model, reason, score, prompt_tokens)
+
+    def acceptable(self, answer: str, final: bool = True) -> bool:
+        """
+        Quality check for small-model answers
+
+        With `final=False` only the beginning of a streamed answer is
+        available, so length and repetition are not judged.
+        """
+        if _UNCERTAIN.search(answer):
+            return False
+        if not final:
+            return True
+        words = answer.split()
+        if len(answer.strip()) < settings.cascade_min_answer_chars:
+            return False
+        if len(words) >= 40 and len(set(words)) / len(words) < 0.3:
+            return False
+        return True
+
+    def record(self, decision: RouteDecision, answer: str, escalated: bool = False):
+        """Count the outcome and log the estimated saving against the large model"""
+        tokens = decision.prompt_tokens + estimate_tokens(answer)
+        small_cost = settings.cascade_small_model_cost
+        if escalated:
+            self.counts["escalated"] += 1
+            self.counts["large"] += 1
+            # The small attempt was wasted work on top of the large answer
+            saved = -tokens * small_cost
+        elif decision.small:
+            self.counts["small"] += 1
+            saved = tokens * (1 - small_cost)
+        else:
+            self.counts["large"] += 1
+            saved = 0.0
+        self.estimated_savings += saved
+
+        if self.enabled:
+            served_by = self.large_model if escalated else decision.model
+            logger.info(
+                f"Cascade: {served_by} served the turn ({decision.reason}, "
+                f"score={decision.score:.2f}{', escalated' if escalated else ''}), "
+                f"saved ~{saved:.0f} large-model tokens (total {self.estimated_savings:.0f})"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "small_model": self.small_model or None,
+            "large_model": self.large_model,
+            **self.counts,
+            "estimated_savings_tokens": round(self.estimated_savings),
+        }
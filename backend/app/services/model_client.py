@@ -0,0 +1,291 @@
+"""
+Client side of the shared model server (services.model_server)
+
+Requests and replies are length-prefixed JSON frames over a Unix socket.
+Bulk data (embedding vectors, audio samples) goes through a shared memory
+buffer owned by each connection instead of the socket: the client names
+its buffer in every request, and the server reads audio from it or writes
+vectors into it. A connection has one request in flight at a time, so the
+buffer is never shared between requests.
+"""
+import json
+import logging
+import queue
+import socket
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!I")
+MIN_BUFFER_BYTES = 1024 * 1024
+# Embedding width assumed before a model's first reply (fits MiniLM to large BERTs)
+DEFAULT_DIMENSION_HINT = 1024
+
+
+class ModelServerError(Exception):
+    """The model server is unreachable or failed a request"""
+
+    def __init__(self, message: str, kind: str = "error", needed_bytes: int = 0):
+        super().__init__(message)
+        self.kind = kind
+        # For kind "buffer_too_small": the shared buffer size the reply needs
+        self.needed_bytes = needed_bytes
+
+
+def encode_frame(message: dict) -> bytes:
+    payload = json.dumps(message).encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Open another process's segment without taking ownership of it
+
+    Before Python 3.13 attaching registers the segment with this process's
+    resource tracker, which would unlink it when this process exits.
+    """
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+    return segment
+
+
+class _Connection:
+    """One socket to the server and the shared buffer its requests use"""
+
+    def __init__(self, path: str, timeout: float):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.buffer: Optional[shared_memory.SharedMemory] = None
+        self.replied = False  # any reply bytes received for the current request
+
+    def reserve(self, nbytes: int) -> shared_memory.SharedMemory:
+        """The shared buffer, replaced with a larger one if it can't hold `nbytes`"""
+        if self.buffer is None or self.buffer.size < nbytes:
+            self.release_buffer()
+            size = MIN_BUFFER_BYTES
+            while size < nbytes:
+                size *= 2
+            self.buffer = shared_memory.SharedMemory(create=True, size=size)
+        return self.buffer
+
+    def release_buffer(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer.unlink()
+            self.buffer = None
+
+    def _recv_exact(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Model server closed the connection")
+            self.replied = True
+            data.extend(chunk)
+        return bytes(data)
+
+    def request(self, message: dict) -> dict:
+        if self.buffer is not None:
+            message = {**message, "buffer": self.buffer.name}
+        self.replied = False
+        self.sock.sendall(encode_frame(message))
+        (size,) = FRAME_HEADER.unpack(self._recv_exact(FRAME_HEADER.size))
+        reply = json.loads(self._recv_exact(size))
+        if reply.get("error"):
+            raise ModelServerError(
+                reply["error"], reply.get("kind", "error"), reply.get("needed_bytes", 0)
+            )
+        return reply
+
+    def close(self):
+        try:
+            self.sock.close()
+        finally:
+            self.release_buffer()
+
+
+class ModelServerClient:
+    """
+    Thread-safe client with a small pool of connections
+
+    Calls block, so async code runs them in a thread. A connection that
+    fails mid-request is discarded rather than reused. An idle connection
+    the server has since closed (say, it restarted) fails before any reply
+    arrives; the request is then retried once on a new connection, which is
+    safe because every op can be repeated.
+    """
+
+    def __init__(self, path: str, connections: int, timeout: float):
+        self.path = path
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[_Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, connections))
+        self._dimensions: Dict[str, int] = {}
+        self._closed = False
+
+    def _acquire(self) -> Tuple[_Connection, bool]:
+        """A connection and whether it was reused from the idle pool"""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            pass
+        try:
+            return _Connection(self.path, self.timeout), False
+        except OSError as e:
+            self._slots.release()
+            raise ModelServerError(
+                f"Model server not reachable at {self.path} ({e}). "
+                "Start it with `python -m services.model_server`."
+            )
+
+    def _call(self, message: dict, prepare=None, finish=None):
+        """
+        Run one request on a pooled connection
+
+        `prepare(connection)` fills the shared buffer before the request;
+        `finish(connection, reply)` reads results out of it afterwards.
+        """
+        connection, reused = self._acquire()
+        healthy = False
+        try:
+            if prepare is not None:
+                prepare(connection)
+            try:
+                reply = connection.request(message)
+            except ConnectionError as e:
+                if not reused or connection.replied:
+                    raise
+                logger.info(f"Idle model server connection was closed ({e}), reconnecting")
+                connection.close()
+                connection = _Connection(self.path, self.timeout)
+                if prepare is not None:
+                    prepare(connection)
+                reply = connection.request(message)
+            result = finish(connection, reply) if finish is not None else reply
+            healthy = True
+            return result
+        except ModelServerError:
+            # The server answered, so the connection is still in sync
+            healthy = True
+            raise
+        except (OSError, ValueError) as e:
+            logger.warning(f"Model server connection dropped: {e}")
+            raise ModelServerError(f"Model server request failed: {e}")
+        finally:
+            if healthy and not self._closed:
+                self._idle.put(connection)
+            else:
+                connection.close()
+            self._slots.release()
+
+    def embed(self, model: str, texts: List[str]) -> np.ndarray:
+        """Normalized (n, dim) float32 embeddings, batched server-side with other workers' requests"""
+        needed = len(texts) * self._dimensions.get(model, DEFAULT_DIMENSION_HINT) * 4
+
+        def prepare(connection: _Connection):
+            connection.reserve(needed)
+
+        def finish(connection: _Connection, reply: dict) -> np.ndarray:
+            view = np.ndarray(tuple(reply["shape"]), dtype=np.float32, buffer=connection.buffer.buf)
+            vectors = view.copy()
+            del view
+            return vectors
+
+        message = {"op": "embed", "model": model, "texts": texts}
+        try:
+            vectors = self._call(message, prepare, finish)
+        except ModelServerError as e:
+            if e.kind != "buffer_too_small":
+                raise
+            # First call for a model wider than the hint
+            needed = e.needed_bytes
+            vectors = self._call(message, prepare, finish)
+        self._dimensions[model] = vectors.shape[1]
+        return vectors
+
+    def transcribe(
+        self,
+        audio: np.ndarray,
+        language: Optional[str],
+        beam_size: int,
+        initial_prompt: Optional[str],
+        timeout: Optional[float] = None,
+    ) -> dict:
+        """Transcribe 16 kHz mono float32 samples; returns the server's result fields"""
+        samples = np.ascontiguousarray(audio, dtype=np.float32)
+
+        def prepare(connection: _Connection):
+            buffer = connection.reserve(samples.nbytes)
+            view = np.ndarray(samples.shape, dtype=np.float32, buffer=buffer.buf)
+            view[:] = samples
+            del view
+
+        return self._call(
+            {
+                "op": "transcribe",
+                "samples": int(samples.size),
+                "language": language,
+                "beam_size": beam_size,
+                "initial_prompt": initial_prompt,
+                "timeout": timeout,
+            },
+            prepare,
+        )
+
+    def stats(self) -> dict:
+        return self._call({"op": "stats"})
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_client: Optional[ModelServerClient] = None
+_client_lock = threading.Lock()
+
+
+def get_model_client() -> ModelServerClient:
+    """The process's client for `model_server_socket` (created on first use)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ModelServerClient(
+                settings.model_server_socket,
+                settings.model_server_connections,
+                settings.model_server_timeout_seconds,
+            )
+        return _client
+
+
+def model_server_stats() -> Optional[dict]:
+    """The server's stats for /metrics, or None when no model server is configured"""
+    if not settings.model_server_socket:
+        return None
+    try:
+        return get_model_client().stats()
+    except ModelServerError as e:
+        return {"error": str(e)}
+
+
+def close_model_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
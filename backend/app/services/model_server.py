@@ -0,0 +1,305 @@
+"""
+Shared model server
+
+Holds one copy of each embedding model and of Whisper for every API worker
+on the machine, which otherwise each load their own. Workers connect over a
+Unix socket (protocol in services.model_client). Embedding requests that
+arrive within `model_server_batch_window_ms` of each other, from any worker,
+are encoded as one batch; transcriptions go through a TranscriptionPool, so
+clips from different workers are queued and packed together.
+
+Run from backend/app, then start the API with the same MODEL_SERVER_SOCKET:
+
+    MODEL_SERVER_SOCKET=/tmp/solverai-models.sock python -m services.model_server
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+from services.deadline import DeadlineExceeded, deadline_scope
+from services.model_client import FRAME_HEADER, attach_shared_memory, encode_frame
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _EmbedJob:
+    texts: List[str]
+    future: asyncio.Future
+
+
+class EmbeddingBatcher:
+    """
+    Queue of embedding requests for one model
+
+    A single consumer task takes the first waiting request, gathers more for
+    up to the batch window (or `model_server_max_batch_texts` texts), encodes
+    them in one call on the model's own thread and splits the rows back out.
+    Requests longer than `model_server_max_batch_texts` are queued one chunk
+    at a time, so a bulk ingest never holds queries up for more than a chunk.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.backend = None
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.task = asyncio.create_task(self._run())
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        step = settings.model_server_max_batch_texts
+        parts = []
+        for start in range(0, len(texts), step) or [0]:
+            job = _EmbedJob(texts[start:start + step], loop.create_future())
+            self.queue.put_nowait(job)
+            parts.append(await job.future)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self.backend is None:
+            from services.embedding_service import build_embedding_backend
+
+            self.backend = build_embedding_backend(self.model_name)
+        return self.backend.embed_documents(texts)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            batch = [job]
+            total = len(job.texts)
+            deadline = loop.time() + settings.model_server_batch_window_ms / 1000
+            while total < settings.model_server_max_batch_texts:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    candidate = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(candidate)
+                total += len(candidate.texts)
+
+            batch = [j for j in batch if not j.future.done()]
+            if not batch:
+                continue
+            texts = [text for j in batch for text in j.texts]
+            try:
+                vectors = await loop.run_in_executor(self.executor, self._encode, texts)
+            except Exception as e:
+                logger.error(f"Embedding with {self.model_name} failed: {e}")
+                for j in batch:
+                    if not j.future.done():
+                        j.future.set_exception(e)
+                continue
+
+            self.requests += len(batch)
+            self.texts += len(texts)
+            self.batches += 1
+            offset = 0
+            for j in batch:
+                if not j.future.done():
+                    j.future.set_result(vectors[offset:offset + len(j.texts)])
+                offset += len(j.texts)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.backend is not None,
+            "dimension": self.backend.dimension if self.backend is not None else None,
+            "requests": self.requests,
+            "texts": self.texts,
+            "batches": self.batches,
+            "avg_batch_texts": round(self.texts / self.batches, 1) if self.batches else 0.0,
+            "queued": self.queue.qsize(),
+        }
+
+    async def shutdown(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+
+class ModelServer:
+    """Serves embedding and transcription requests from API workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.batchers: Dict[str, EmbeddingBatcher] = {}
+        self.transcription_pool = None
+        self.connections = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def _batcher(self, model_name: str) -> EmbeddingBatcher:
+        batcher = self.batchers.get(model_name)
+        if batcher is None:
+            batcher = EmbeddingBatcher(model_name)
+            self.batchers[model_name] = batcher
+        return batcher
+
+    def _pool(self):
+        if self.transcription_pool is None:
+            from services.transcription_pool import TranscriptionPool, detect_device
+
+            self.transcription_pool = TranscriptionPool(*detect_device())
+        return self.transcription_pool
+
+    async def start(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # Left behind by a server that didn't shut down cleanly
+                os.unlink(self.path)
+            else:
+                raise RuntimeError(f"A model server is already listening on {self.path}")
+            finally:
+                probe.close()
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o660)
+        logger.info(f"Model server listening on {self.path}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        segment = None
+        try:
+            while True:
+                try:
+                    (size,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                    request = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    break
+
+                # Each connection keeps its client's buffer mapped until the
+                # client replaces it with a larger one
+                name = request.get("buffer")
+                if name and (segment is None or segment.name != name.lstrip("/")):
+                    if segment is not None:
+                        segment.close()
+                    segment = attach_shared_memory(name)
+
+                try:
+                    reply = await self._dispatch(request, segment)
+                except DeadlineExceeded as e:
+                    reply = {"error": str(e), "kind": "deadline"}
+                except Exception as e:
+                    from services.transcription_pool import TranscriptionQueueFull
+
+                    kind = "queue_full" if isinstance(e, TranscriptionQueueFull) else "error"
+                    if kind == "error":
+                        logger.error(f"Model server request {request.get('op')} failed: {e}")
+                    reply = {"error": str(e) or type(e).__name__, "kind": kind}
+                writer.write(encode_frame(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections -= 1
+            if segment is not None:
+                segment.close()
+            writer.close()
+
+    async def _dispatch(self, request: dict, segment) -> dict:
+        op = request.get("op")
+        if op == "embed":
+            vectors = await self._batcher(request["model"]).embed(request["texts"])
+            if segment is None or segment.size < vectors.nbytes:
+                return {
+                    "error": "Shared buffer too small for the embeddings",
+                    "kind": "buffer_too_small",
+                    "needed_bytes": vectors.nbytes,
+                }
+            view = np.ndarray(vectors.shape, dtype=np.float32, buffer=segment.buf)
+            view[:] = vectors
+            del view
+            return {"shape": list(vectors.shape)}
+
+        if op == "transcribe":
+            view = np.ndarray((request["samples"],), dtype=np.float32, buffer=segment.buf)
+            audio = view.copy()
+            del view
+            timeout = request.get("timeout")
+            scope = deadline_scope(timeout) if timeout is not None else contextlib.nullcontext()
+            with scope:
+                result = await self._pool().submit(
+                    audio,
+                    language=request.get("language"),
+                    beam_size=request.get("beam_size", 5),
+                    initial_prompt=request.get("initial_prompt"),
+                )
+            return {"result": asdict(result)}
+
+        if op == "stats":
+            return self.stats()
+
+        raise ValueError(f"Unknown model server op '{op}'")
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "connections": self.connections,
+            "embedding_models": {name: b.stats() for name, b in self.batchers.items()},
+            "whisper": {
+                "loaded": self.transcription_pool is not None,
+                "queued": self.transcription_pool.queue.qsize()
+                if self.transcription_pool is not None and self.transcription_pool.queue is not None
+                else 0,
+            },
+        }
+
+    async def shutdown(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for batcher in self.batchers.values():
+            await batcher.shutdown()
+        if self.transcription_pool is not None:
+            await self.transcription_pool.shutdown()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+async def serve(path: str):
+    server = ModelServer(path)
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    logger.info("Shutting down model server...")
+    await server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding and Whisper model server")
+    parser.add_argument(
+        "--socket",
+        default=settings.model_server_socket,
+        help="Unix socket path (default: MODEL_SERVER_SOCKET)",
+    )
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("Set MODEL_SERVER_SOCKET or pass --socket")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == "__main__":
+    main()
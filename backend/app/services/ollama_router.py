@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+import httpx
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class NoReplicaAvailable(Exception):
+    """No healthy Ollama replica serves the requested model"""
+
+
+class OllamaReplica:
+    """One Ollama endpoint and its routing state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.models: Set[str] = set()
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+
+    def serves(self, model: str) -> bool:
+        # Before the first health check the model list is unknown
+        return not self.models or model in self.models or f"{model}:latest" in self.models
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "models": sorted(self.models),
+        }
+
+
+class OllamaRouter:
+    """
+    Routes generation requests across Ollama replicas
+
+    Picks the replica with the fewest in-flight requests, but keeps a
+    conversation on the replica chosen for it by rendezvous hashing (so its
+    prompt cache is reused) unless that replica is more than
+    `ollama_affinity_slack` requests busier than the least-loaded one.
+    Replicas are ejected after consecutive failures and re-admitted once a
+    health probe succeeds after the cooldown.
+
+    Background (batch) requests wait until no more than
+    `batch_max_interactive` interactive requests are in flight, so bulk jobs
+    only use capacity that chats leave idle.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [OllamaReplica(url) for url in urls]
+        self.interactive = 0
+        self._last_probe = 0.0
+        self._probe_lock = asyncio.Lock()
+        self._interactive_changed = asyncio.Condition()
+
+    async def _probe(self, replica: OllamaReplica):
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                response = await client.get(f"{replica.url}/api/tags")
+                response.raise_for_status()
+            replica.models = {m["name"] for m in response.json().get("models", [])}
+            if not replica.healthy:
+                logger.info(f"Ollama replica {replica.url} is healthy again")
+            replica.healthy = True
+            replica.failures = 0
+        except Exception as e:
+            logger.warning(f"Ollama replica {replica.url} not available: {e}")
+            self._eject(replica)
+
+    async def refresh(self, force: bool = False):
+        """Probe replicas if the last health check is older than the interval"""
+        if not force and time.monotonic() - self._last_probe < settings.ollama_health_interval_seconds:
+            return
+        async with self._probe_lock:
+            now = time.monotonic()
+            if not force and now - self._last_probe < settings.ollama_health_interval_seconds:
+                return
+            # Ejected replicas wait out their cooldown before being probed again
+            due = [r for r in self.replicas if r.healthy or now >= r.ejected_until]
+            await asyncio.gather(*[self._probe(r) for r in due])
+            self._last_probe = time.monotonic()
+
+    def available(self, model: Optional[str] = None) -> bool:
+        return any(r.healthy and (model is None or r.serves(model)) for r in self.replicas)
+
+    def _eject(self, replica: OllamaReplica):
+        if replica.healthy:
+            logger.warning(f"Ejecting Ollama replica {replica.url}")
+        replica.healthy = False
+        replica.ejected_until = time.monotonic() + settings.ollama_eject_seconds
+
+    def report_failure(self, replica: OllamaReplica):
+        replica.failures += 1
+        if replica.failures >= settings.ollama_eject_after_failures:
+            self._eject(replica)
+
+    def report_success(self, replica: OllamaReplica):
+        replica.failures = 0
+
+    def choose(
+        self,
+        model: str,
+        affinity_key: Optional[str] = None,
+        exclude: Optional[Set[str]] = None,
+    ) -> OllamaReplica:
+        candidates = [
+            r for r in self.replicas
+            if r.healthy and r.serves(model) and r.url not in (exclude or ())
+        ]
+        if not candidates:
+            raise NoReplicaAvailable(f"No healthy Ollama replica serves {model}")
+
+        least = min(candidates, key=lambda r: r.outstanding)
+        if affinity_key is None:
+            return least
+        preferred = max(
+            candidates,
+            key=lambda r: hashlib.md5(f"{affinity_key}|{r.url}".encode()).digest(),
+        )
+        if preferred.outstanding - least.outstanding <= settings.ollama_affinity_slack:
+            return preferred
+        return least
+
+    async def wait_for_quiet(self, max_interactive: int):
+        """Wait until no more than `max_interactive` interactive requests are in flight"""
+        async with self._interactive_changed:
+            await self._interactive_changed.wait_for(lambda: self.interactive <= max_interactive)
+
+    @asynccontextmanager
+    async def lease(
+        self,
+        model: str,
+        affinity_key: Optional[str] = None,
+        exclude: Optional[Set[str]] = None,
+        background: bool = False,
+    ) -> AsyncIterator[OllamaReplica]:
+        """Reserve a replica for the duration of one request"""
+        if background:
+            await self.wait_for_quiet(settings.batch_max_interactive)
+        else:
+            self.interactive += 1
+
+        try:
+            replica = self.choose(model, affinity_key, exclude)
+            replica.outstanding += 1
+            replica.requests += 1
+            try:
+                yield replica
+            finally:
+                replica.outstanding -= 1
+        finally:
+            if not background:
+                self.interactive -= 1
+                async with self._interactive_changed:
+                    self._interactive_changed.notify_all()
+
+    def status(self) -> List[Dict]:
+        return [r.status() for r in self.replicas]
@@ -1,100 +1,290 @@
+import asyncio
 import logging
+import multiprocessing
 import os
-from typing import List, Optional, Sequence
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
 from langchain.docstore.document import Document
 from config import settings
+from services.deadline import DeadlineExceeded, check_deadline, has_budget
+from services.embedding_service import get_embedding_backend, release_embedding_backends
+from services.model_client import ModelServerError
+from services.retrieval_cache import RetrievalCache
+from services.ingestion_worker import (
+    build_text_splitter,
+    init_worker,
+    load_chunks,
+    parse_and_embed,
+)
+from services.vector_store import (
+    DEFAULT_COLLECTION,
+    VectorBackend,
+    VectorStore,
+    chunk_id,
+    get_vector_backend,
+)
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class IndexSpec:
+    """What an index generation is embedded with; vectors of different specs don't mix"""
+
+    embedding_model: str
+    chunk_size: int
+    chunk_overlap: int
+
+    @classmethod
+    def from_settings(cls) -> "IndexSpec":
+        return cls(settings.embedding_model, settings.chunk_size, settings.chunk_overlap)
+
+    @classmethod
+    def from_manifest(cls, manifest: dict) -> "IndexSpec":
+        return cls(manifest["embedding_model"], manifest["chunk_size"], manifest["chunk_overlap"])
+
+    def manifest(self, generation: int, documents: Optional[Dict[str, Optional[str]]] = None) -> dict:
+        return {
+            "generation": generation,
+            "embedding_model": self.embedding_model,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "documents": documents,
+        }
+
+
+@dataclass
+class IngestPool:
+    """Bulk ingestion workers, loaded with the embedding model of `spec`"""
+
+    executor: ProcessPoolExecutor
+    spec: IndexSpec
+
+
+class IndexBuilder:
+    """
+    An index generation being built or reconciled off the live path
+
+    Has its own store, embedding model and splitter, so it can use another
+    spec than the live index. `documents` maps each document processed into
+    this generation to the `ingested_at` it had then (ISO string), which is
+    how a later activation finds documents that changed since. Not
+    thread-safe; the rebuild job drives it one step at a time.
+    """
+
+    def __init__(
+        self,
+        generation: int,
+        spec: IndexSpec,
+        backend: VectorBackend,
+        documents: Optional[Dict[str, Optional[str]]] = None,
+    ):
+        self.generation = generation
+        self.spec = spec
+        self.backend = backend
+        self.documents: Dict[str, Optional[str]] = dict(documents or {})
+        self.embeddings = get_embedding_backend(spec.embedding_model)
+        self.text_splitter = build_text_splitter(spec.chunk_size, spec.chunk_overlap)
+        self.store: VectorStore = backend.open(generation, self.embeddings)
+
+    def load_chunks(self, file_path: str, document_id: str, collection: str) -> List[Document]:
+        return load_chunks(file_path, document_id, self.text_splitter, collection)
+
+    def add_chunks(self, chunks: List[Document]):
+        """Embed and add chunks of one document (callers pass slices to throttle)"""
+        if not chunks:
+            return
+        texts = [chunk.page_content for chunk in chunks]
+        ids = [
+            chunk_id(chunk.metadata["document_id"], chunk.metadata["chunk_index"])
+            for chunk in chunks
+        ]
+        self.store.add(ids, texts, self.embeddings.embed_documents(texts), [chunk.metadata for chunk in chunks])
+
+    def remove_document(self, document_id: str) -> int:
+        return self.store.delete_document(document_id)
+
+    def document_ids(self) -> Set[str]:
+        """Documents with at least one chunk in this generation"""
+        return self.store.document_ids()
+
+    def save(self):
+        self.store.save()
+        self.backend.write_manifest(self.generation, self.spec.manifest(self.generation, self.documents))
+
+
 class RagService:
-    """Service for RAG (Retrieval Augmented Generation) operations"""
+    """
+    Service for RAG (Retrieval Augmented Generation) operations
+
+    The index lives in numbered generations in a vector store backend
+    (VECTOR_STORE: FAISS files or pgvector tables), which also keeps the
+    pointer to the live generation and each generation's manifest. The
+    manifest records the embedding model and chunking it was built with, so
+    changing those settings never mixes incompatible vectors into the live
+    index; a rebuild (services.index_rebuild) builds a new generation and
+    swaps it in with activate().
+    """
 
     def __init__(self):
-        self.vector_db_path = settings.absolute_vector_db_path
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=settings.embedding_model
+        self.backend = get_vector_backend()
+        self.index_generation, self.spec = self._read_current()
+        self.embeddings = get_embedding_backend(self.spec.embedding_model)
+        self.text_splitter = build_text_splitter(self.spec.chunk_size, self.spec.chunk_overlap)
+        self.cache = RetrievalCache()
+        # Guards the (cache generation, store, model) snapshot taken by queries against a swap
+        self._swap_lock = threading.Lock()
+        # Bulk ingestions in flight; a swap waits for them (their vectors use the live model)
+        self.mutations = 0
+        # Documents changed in the live index while a rebuild tracks changes
+        self._changed: Optional[Set[str]] = None
+        logger.info(
+            f"Opening index generation {self.index_generation} ({self.spec.embedding_model}, "
+            f"{settings.vector_store})"
         )
-        self.vector_store: Optional[FAISS] = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
+        self.vector_store: VectorStore = self.backend.open(self.index_generation, self.embeddings)
+
+    def _read_current(self) -> Tuple[int, IndexSpec]:
+        generation = self.backend.read_current()
+        manifest = self.backend.read_manifest(generation)
+        if manifest and self.backend.has_vectors(generation):
+            return generation, IndexSpec.from_manifest(manifest)
+        # An empty index adopts the settings; an index from before manifests
+        # existed was built with them
+        spec = IndexSpec.from_settings()
+        self.backend.write_manifest(generation, spec.manifest(generation))
+        return generation, spec
+
+    def index_stamp(self) -> dict:
+        """Document columns recording the generation and model a document was just embedded into"""
+        return {
+            "index_generation": self.index_generation,
+            "embedding_model": self.spec.embedding_model,
+        }
+
+    def _snapshot(self) -> Tuple[int, VectorStore, object]:
+        with self._swap_lock:
+            return self.cache.generation, self.vector_store, self.embeddings
+
+    def _record_change(self, document_id: str):
+        if self._changed is not None:
+            self._changed.add(document_id)
+
+    def track_changes(self):
+        """Start recording which documents the live index changes"""
+        self._changed = set()
+
+    def take_changes(self) -> Set[str]:
+        """Documents changed since tracking started or the last call"""
+        changed, self._changed = self._changed or set(), set()
+        return changed
+
+    def stop_tracking(self):
+        self._changed = None
+
+    @property
+    def quiescent(self) -> bool:
+        """No bulk ingestion in flight and no untaken changes (a swap may happen now)"""
+        return self.mutations == 0 and not self._changed
+
+    def new_builder(self, generation: int, spec: IndexSpec) -> IndexBuilder:
+        """An empty generation (loads the spec's model, so call off the event loop)"""
+        self.backend.drop(generation)
+        return IndexBuilder(generation, spec, self.backend)
+
+    def load_builder(self, generation: int) -> IndexBuilder:
+        """
+        A stored generation, opened for reconciling and activation
+
+        Raises:
+            FileNotFoundError: If the generation has no manifest
+        """
+        manifest = self.backend.read_manifest(generation)
+        if manifest is None:
+            raise FileNotFoundError(f"Index generation {generation} not found")
+        return IndexBuilder(
+            generation, IndexSpec.from_manifest(manifest), self.backend, documents=manifest.get("documents")
         )
-        self._initialize_vector_store()
 
-    def _initialize_vector_store(self):
-        """Initialize or load vector store"""
-        try:
-            if os.path.exists(self.vector_db_path) and os.path.exists(
-                os.path.join(self.vector_db_path, "index.faiss")
-            ):
-                logger.info(f"Loading existing vector store from {self.vector_db_path}")
-                self.vector_store = FAISS.load_local(
-                    self.vector_db_path, self.embeddings
-                )
-            else:
-                logger.info("Initializing new vector store")
-                # Create empty vector store
-                self.vector_store = None
-        except Exception as e:
-            logger.error(f"Error initializing vector store: {e}")
-            self.vector_store = None
+    def live_document_ids(self) -> Set[str]:
+        return self.vector_store.document_ids()
 
-    async def ingest_file(self, file_path: str, document_id: str) -> int:
+    def activate(self, builder: IndexBuilder, retired_documents: Dict[str, Optional[str]]):
+        """
+        Swap a saved generation in as the live index
+
+        Synchronous, so no request on the event loop sees a half-swapped
+        state. The live pointer is replaced atomically, and the retired
+        generation's manifest records `retired_documents` so it can be
+        reconciled if it is activated again (rollback).
+
+        Args:
+            builder: Generation to make live; already saved
+            retired_documents: document_id -> ingested_at for the outgoing index
+        """
+        retired = self.index_generation
+        self.backend.write_manifest(retired, self.spec.manifest(retired, retired_documents))
+        self.backend.write_current(builder.generation)
+        self.adopt(builder)
+        logger.info(f"Activated index generation {builder.generation}, replacing {retired}")
+
+    def adopt(self, builder: IndexBuilder):
+        """
+        Serve from `builder`'s generation without touching the live pointer
+
+        Used by activate() and, with shared backends, by nodes following a
+        swap made on another node. Queries running in threads see either
+        the old or the new (store, model) pair.
+        """
+        with self._swap_lock:
+            self.vector_store = builder.store
+            self.embeddings = builder.embeddings
+            self.text_splitter = builder.text_splitter
+            self.spec = builder.spec
+            self.index_generation = builder.generation
+            self.cache.clear()
+        release_embedding_backends({self.spec.embedding_model})
+        logger.info(f"Serving index generation {builder.generation} ({builder.spec.embedding_model})")
+
+    def delete_generation(self, generation: int):
+        """Remove an inactive generation's vectors and manifest"""
+        if generation == self.index_generation:
+            raise ValueError("Cannot delete the live index generation")
+        self.backend.drop(generation)
+
+    async def ingest_file(
+        self, file_path: str, document_id: str, collection: str = DEFAULT_COLLECTION
+    ) -> int:
         """
         Ingest a file into the vector store
 
         Args:
             file_path: Path to the file to ingest
+            collection: Collection (index shard) the document belongs to
 
         Returns:
             Number of chunks added
         """
         try:
-            # Load document
-            if file_path.lower().endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-                documents = loader.load()
-            elif file_path.lower().endswith(".txt"):
-                from langchain_community.document_loaders import TextLoader
-                loader = TextLoader(file_path)
-                documents = loader.load()
-            else:
-                raise ValueError("Unsupported file format. Only PDF and TXT are supported.")
-
-            # Split text
-            chunks = self.text_splitter.split_documents(documents)
-            for idx, chunk in enumerate(chunks):
-                if chunk.metadata is None:
-                    chunk.metadata = {}
-                chunk.metadata.update(
-                    {
-                        "document_id": document_id,
-                        "source": file_path,
-                        "chunk_index": idx,
-                    }
-                )
+            chunks = load_chunks(file_path, document_id, self.text_splitter, collection)
 
             if not chunks:
                 logger.warning("No text chunks found in document")
                 return 0
 
             # Add to vector store
-            ids = [self._build_chunk_id(document_id, idx) for idx in range(len(chunks))]
-
-            if self.vector_store is None:
-                logger.info("Creating new vector store from documents")
-                self.vector_store = FAISS.from_documents(
-                    chunks, self.embeddings, ids=ids
-                )
-            else:
-                logger.info("Adding documents to existing vector store")
-                self.vector_store.add_documents(chunks, ids=ids)
+            ids = [chunk_id(document_id, idx) for idx in range(len(chunks))]
+            texts = [chunk.page_content for chunk in chunks]
+            self.vector_store.add(
+                ids, texts, self.embeddings.embed_documents(texts), [chunk.metadata for chunk in chunks]
+            )
 
+            self.cache.bump_generation()
+            self._record_change(document_id)
             # Save vector store
             self._save_vector_store()
 
@@ -105,8 +295,130 @@ class RagService:
             logger.error(f"Error ingesting file {file_path}: {e}")
             raise
 
+    @contextmanager
+    def ingest_pool(self, files: int, workers: Optional[int] = None):
+        """
+        Worker processes for ingest_files_bulk
+
+        Spawning the workers and loading the embedding model in each costs
+        seconds, so callers ingesting several batches open one pool and pass
+        it to every ingest_files_bulk call.
+
+        Args:
+            files: Total number of files to be ingested (caps the worker count)
+            workers: Number of worker processes (defaults to settings)
+        """
+        cpu_count = os.cpu_count() or 1
+        workers = min(workers or settings.ingest_workers or cpu_count, max(1, files))
+        spec = self.spec
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(
+                max(1, cpu_count // workers),
+                spec.embedding_model,
+                spec.chunk_size,
+                spec.chunk_overlap,
+            ),
+        ) as executor:
+            yield IngestPool(executor, spec)
+
+    async def ingest_files_bulk(
+        self,
+        files: Sequence[Tuple[str, str, str]],
+        workers: Optional[int] = None,
+        pool: Optional[IngestPool] = None,
+    ) -> Dict[str, Tuple[int, Optional[str]]]:
+        """
+        Parse and embed many files across worker processes
+
+        All resulting vectors are added to the index in a single batched
+        write followed by a single save.
+
+        Args:
+            files: (file_path, document_id, collection) triples
+            workers: Number of worker processes (defaults to settings)
+            pool: Workers from ingest_pool to reuse; a pool is opened for
+                this call alone if None or if the index spec has changed
+
+        Returns:
+            Mapping of document_id to (chunk_count, error)
+        """
+        if not files:
+            return {}
+
+        self.mutations += 1
+        try:
+            if pool is not None and pool.spec == self.spec:
+                return await self._ingest_files_bulk(files, pool.executor)
+            with self.ingest_pool(len(files), workers) as own_pool:
+                return await self._ingest_files_bulk(files, own_pool.executor)
+        finally:
+            self.mutations -= 1
+            for _, document_id, _ in files:
+                self._record_change(document_id)
+
+    async def _ingest_files_bulk(
+        self,
+        files: Sequence[Tuple[str, str, str]],
+        executor: ProcessPoolExecutor,
+    ) -> Dict[str, Tuple[int, Optional[str]]]:
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(
+            *[
+                loop.run_in_executor(executor, parse_and_embed, path, document_id, collection)
+                for path, document_id, collection in files
+            ],
+            return_exceptions=True,
+        )
+
+        results: Dict[str, Tuple[int, Optional[str]]] = {}
+        texts: List[str] = []
+        metadatas: List[dict] = []
+        ids: List[str] = []
+        vectors: List[np.ndarray] = []
+        for (path, document_id, _), outcome in zip(files, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Error ingesting file {path}: {outcome}")
+                results[document_id] = (0, str(outcome))
+                continue
+
+            doc_texts, doc_metadatas, doc_vectors = outcome
+            results[document_id] = (len(doc_texts), None)
+            if not doc_texts:
+                continue
+            texts.extend(doc_texts)
+            metadatas.extend(doc_metadatas)
+            ids.extend(chunk_id(document_id, idx) for idx in range(len(doc_texts)))
+            vectors.append(doc_vectors)
+
+        if vectors:
+            await asyncio.to_thread(
+                self._add_embeddings, texts, np.concatenate(vectors), metadatas, ids
+            )
+            logger.info(f"Bulk ingested {len(texts)} chunks from {len(files)} files")
+
+        return results
+
+    def _add_embeddings(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        metadatas: List[dict],
+        ids: List[str],
+    ):
+        """Add precomputed vectors to the index and persist it once"""
+        self.vector_store.add(ids, texts, vectors, metadatas)
+        self.cache.bump_generation()
+        self._save_vector_store()
+
     def retrieve(
-        self, query: str, k: int = 3, document_ids: Optional[Sequence[str]] = None
+        self,
+        query: str,
+        k: int = 3,
+        document_ids: Optional[Sequence[str]] = None,
+        collections: Optional[Sequence[str]] = None,
     ) -> List[Document]:
         """
         Retrieve relevant documents for a query
@@ -114,62 +426,129 @@ class RagService:
         Args:
             query: Search query
             k: Number of documents to retrieve
+            document_ids: Only search these documents
+            collections: Only search these collections (all if None)
 
         Returns:
             List of relevant documents
         """
-        if not self.vector_store:
+        generation, store, embeddings = self._snapshot()
+        if store.empty:
             logger.warning("Vector store not initialized")
             return []
+        if not has_budget(settings.deadline_rag_min_seconds):
+            # Answering without context beats missing the deadline
+            logger.warning("Skipping retrieval, request deadline is too close")
+            return []
 
         try:
-            docs = self.vector_store.similarity_search(query, k=max(k * 2, k))
-            selected_ids = set(document_ids) if document_ids else None
-            if selected_ids:
-                filtered = [
-                    doc
-                    for doc in docs
-                    if doc.metadata.get("document_id") in selected_ids
-                ]
-                return filtered[:k]
-            return docs[:k]
+            vector = self._embed_queries([query], embeddings)[0]
+            check_deadline("vector search")
+            return self._search(generation, store, vector, k, document_ids, collections)
+        except (DeadlineExceeded, ModelServerError):
+            # Surfaced as 504 / 503 rather than a silently context-free answer
+            raise
         except Exception as e:
             logger.error(f"Error retrieving documents: {e}")
             return []
 
-    def _save_vector_store(self):
-        """Save vector store to disk"""
-        if self.vector_store:
-            os.makedirs(self.vector_db_path, exist_ok=True)
-            self.vector_store.save_local(self.vector_db_path)
-            logger.info(f"Saved vector store to {self.vector_db_path}")
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        k: int = 3,
+        document_ids: Optional[Sequence[Optional[Sequence[str]]]] = None,
+        collections: Optional[Sequence[Optional[Sequence[str]]]] = None,
+    ) -> List[List[Document]]:
+        """
+        Retrieve documents for many queries with one batched embedding pass
 
-    def _build_chunk_id(self, document_id: str, chunk_idx: int) -> str:
-        return f"{document_id}_{chunk_idx}"
+        Args:
+            queries: Search queries
+            k: Number of documents to retrieve per query
+            document_ids: Optional per-query document filters
+            collections: Optional per-query collection filters
 
-    def remove_document(self, document_id: str) -> int:
-        """Remove all chunks for a document from the vector store."""
-        if not self.vector_store:
-            return 0
+        Returns:
+            One list of documents per query
+        """
+        generation, store, embeddings = self._snapshot()
+        if store.empty or not queries:
+            return [[] for _ in queries]
 
-        docstore = getattr(self.vector_store, "docstore", None)
-        if not docstore or not hasattr(docstore, "_dict"):
-            logger.warning("Vector store docstore not available for deletion")
-            return 0
+        filters = document_ids or [None] * len(queries)
+        scopes = collections or [None] * len(queries)
+        try:
+            vectors = self._embed_queries(list(queries), embeddings)
+            return [
+                self._search(generation, store, vector, k, selected, scope)
+                for vector, selected, scope in zip(vectors, filters, scopes)
+            ]
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {e}")
+            return [[] for _ in queries]
 
-        ids_to_remove = [
-            doc_id
-            for doc_id, doc in docstore._dict.items()
-            if doc.metadata.get("document_id") == document_id
-        ]
+    def _embed_queries(self, queries: List[str], embeddings) -> List[np.ndarray]:
+        """Query embeddings from the cache, embedding only the misses (in one batch)"""
+        model = embeddings.model_name
+        vectors = [self.cache.get_embedding(model, query) for query in queries]
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = embeddings.embed_documents([queries[idx] for idx in missing])
+            for idx, vector in zip(missing, embedded):
+                self.cache.put_embedding(model, queries[idx], vector)
+                vectors[idx] = np.array(vector, dtype=np.float32)
+        return vectors
 
-        if not ids_to_remove:
+    def _search(
+        self,
+        generation: int,
+        store: VectorStore,
+        vector: np.ndarray,
+        k: int,
+        document_ids: Optional[Sequence[str]],
+        collections: Optional[Sequence[str]] = None,
+    ) -> List[Document]:
+        """
+        Top k chunks for a query embedding, served from the result cache when
+        the index hasn't changed since the same search was last run
+        """
+        if self.backend.shared:
+            # Other nodes write to a shared index without bumping our generation
+            return [doc for _, doc in store.search(vector, k, document_ids, collections)]
+
+        key = self.cache.result_key(generation, vector, k, document_ids, collections)
+        cached = self.cache.get_results(key)
+        if cached is not None:
+            docs = store.get(cached)
+            if all(doc is not None for doc in docs):
+                return docs
+
+        found = store.search(vector, k, document_ids, collections)
+        self.cache.put_results(key, [hit_id for hit_id, _ in found])
+        return [doc for _, doc in found]
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    def collection_sizes(self) -> Dict[str, int]:
+        """Documents in the live index per collection"""
+        return self.vector_store.collection_sizes()
+
+    def _save_vector_store(self):
+        """Persist the live store"""
+        self.vector_store.save()
+
+    def remove_document(self, document_id: str) -> int:
+        """Remove all chunks for a document from the vector store."""
+        self._record_change(document_id)
+        removed = self.vector_store.delete_document(document_id)
+        if not removed:
             return 0
 
-        self.vector_store.delete(ids_to_remove)
+        self.cache.bump_generation()
         self._save_vector_store()
-        logger.info(f"Removed {len(ids_to_remove)} chunks for document {document_id}")
-        return len(ids_to_remove)
+        logger.info(f"Removed {removed} chunks for document {document_id}")
+        return removed
 
 
 # Create singleton instance
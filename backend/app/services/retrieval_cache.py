@@ -0,0 +1,147 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+from config import settings
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split())
+
+
+def embedding_key(vector: np.ndarray) -> str:
+    """Identity of an embedding, shared by every query text that produced it"""
+    return hashlib.blake2b(np.ascontiguousarray(vector).tobytes(), digest_size=16).hexdigest()
+
+
+class _LRU:
+    """Thread-safe LRU bounded by entries and approximate bytes"""
+
+    def __init__(self, max_entries: int, max_bytes: int, sizeof: Callable[[Hashable, object], int]):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, size in bytes)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(key, value)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+def _result_size(key, ids: List[str]) -> int:
+    # Key tuple and list overhead plus the id strings
+    return 200 + sum(len(chunk_id) + 50 for chunk_id in ids)
+
+
+class RetrievalCache:
+    """
+    Two-level cache in front of the embedding model and the FAISS search
+
+    Level one maps (model, whitespace-normalized query text) to its embedding.
+    Level two maps (embedding key, k, document filter) to the ids of the
+    chunks retrieved. Level two keys include a generation counter, which
+    RagService bumps on every change to the index, so results computed
+    against an older index are never served.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.embeddings = _LRU(
+            settings.retrieval_embedding_cache_entries,
+            settings.retrieval_embedding_cache_max_bytes,
+            lambda key, vector: len(key[1]) + vector.nbytes + 100,
+        )
+        self.results = _LRU(
+            settings.retrieval_result_cache_entries,
+            settings.retrieval_result_cache_max_bytes,
+            _result_size,
+        )
+
+    def bump_generation(self):
+        """Call after the index changes; earlier results become unreachable"""
+        self.generation += 1
+        self.results.clear()
+
+    def clear(self):
+        """Drop both levels, e.g. after swapping in an index with another model"""
+        self.embeddings.clear()
+        self.bump_generation()
+
+    def get_embedding(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.embeddings.get((model, normalize_query(text)))
+
+    def put_embedding(self, model: str, text: str, vector: np.ndarray):
+        # Copy so the cache doesn't pin a row of a larger batch buffer
+        self.embeddings.put((model, normalize_query(text)), np.array(vector, dtype=np.float32))
+
+    @staticmethod
+    def result_key(
+        generation: int,
+        vector: np.ndarray,
+        k: int,
+        document_ids: Optional[Sequence[str]],
+        collections: Optional[Sequence[str]] = None,
+    ) -> tuple:
+        selected = tuple(sorted(set(document_ids))) if document_ids else None
+        scope = tuple(sorted(set(collections))) if collections is not None else None
+        return (generation, embedding_key(vector), k, selected, scope)
+
+    def get_results(self, key: tuple) -> Optional[List[str]]:
+        if key[0] != self.generation:
+            return None
+        return self.results.get(key)
+
+    def put_results(self, key: tuple, ids: List[str]):
+        # Searched against an index that has since changed
+        if key[0] != self.generation:
+            return
+        self.results.put(key, ids)
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+        }
@@ -0,0 +1,152 @@
+import base64
+import json
+import logging
+import re
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import and_, column, func, literal_column, or_, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from models.conversation import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# SQLite: FTS5 external-content table kept in sync by triggers, so index
+# updates happen in the same transaction as the message writes
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+# Postgres: stored generated tsvector column with a GIN index
+POSTGRES_FTS_DDL = [
+    """ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING GIN (content_tsv)",
+]
+
+
+def ensure_search_index(connection):
+    """Create the message full-text index if missing (run via run_sync)"""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        ).first()
+        for statement in SQLITE_FTS_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            # Index messages written before the FTS table existed
+            connection.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for statement in POSTGRES_FTS_DDL:
+            connection.execute(text(statement))
+    else:
+        logger.warning(f"Full-text search not supported on {dialect}")
+
+
+def _encode_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, message_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(message_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _fts5_query(query: str) -> str:
+    """Quote each term so user input can't break FTS5 query syntax"""
+    terms = re.findall(r"\w+", query)
+    return " ".join(f'"{term}"' for term in terms)
+
+
+async def search_messages(
+    db: AsyncSession,
+    query: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> Dict:
+    """
+    Ranked full-text search over message content
+
+    Results are ordered by relevance then message id; `next_cursor` encodes
+    the last (rank, id) pair for keyset pagination.
+    """
+    dialect = engine.dialect.name
+
+    if dialect == "sqlite":
+        match = _fts5_query(query)
+        if not match:
+            return {"results": [], "next_cursor": None}
+        fts = table("messages_fts", column("rowid"))
+        fts_ref = literal_column("messages_fts")
+        rank = func.bm25(fts_ref)
+        snippet = func.snippet(fts_ref, 0, "[", "]", "...", 16)
+        stmt = (
+            select(Message.id, Message.conversation_id, Message.role, Message.created_at,
+                   Conversation.title, rank.label("rank"), snippet.label("snippet"))
+            .select_from(fts)
+            .join(Message, Message.id == fts.c.rowid)
+            .join(Conversation, Conversation.id == Message.conversation_id)
+            .where(fts_ref.op("MATCH")(match))
+            # bm25: lower is better
+            .order_by(rank.asc(), Message.id.asc())
+        )
+        if cursor:
+            last_rank, last_id = _decode_cursor(cursor)
+            stmt = stmt.where(or_(rank > last_rank, and_(rank == last_rank, Message.id > last_id)))
+    elif dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery("english", query)
+        tsv = literal_column("messages.content_tsv")
+        rank = func.ts_rank_cd(tsv, tsquery)
+        snippet = func.ts_headline(
+            "english", Message.content, tsquery,
+            "StartSel=[, StopSel=], MaxWords=24, MinWords=8",
+        )
+        stmt = (
+            select(Message.id, Message.conversation_id, Message.role, Message.created_at,
+                   Conversation.title, rank.label("rank"), snippet.label("snippet"))
+            .join(Conversation, Conversation.id == Message.conversation_id)
+            .where(tsv.op("@@")(tsquery))
+            .order_by(rank.desc(), Message.id.asc())
+        )
+        if cursor:
+            last_rank, last_id = _decode_cursor(cursor)
+            stmt = stmt.where(or_(rank < last_rank, and_(rank == last_rank, Message.id > last_id)))
+    else:
+        raise NotImplementedError(f"Full-text search not supported on {dialect}")
+
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        "results": [
+            {
+                "conversation_id": row.conversation_id,
+                "title": row.title,
+                "message_id": row.id,
+                "role": row.role,
+                "snippet": row.snippet,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "rank": row.rank,
+            }
+            for row in rows
+        ],
+        "next_cursor": _encode_cursor(rows[-1].rank, rows[-1].id) if has_more else None,
+    }
@@ -0,0 +1,32 @@
+import time
+from typing import Awaitable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class StageTimings:
+    """Per-request stage durations, reported via logs and Server-Timing"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+
+    async def run(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Await a stage and record how long it took"""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.durations[name] = time.perf_counter() - start
+
+    def mark(self, name: str):
+        """Record the time elapsed since the request started"""
+        self.durations[name] = time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        return " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.durations.items())
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()
+        )
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import struct
+import time
+import uuid
+import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncGenerator, List, Optional, Tuple
+
+from config import settings
+from services.deadline import check_deadline
+
+logger = logging.getLogger(__name__)
+
+# (nchannels, sampwidth, framerate)
+AudioParams = Tuple[int, int, int]
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+_MARKDOWN_SYMBOLS = re.compile(r"[*#`>_|]+")
+
+# After a failed start, TTS requests fail fast for this long before retrying
+START_RETRY_SECONDS = 30.0
+
+_engine = None
+_default_voice = None
+
+
+class SynthesisUnavailable(Exception):
+    """The TTS engine processes could not be started (e.g. pyttsx3 or espeak missing)"""
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences for incremental synthesis"""
+    return [s.strip() for s in _SENTENCE_BOUNDARY.split(text) if s.strip()]
+
+
+def speakable(text: str) -> str:
+    """Strip markdown markup that TTS engines would read out literally"""
+    return _MARKDOWN_SYMBOLS.sub("", text).strip()
+
+
+class SentenceSplitter:
+    """Cut a stream of text fragments (e.g. LLM tokens) into complete sentences"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, fragment: str) -> List[str]:
+        self.buffer += fragment
+        parts = _SENTENCE_BOUNDARY.split(self.buffer)
+        # The last part may still be growing
+        self.buffer = parts.pop()
+        return [p.strip() for p in parts if p.strip()]
+
+    def flush(self) -> Optional[str]:
+        remainder, self.buffer = self.buffer.strip(), ""
+        return remainder or None
+
+
+def wav_header(params: AudioParams, data_size: Optional[int] = None) -> bytes:
+    """
+    RIFF header for PCM audio
+
+    Without `data_size` the sizes are set to the maximum value, which
+    players treat as "read until end of stream".
+    """
+    channels, sampwidth, rate = params
+    riff_size = 0xFFFFFFFF if data_size is None else 36 + data_size
+    data_size = 0xFFFFFFFF if data_size is None else data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, rate,
+        rate * channels * sampwidth, channels * sampwidth, sampwidth * 8,
+        b"data", data_size,
+    )
+
+
+def _init_engine():
+    """Process pool initializer: create the pyttsx3 engine once per worker"""
+    global _engine, _default_voice
+    import pyttsx3
+
+    _engine = pyttsx3.init()
+    _default_voice = _engine.getProperty("voice")
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+def _render(text: str, voice: Optional[str], audio_dir: str) -> Tuple[AudioParams, bytes]:
+    """Render one sentence and return its PCM frames"""
+    _engine.setProperty("voice", voice or _default_voice)
+    # pyttsx3 can only render to a file; it is read back and removed here
+    path = os.path.join(audio_dir, f"tts_{uuid.uuid4()}.wav")
+    try:
+        _engine.save_to_file(text, path)
+        _engine.runAndWait()
+        with wave.open(path, "rb") as wav:
+            params = (wav.getnchannels(), wav.getsampwidth(), wav.getframerate())
+            frames = wav.readframes(wav.getnframes())
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return params, frames
+
+
+class SynthesisCache:
+    """LRU of rendered sentences keyed by (text, voice), bounded by entries and bytes"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], Tuple[AudioParams, bytes]]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry: Tuple[AudioParams, bytes]):
+        if self.max_entries <= 0 or len(entry[1]) > self.max_bytes:
+            return
+        if key in self._entries:
+            self.size_bytes -= len(self._entries.pop(key)[1])
+        self._entries[key] = entry
+        self.size_bytes += len(entry[1])
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            _, (_, frames) = self._entries.popitem(last=False)
+            self.size_bytes -= len(frames)
+
+
+class SynthesisPool:
+    """
+    Pre-initialized pyttsx3 engines in dedicated worker processes
+
+    Text is split into sentences which are rendered in parallel (up to the
+    number of workers per request) and streamed in order, so the first
+    sentence plays while the rest are still rendering. If the engine can't
+    start, TTS raises SynthesisUnavailable and the rest of the API keeps
+    working; the start is retried after `START_RETRY_SECONDS`.
+    """
+
+    def __init__(self, audio_dir: str):
+        self.audio_dir = audio_dir
+        self.workers = max(1, settings.tts_workers)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self._start_lock = asyncio.Lock()
+        self.error: Optional[str] = None
+        self._failed_at: Optional[float] = None
+        self.cache = SynthesisCache(
+            settings.tts_cache_entries, settings.tts_cache_max_bytes
+        )
+
+    async def start(self):
+        async with self._start_lock:
+            if self.executor is not None:
+                return
+            if self._failed_at is not None and time.monotonic() - self._failed_at < START_RETRY_SECONDS:
+                raise SynthesisUnavailable(self.error)
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_engine,
+            )
+            loop = asyncio.get_running_loop()
+            try:
+                pids = await asyncio.gather(
+                    *[loop.run_in_executor(executor, _warmup) for _ in range(self.workers)]
+                )
+            except Exception as e:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.error = f"Speech synthesis unavailable: {e or type(e).__name__}"
+                self._failed_at = time.monotonic()
+                logger.error(self.error)
+                raise SynthesisUnavailable(self.error) from e
+            self.executor = executor
+            self.error = None
+            self._failed_at = None
+            logger.info(f"TTS pool ready with {len(set(pids))} worker processes")
+
+    async def render(self, text: str, voice: Optional[str] = None) -> Tuple[AudioParams, bytes]:
+        """Render one sentence, served from the LRU cache when possible"""
+        key = (text, voice)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        await self.start()
+        check_deadline("speech synthesis")
+        executor = self.executor
+        try:
+            entry = await asyncio.get_running_loop().run_in_executor(
+                executor, _render, text, voice, self.audio_dir
+            )
+        except BrokenProcessPool as e:
+            # A worker died; start a fresh pool on the next request
+            if self.executor is executor:
+                self.executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise SynthesisUnavailable(f"Speech synthesis worker died: {e}") from e
+        self.cache.put(key, entry)
+        return entry
+
+    async def stream(self, text: str, voice: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+        """Yield a WAV header followed by PCM frames, sentence by sentence"""
+        sentences = split_sentences(text)
+        pending: List[asyncio.Task] = []
+        next_idx = 0
+        header_sent = False
+        try:
+            while next_idx < len(sentences) or pending:
+                while next_idx < len(sentences) and len(pending) < self.workers:
+                    pending.append(asyncio.create_task(self.render(sentences[next_idx], voice)))
+                    next_idx += 1
+
+                params, frames = await pending.pop(0)
+                if not header_sent:
+                    yield wav_header(params)
+                    header_sent = True
+                yield frames
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+from faster_whisper import WhisperModel
+
+from config import settings
+from services.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    check_deadline,
+    current_deadline,
+    within_deadline,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Silence inserted between packed clips so words don't run together
+BATCH_GAP_SECONDS = 1.0
+# One Whisper window; packed batches never exceed it
+BATCH_MAX_SECONDS = 30.0
+
+
+class TranscriptionQueueFull(Exception):
+    """Raised when the transcription queue has no room for another request"""
+
+
+def detect_device() -> Tuple[str, str]:
+    """Whisper device and compute type: CUDA float16 when available, else CPU int8"""
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            return "cuda", "float16"
+    except Exception:
+        pass
+    return "cpu", "int8"
+
+
+@dataclass
+class TranscriptionResult:
+    text: str
+    language: Optional[str]
+    duration: float
+    real_time_factor: float
+    queue_seconds: float
+
+
+@dataclass
+class _Job:
+    audio: np.ndarray
+    language: Optional[str]
+    beam_size: int
+    initial_prompt: Optional[str]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    # The submitting request's deadline; expired jobs are dropped unprocessed
+    deadline: Optional[Deadline] = field(default_factory=current_deadline)
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and self.deadline.expired
+
+    @property
+    def duration(self) -> float:
+        return self.audio.size / SAMPLE_RATE
+
+    @property
+    def batchable(self) -> bool:
+        # Packing shares one language and one decoding config across clips
+        return (
+            self.language is not None
+            and self.initial_prompt is None
+            and self.duration <= settings.whisper_batch_clip_seconds
+        )
+
+
+class TranscriptionPool:
+    """
+    Dedicated Whisper executor
+
+    Holds `replicas` WhisperModel instances, each served by one consumer task
+    and one executor thread, so transcription never runs on the default
+    `to_thread` pool. Requests wait in a bounded queue; short clips with the
+    same language are packed into a single Whisper window and transcribed
+    together, then split back apart using word timestamps.
+    """
+
+    def __init__(self, device: str, compute_type: str):
+        self.replicas = max(1, settings.whisper_replicas)
+        self.models = [
+            WhisperModel(
+                settings.whisper_model,
+                device=device,
+                compute_type=compute_type,
+                cpu_threads=settings.whisper_cpu_threads,
+                num_workers=settings.whisper_num_workers,
+            )
+            for _ in range(self.replicas)
+        ]
+        # One inference thread per replica plus one for audio decoding
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.replicas + 1, thread_name_prefix="whisper"
+        )
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+
+    def _ensure_started(self):
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=settings.whisper_queue_size)
+        self.workers = [
+            asyncio.create_task(self._worker(model)) for model in self.models
+        ]
+
+    async def run_in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def submit(
+        self,
+        audio: np.ndarray,
+        language: Optional[str] = None,
+        beam_size: int = 5,
+        initial_prompt: Optional[str] = None,
+    ) -> TranscriptionResult:
+        """Queue 16 kHz mono float32 samples for transcription"""
+        self._ensure_started()
+        job = _Job(
+            audio=audio,
+            language=language,
+            beam_size=beam_size,
+            initial_prompt=initial_prompt,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise TranscriptionQueueFull("Transcription queue is full, try again later")
+        return await within_deadline(job.future, "transcription")
+
+    async def _worker(self, model: WhisperModel):
+        loop = asyncio.get_running_loop()
+        carry: List[_Job] = []
+        batch: List[_Job] = []
+        try:
+            while True:
+                job = carry.pop(0) if carry else await self.queue.get()
+                if job.future.cancelled():
+                    continue
+
+                batch = [job]
+                if job.batchable:
+                    total = job.duration
+                    deadline = loop.time() + settings.whisper_batch_window_ms / 1000
+                    while True:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            candidate = await asyncio.wait_for(self.queue.get(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+                        fits = total + BATCH_GAP_SECONDS + candidate.duration <= BATCH_MAX_SECONDS
+                        if candidate.batchable and candidate.language == job.language and fits:
+                            batch.append(candidate)
+                            total += BATCH_GAP_SECONDS + candidate.duration
+                        else:
+                            carry.append(candidate)
+                            break
+
+                for j in batch:
+                    if j.expired and not j.future.done():
+                        j.future.set_exception(DeadlineExceeded("Request deadline exceeded before transcription"))
+                batch = [j for j in batch if not j.future.done()]
+                if not batch:
+                    continue
+
+                started = time.perf_counter()
+                try:
+                    if len(batch) == 1:
+                        outputs = [await self.run_in_executor(self._transcribe_one, model, batch[0])]
+                    else:
+                        outputs = await self.run_in_executor(self._transcribe_packed, model, batch)
+                except Exception as e:
+                    for j in batch:
+                        if not j.future.done():
+                            j.future.set_exception(e)
+                    continue
+
+                elapsed = time.perf_counter() - started
+                for j, (text, language) in zip(batch, outputs):
+                    if j.future.done():
+                        continue
+                    rtf = elapsed / j.duration if j.duration else 0.0
+                    result = TranscriptionResult(
+                        text=text,
+                        language=language,
+                        duration=j.duration,
+                        real_time_factor=round(rtf, 3),
+                        queue_seconds=round(started - j.enqueued_at, 3),
+                    )
+                    logger.info(
+                        f"Transcribed {j.duration:.1f}s audio: rtf={result.real_time_factor} "
+                        f"queue={result.queue_seconds}s batch={len(batch)}"
+                    )
+                    j.future.set_result(result)
+        finally:
+            # Cancelled at shutdown: fail the jobs this worker had taken
+            _fail(carry + batch, "Transcription pool shut down")
+
+    def _transcribe_one(self, model: WhisperModel, job: _Job):
+        segments, info = model.transcribe(
+            job.audio,
+            language=job.language,
+            beam_size=job.beam_size,
+            initial_prompt=job.initial_prompt,
+        )
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        return text, info.language
+
+    def _transcribe_packed(self, model: WhisperModel, jobs: List[_Job]):
+        gap = np.zeros(int(BATCH_GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+        pieces = []
+        bounds = []
+        cursor = 0.0
+        for job in jobs:
+            bounds.append(cursor + job.duration)
+            pieces.extend([job.audio, gap])
+            cursor += job.duration + BATCH_GAP_SECONDS
+
+        segments, info = model.transcribe(
+            np.concatenate(pieces),
+            language=jobs[0].language,
+            beam_size=jobs[0].beam_size,
+            word_timestamps=True,
+            condition_on_previous_text=False,
+        )
+
+        words: List[List[str]] = [[] for _ in jobs]
+        for segment in segments:
+            for word in segment.words or []:
+                midpoint = (word.start + word.end) / 2
+                idx = next(
+                    (i for i, end in enumerate(bounds) if midpoint <= end + BATCH_GAP_SECONDS / 2),
+                    len(jobs) - 1,
+                )
+                words[idx].append(word.word)
+
+        return [("".join(w).strip(), info.language) for w in words]
+
+    async def shutdown(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.queue is not None:
+            queued = []
+            while not self.queue.empty():
+                queued.append(self.queue.get_nowait())
+            _fail(queued, "Transcription pool shut down")
+        self.executor.shutdown(wait=False)
+
+
+def _fail(jobs: List[_Job], reason: str):
+    for job in jobs:
+        if not job.future.done():
+            job.future.set_exception(RuntimeError(reason))
+
+
+class RemoteTranscriptionPool:
+    """
+    Same interface as TranscriptionPool, backed by the shared model server
+
+    Audio is still decoded here (on a small local executor); the samples go
+    to the server, whose TranscriptionPool queues and packs clips from every
+    worker. The request's remaining deadline travels with it so the server
+    drops clips nobody is waiting for.
+    """
+
+    def __init__(self):
+        from services.model_client import get_model_client
+
+        self.client = get_model_client()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
+    async def run_in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def submit(
+        self,
+        audio: np.ndarray,
+        language: Optional[str] = None,
+        beam_size: int = 5,
+        initial_prompt: Optional[str] = None,
+    ) -> TranscriptionResult:
+        """Send 16 kHz mono float32 samples to the model server for transcription"""
+        from services.model_client import ModelServerError
+
+        check_deadline("transcription")
+        deadline = current_deadline()
+        try:
+            reply = await within_deadline(
+                asyncio.to_thread(
+                    self.client.transcribe,
+                    audio,
+                    language,
+                    beam_size,
+                    initial_prompt,
+                    deadline.remaining() if deadline else None,
+                ),
+                "transcription",
+            )
+        except ModelServerError as e:
+            if e.kind == "queue_full":
+                raise TranscriptionQueueFull(str(e))
+            if e.kind == "deadline":
+                raise DeadlineExceeded(str(e))
+            raise
+        return TranscriptionResult(**reply["result"])
+
+    async def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,36 @@
+from config import settings
+from services.vector_store.base import (
+    DEFAULT_COLLECTION,
+    VectorBackend,
+    VectorStore,
+    chunk_document_id,
+    chunk_id,
+    validate_collection,
+)
+
+
+def get_vector_backend() -> VectorBackend:
+    """The vector store backend selected by VECTOR_STORE"""
+    kind = settings.vector_store.lower()
+    if kind == "faiss":
+        from services.vector_store.faiss_store import FaissBackend
+
+        return FaissBackend(settings.absolute_vector_db_path)
+    if kind == "pgvector":
+        from services.vector_store.pgvector_store import PgvectorBackend
+
+        return PgvectorBackend()
+    raise ValueError(
+        f"Unknown vector store '{settings.vector_store}'. Use 'faiss' or 'pgvector'."
+    )
+
+
+__all__ = [
+    "DEFAULT_COLLECTION",
+    "VectorBackend",
+    "VectorStore",
+    "chunk_document_id",
+    "chunk_id",
+    "get_vector_backend",
+    "validate_collection",
+]
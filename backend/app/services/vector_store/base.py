@@ -0,0 +1,125 @@
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+DEFAULT_COLLECTION = "default"
+
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_collection(name: Optional[str]) -> str:
+    """
+    A collection name, DEFAULT_COLLECTION for None/empty
+
+    Raises:
+        ValueError: If the name isn't 1-64 letters, digits, '-' or '_'
+    """
+    if not name:
+        return DEFAULT_COLLECTION
+    if not _COLLECTION_NAME.match(name):
+        raise ValueError(
+            f"Invalid collection name '{name}'. Use 1-64 letters, digits, '-' or '_'."
+        )
+    return name
+
+
+def chunk_id(document_id: str, chunk_index: int) -> str:
+    return f"{document_id}_{chunk_index}"
+
+
+def chunk_document_id(chunk_id: str) -> str:
+    return chunk_id.rsplit("_", 1)[0]
+
+
+class VectorStore:
+    """
+    Chunk vectors of one index generation
+
+    Chunks are identified by chunk_id() and carry the loader's metadata,
+    including `document_id` and `collection`. Each collection is a separate
+    shard, so a search only pays for the collections it spans. Searches run
+    in worker threads; writes come from RagService or the rebuild job.
+    """
+
+    @property
+    def empty(self) -> bool:
+        """Nothing to search, so retrieval can skip embedding the query"""
+        return False
+
+    def add(self, ids: List[str], texts: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        raise NotImplementedError
+
+    def delete_document(self, document_id: str) -> int:
+        """Remove a document's chunks; returns how many were removed"""
+        raise NotImplementedError
+
+    def search(
+        self,
+        vector: np.ndarray,
+        k: int,
+        document_ids: Optional[Sequence[str]] = None,
+        collections: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[str, Document]]:
+        """
+        Up to k (chunk id, chunk) pairs nearest to `vector`, optionally only
+        from `document_ids` and/or `collections` (all collections if None)
+        """
+        raise NotImplementedError
+
+    def get(self, ids: Sequence[str]) -> List[Optional[Document]]:
+        """Chunks by id, None for ids no longer stored"""
+        raise NotImplementedError
+
+    def document_ids(self) -> Set[str]:
+        """Documents with at least one chunk stored"""
+        raise NotImplementedError
+
+    def save(self):
+        """Persist writes made since the last save (no-op for database-backed stores)"""
+
+    def collection_sizes(self) -> Dict[str, int]:
+        """Documents stored per collection"""
+        raise NotImplementedError
+
+
+class VectorBackend:
+    """
+    Where index generations live
+
+    Holds each generation's vectors, its manifest (the spec it was built
+    with and the documents it holds) and the pointer to the live
+    generation. A `shared` backend is seen by every API node at once, so
+    nodes follow swaps made elsewhere and results can't be cached locally.
+    """
+
+    shared = False
+
+    def read_current(self) -> int:
+        """The live generation (0 if none was ever activated)"""
+        raise NotImplementedError
+
+    def write_current(self, generation: int):
+        """Atomically make `generation` the live one"""
+        raise NotImplementedError
+
+    def read_manifest(self, generation: int) -> Optional[dict]:
+        raise NotImplementedError
+
+    def write_manifest(self, generation: int, manifest: dict):
+        raise NotImplementedError
+
+    def has_vectors(self, generation: int) -> bool:
+        raise NotImplementedError
+
+    def open(self, generation: int, embeddings) -> VectorStore:
+        """A generation's store, empty if nothing was written to it yet"""
+        raise NotImplementedError
+
+    def drop(self, generation: int):
+        """Delete a generation's vectors and manifest"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
@@ -0,0 +1,544 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain.docstore.document import Document
+
+from config import settings
+from services.vector_store.base import (
+    DEFAULT_COLLECTION,
+    VectorBackend,
+    VectorStore,
+    chunk_document_id,
+)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+SHARDS_FILE = "shards.json"
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class FaissStore:
+    """
+    One collection's shard: a langchain FAISS index held in memory and saved to a directory
+
+    The index and its docstore are not thread-safe, so every read and write
+    holds the shard's lock.
+    """
+
+    def __init__(self, path: str, embeddings, index: Optional[FAISS] = None):
+        self.path = path
+        self.embeddings = embeddings
+        self.index = index
+        self.dirty = False
+        self.pins = 0
+        self._lock = threading.Lock()
+        self._text_bytes = 0
+        if index is not None:
+            with self._lock:
+                self._text_bytes = sum(len(doc.page_content) for doc in self._documents().values())
+
+    @property
+    def empty(self) -> bool:
+        return self.index is None
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held: vectors plus chunk texts"""
+        if self.index is None:
+            return 0
+        return self.index.index.ntotal * self.index.index.d * 4 + self._text_bytes
+
+    def _documents(self) -> dict:
+        docstore = getattr(self.index, "docstore", None)
+        return getattr(docstore, "_dict", None) or {}
+
+    def add(self, ids: List[str], texts: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        if not ids:
+            return
+        text_embeddings = list(zip(texts, vectors))
+        with self._lock:
+            if self.index is None:
+                self.index = FAISS.from_embeddings(
+                    text_embeddings, self.embeddings, metadatas=metadatas, ids=ids
+                )
+            else:
+                self.index.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            self._text_bytes += sum(len(content) for content in texts)
+            self.dirty = True
+
+    def delete_document(self, document_id: str) -> int:
+        with self._lock:
+            if self.index is None:
+                return 0
+            removed = {
+                chunk_id: doc
+                for chunk_id, doc in self._documents().items()
+                if doc.metadata.get("document_id") == document_id
+            }
+            if removed:
+                self.index.delete(list(removed))
+                self._text_bytes -= sum(len(doc.page_content) for doc in removed.values())
+                self.dirty = True
+        return len(removed)
+
+    def search(
+        self, vector: np.ndarray, k: int, document_ids: Optional[Sequence[str]] = None
+    ) -> List[Tuple[str, Document, float]]:
+        """Up to k (chunk id, chunk, distance) triples; lower distances are better"""
+        with self._lock:
+            if self.index is None:
+                return []
+            store = self.index
+            # Same steps as FAISS.similarity_search_by_vector, keeping the chunk ids
+            query = np.array([vector], dtype=np.float32)
+            if getattr(store, "_normalize_L2", False):
+                import faiss
+
+                faiss.normalize_L2(query)
+            scores, indices = store.index.search(query, k * 2)
+            # Inner-product indexes score higher for closer vectors
+            sign = -1.0 if getattr(store, "distance_strategy", None) == "MAX_INNER_PRODUCT" else 1.0
+            found = []
+            for score, i in zip(scores[0], indices[0]):
+                if i == -1:
+                    continue
+                chunk_id = store.index_to_docstore_id[i]
+                doc = store.docstore.search(chunk_id)
+                if isinstance(doc, Document):
+                    found.append((chunk_id, doc, sign * float(score)))
+
+        if document_ids:
+            selected_ids = set(document_ids)
+            found = [hit for hit in found if hit[1].metadata.get("document_id") in selected_ids]
+        return found[:k]
+
+    def get(self, ids: Sequence[str]) -> List[Optional[Document]]:
+        with self._lock:
+            if self.index is None:
+                return [None for _ in ids]
+            docs = [self.index.docstore.search(chunk_id) for chunk_id in ids]
+        return [doc if isinstance(doc, Document) else None for doc in docs]
+
+    def document_ids(self) -> Set[str]:
+        with self._lock:
+            return {doc.metadata.get("document_id") for doc in self._documents().values()}
+
+    def save(self):
+        with self._lock:
+            if self.index is None or not self.dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            self.index.save_local(self.path)
+            self.dirty = False
+        logger.info(f"Saved vector store to {self.path}")
+
+
+class ShardCache:
+    """
+    Open shards, least recently used closed first once over a memory budget
+
+    Shards in use (pinned) are never closed; unsaved ones are saved first.
+    Shared by every generation of a backend, so the live index and a
+    rebuild draw on the same budget. Loading and saving happen outside the
+    cache lock, so a cold shard never holds up queries on open ones; a key
+    being loaded or saved is marked pending and other users of that key
+    wait for it.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._shards: "OrderedDict[Tuple[int, str], FaissStore]" = OrderedDict()
+        self._pending: Dict[Tuple[int, str], threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def use(self, key: Tuple[int, str], load: Callable[[], FaissStore]) -> Iterator[FaissStore]:
+        """The shard for `key`, loaded with `load` if not open, pinned while in use"""
+        shard = self._acquire(key, load)
+        try:
+            yield shard
+        finally:
+            with self._lock:
+                shard.pins -= 1
+                closing = self._evict()
+            self._close(closing)
+
+    def _acquire(self, key: Tuple[int, str], load: Callable[[], FaissStore]) -> FaissStore:
+        while True:
+            with self._lock:
+                shard = self._shards.get(key)
+                if shard is not None:
+                    self._shards.move_to_end(key)
+                    self.hits += 1
+                    shard.pins += 1
+                    return shard
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Another thread is loading it, or saving it on eviction
+            pending.wait()
+
+        try:
+            shard = load()
+            with self._lock:
+                self._shards[key] = shard
+                self.misses += 1
+                shard.pins += 1
+            return shard
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def _evict(self) -> List[Tuple[Tuple[int, str], FaissStore, threading.Event]]:
+        """Take shards out of the cache until it fits; the caller closes them after unlocking"""
+        closing = []
+        total = sum(shard.nbytes for shard in self._shards.values())
+        for key in list(self._shards):
+            if total <= self.max_bytes:
+                break
+            shard = self._shards[key]
+            if shard.pins:
+                continue
+            del self._shards[key]
+            total -= shard.nbytes
+            self._pending[key] = threading.Event()
+            closing.append((key, shard, self._pending[key]))
+        return closing
+
+    def _close(self, closing: List[Tuple[Tuple[int, str], FaissStore, threading.Event]]):
+        for key, shard, pending in closing:
+            try:
+                shard.save()
+            except Exception as e:
+                # Kept open rather than losing its unsaved vectors
+                logger.error(f"Error saving index shard {shard.path}, keeping it open: {e}")
+                with self._lock:
+                    self._shards[key] = shard
+            else:
+                with self._lock:
+                    self.evictions += 1
+                logger.info(f"Closed index shard {shard.path} ({shard.nbytes} bytes)")
+            finally:
+                with self._lock:
+                    del self._pending[key]
+                pending.set()
+
+    def flush(self, generation: int):
+        """Save the generation's open shards, and wait for any being saved on eviction"""
+        with self._lock:
+            saving = [
+                shard
+                for (shard_generation, _), shard in self._shards.items()
+                if shard_generation == generation and shard.dirty
+            ]
+            # Pinned so they stay open while saved outside the lock
+            for shard in saving:
+                shard.pins += 1
+            closing = [
+                pending for (shard_generation, _), pending in self._pending.items()
+                if shard_generation == generation
+            ]
+        try:
+            for shard in saving:
+                shard.save()
+        finally:
+            with self._lock:
+                for shard in saving:
+                    shard.pins -= 1
+                evicted = self._evict()
+            self._close(evicted)
+        for pending in closing:
+            pending.wait()
+
+    def discard(self, generation: int):
+        """Forget the generation's open shards without saving them"""
+        with self._lock:
+            for key in [key for key in self._shards if key[0] == generation]:
+                del self._shards[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "open_shards": len(self._shards),
+                "bytes": sum(shard.nbytes for shard in self._shards.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class ShardedFaissStore(VectorStore):
+    """
+    A generation as one FAISS shard per collection
+
+    Shards are opened on demand through the backend's ShardCache. Which
+    collection each document lives in is kept in shards.json, so deletes and
+    filtered searches go straight to the right shard.
+    """
+
+    def __init__(self, backend: "FaissBackend", generation: int, embeddings):
+        self.backend = backend
+        self.generation = generation
+        self.embeddings = embeddings
+        self.routes: Dict[str, str] = backend.read_routes(generation, embeddings)
+        # Guards routes/_sizes: searches read them from worker threads
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, int] = {}
+        for collection in self.routes.values():
+            self._sizes[collection] = self._sizes.get(collection, 0) + 1
+
+    @property
+    def empty(self) -> bool:
+        return not self.routes
+
+    def _shard(self, collection: str):
+        path = self.backend.shard_path(self.generation, collection)
+        return self.backend.shards.use(
+            (self.generation, collection), lambda: self.backend.load_shard(path, self.embeddings)
+        )
+
+    def _route(self, document_id: str, collection: Optional[str]):
+        with self._lock:
+            previous = self.routes.get(document_id)
+            if previous == collection:
+                return
+            if previous is not None:
+                self._sizes[previous] -= 1
+                if not self._sizes[previous]:
+                    del self._sizes[previous]
+            if collection is None:
+                del self.routes[document_id]
+            else:
+                self.routes[document_id] = collection
+                self._sizes[collection] = self._sizes.get(collection, 0) + 1
+
+    def add(self, ids: List[str], texts: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        groups: Dict[str, List[int]] = {}
+        for position, metadata in enumerate(metadatas):
+            groups.setdefault(metadata.get("collection") or DEFAULT_COLLECTION, []).append(position)
+        for collection, positions in groups.items():
+            moved = {
+                metadatas[i]["document_id"]
+                for i in positions
+                if self.routes.get(metadatas[i]["document_id"], collection) != collection
+            }
+            for document_id in moved:
+                # Moved to another collection: drop the copy in the old shard
+                self.delete_document(document_id)
+            with self._shard(collection) as shard:
+                shard.add(
+                    [ids[i] for i in positions],
+                    [texts[i] for i in positions],
+                    np.asarray(vectors)[positions],
+                    [metadatas[i] for i in positions],
+                )
+            for i in positions:
+                self._route(metadatas[i]["document_id"], collection)
+
+    def delete_document(self, document_id: str) -> int:
+        collection = self.routes.get(document_id)
+        if collection is None:
+            return 0
+        with self._shard(collection) as shard:
+            removed = shard.delete_document(document_id)
+        self._route(document_id, None)
+        return removed
+
+    def _targets(
+        self, document_ids: Optional[Sequence[str]], collections: Optional[Sequence[str]]
+    ) -> Set[str]:
+        with self._lock:
+            if document_ids:
+                targets = {self.routes[d] for d in document_ids if d in self.routes}
+            else:
+                targets = set(self._sizes)
+        if collections is not None:
+            targets &= set(collections)
+        return targets
+
+    def search(
+        self,
+        vector: np.ndarray,
+        k: int,
+        document_ids: Optional[Sequence[str]] = None,
+        collections: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[str, Document]]:
+        targets = sorted(self._targets(document_ids, collections))
+
+        def search_shard(collection: str):
+            with self._shard(collection) as shard:
+                return shard.search(vector, k, document_ids)
+
+        if len(targets) == 1:
+            hits = search_shard(targets[0])
+        else:
+            # FAISS releases the GIL while searching, so shards are searched in parallel
+            hits = [
+                hit
+                for shard_hits in self.backend.search_pool.map(search_shard, targets)
+                for hit in shard_hits
+            ]
+            hits.sort(key=lambda hit: hit[2])
+        return [(chunk_id, doc) for chunk_id, doc, _ in hits[:k]]
+
+    def get(self, ids: Sequence[str]) -> List[Optional[Document]]:
+        found: Dict[str, Optional[Document]] = {}
+        groups: Dict[str, List[str]] = {}
+        with self._lock:
+            for chunk_id in ids:
+                collection = self.routes.get(chunk_document_id(chunk_id))
+                if collection is not None:
+                    groups.setdefault(collection, []).append(chunk_id)
+        for collection, chunk_ids in groups.items():
+            with self._shard(collection) as shard:
+                found.update(zip(chunk_ids, shard.get(chunk_ids)))
+        return [found.get(chunk_id) for chunk_id in ids]
+
+    def document_ids(self) -> Set[str]:
+        with self._lock:
+            return set(self.routes)
+
+    def collection_sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._sizes)
+
+    def save(self):
+        self.backend.shards.flush(self.generation)
+        with self._lock:
+            routes = dict(self.routes)
+        self.backend.write_routes(self.generation, routes)
+
+
+class FaissBackend(VectorBackend):
+    """
+    Generations as FAISS directories under `vector_db_path`
+
+    Generation 0 is the directory itself (the layout used before
+    generations existed), later ones are generations/<n>. Each has a
+    manifest.json, and the CURRENT file names the live one. Within a
+    generation the default collection's shard is the directory itself (the
+    layout used before collections existed) and others are
+    collections/<name>. Local to one API node.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.shards = ShardCache(settings.vector_shard_cache_mb * 1024 * 1024)
+        self.search_pool = ThreadPoolExecutor(
+            max_workers=max(1, settings.vector_shard_search_workers),
+            thread_name_prefix="shard-search",
+        )
+
+    def generation_path(self, generation: int) -> str:
+        if generation == 0:
+            return self.root
+        return os.path.join(self.root, "generations", str(generation))
+
+    def shard_path(self, generation: int, collection: str) -> str:
+        path = self.generation_path(generation)
+        if collection == DEFAULT_COLLECTION:
+            return path
+        return os.path.join(path, "collections", collection)
+
+    def load_shard(self, path: str, embeddings) -> FaissStore:
+        if not os.path.exists(os.path.join(path, "index.faiss")):
+            return FaissStore(path, embeddings)
+        try:
+            logger.info(f"Loading index shard from {path}")
+            return FaissStore(path, embeddings, FAISS.load_local(path, embeddings))
+        except Exception as e:
+            logger.error(f"Error loading index shard {path}: {e}")
+            return FaissStore(path, embeddings)
+
+    def read_routes(self, generation: int, embeddings=None) -> Dict[str, str]:
+        """document_id -> collection for a generation"""
+        routes_path = os.path.join(self.generation_path(generation), SHARDS_FILE)
+        if os.path.exists(routes_path):
+            with open(routes_path) as f:
+                return json.load(f)
+        # Indexes from before collections exist hold only the default collection;
+        # its shard is opened through the cache so the store reuses it
+        path = self.shard_path(generation, DEFAULT_COLLECTION)
+        with self.shards.use(
+            (generation, DEFAULT_COLLECTION), lambda: self.load_shard(path, embeddings)
+        ) as default:
+            return {document_id: DEFAULT_COLLECTION for document_id in default.document_ids()}
+
+    def write_routes(self, generation: int, routes: Dict[str, str]):
+        path = self.generation_path(generation)
+        os.makedirs(path, exist_ok=True)
+        _write_atomic(os.path.join(path, SHARDS_FILE), json.dumps(routes))
+
+    def read_current(self) -> int:
+        pointer = os.path.join(self.root, CURRENT_FILE)
+        if not os.path.exists(pointer):
+            return 0
+        with open(pointer) as f:
+            return int(f.read().strip())
+
+    def write_current(self, generation: int):
+        os.makedirs(self.root, exist_ok=True)
+        _write_atomic(os.path.join(self.root, CURRENT_FILE), str(generation))
+
+    def read_manifest(self, generation: int) -> Optional[dict]:
+        manifest_path = os.path.join(self.generation_path(generation), MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def write_manifest(self, generation: int, manifest: dict):
+        path = self.generation_path(generation)
+        os.makedirs(path, exist_ok=True)
+        _write_atomic(os.path.join(path, MANIFEST_FILE), json.dumps(manifest))
+
+    def has_vectors(self, generation: int) -> bool:
+        path = self.generation_path(generation)
+        return os.path.exists(os.path.join(path, SHARDS_FILE)) or os.path.exists(
+            os.path.join(path, "index.faiss")
+        )
+
+    def open(self, generation: int, embeddings) -> ShardedFaissStore:
+        return ShardedFaissStore(self, generation, embeddings)
+
+    def drop(self, generation: int):
+        self.shards.discard(generation)
+        path = self.generation_path(generation)
+        if generation == 0:
+            # Shares the directory with the other generations and CURRENT
+            for name in ("index.faiss", "index.pkl", MANIFEST_FILE, SHARDS_FILE):
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+            shutil.rmtree(os.path.join(path, "collections"), ignore_errors=True)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {"shards": self.shards.stats()}
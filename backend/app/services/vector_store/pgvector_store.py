@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+
+from config import settings
+from services.vector_store.base import DEFAULT_COLLECTION, VectorBackend, VectorStore, validate_collection
+
+logger = logging.getLogger(__name__)
+
+ITERATIVE_SCAN_MODES = {"off", "strict_order", "relaxed_order"}
+
+
+def _vector_literal(vector) -> str:
+    return "[" + ",".join(map(str, np.asarray(vector, dtype=np.float32).tolist())) + "]"
+
+
+class PgvectorStore(VectorStore):
+    """
+    One generation's chunks in a Postgres table with an HNSW index
+
+    The table is list-partitioned by collection, one partition (with its own
+    HNSW index) per collection created on first write, so a search scoped
+    to some collections only scans their partitions.
+    """
+
+    def __init__(self, engine, table: str):
+        self.engine = engine
+        self.table = table
+        self._exists = False
+        self._partitions: Set[str] = set()
+
+    def _table_exists(self) -> bool:
+        # Cached once true; until then another node may create it with the first document
+        if not self._exists:
+            with self.engine.connect() as conn:
+                self._exists = conn.execute(
+                    text("SELECT to_regclass(:name) IS NOT NULL"), {"name": self.table}
+                ).scalar()
+        return self._exists
+
+    @property
+    def empty(self) -> bool:
+        return not self._table_exists()
+
+    def _create(self, dimension: int):
+        table = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        collection varchar NOT NULL,
+                        id varchar NOT NULL,
+                        document_id varchar NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+                        content text NOT NULL,
+                        metadata jsonb NOT NULL,
+                        embedding vector({int(dimension)}) NOT NULL,
+                        PRIMARY KEY (collection, id)
+                    ) PARTITION BY LIST (collection)
+                    """
+                )
+            )
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_document_id ON {table} (document_id)"))
+            # Created on each partition, including ones added later
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding ON {table} "
+                    f"USING hnsw (embedding vector_cosine_ops) "
+                    f"WITH (m = {int(settings.pgvector_hnsw_m)}, "
+                    f"ef_construction = {int(settings.pgvector_hnsw_ef_construction)})"
+                )
+            )
+        self._exists = True
+        logger.info(f"Created vector table {table} ({dimension} dimensions)")
+
+    def _create_partition(self, collection: str):
+        # Names are validated, but DDL can't take bind parameters, so quote anyway
+        validate_collection(collection)
+        suffix = hashlib.sha1(collection.encode()).hexdigest()[:12]
+        literal = collection.replace("'", "''")
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {self.table}_{suffix} "
+                    f"PARTITION OF {self.table} FOR VALUES IN ('{literal}')"
+                )
+            )
+        self._partitions.add(collection)
+
+    def add(self, ids: List[str], texts: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        if not ids:
+            return
+        if not self._table_exists():
+            self._create(len(vectors[0]))
+        collections = [metadata.get("collection") or DEFAULT_COLLECTION for metadata in metadatas]
+        for collection in set(collections) - self._partitions:
+            self._create_partition(collection)
+        rows = [
+            {
+                "collection": collection,
+                "id": chunk_id,
+                "document_id": metadata["document_id"],
+                "content": content,
+                "metadata": json.dumps(metadata),
+                "embedding": _vector_literal(vector),
+            }
+            for chunk_id, content, vector, metadata, collection in zip(
+                ids, texts, vectors, metadatas, collections
+            )
+        ]
+        # One transaction per call, so a document's chunks appear together
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"INSERT INTO {self.table} (collection, id, document_id, content, metadata, embedding) "
+                    f"VALUES (:collection, :id, :document_id, :content, CAST(:metadata AS jsonb), "
+                    f"CAST(:embedding AS vector)) "
+                    f"ON CONFLICT (collection, id) DO UPDATE SET document_id = EXCLUDED.document_id, "
+                    f"content = EXCLUDED.content, metadata = EXCLUDED.metadata, embedding = EXCLUDED.embedding"
+                ),
+                rows,
+            )
+
+    def delete_document(self, document_id: str) -> int:
+        if not self._table_exists():
+            return 0
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                text(f"DELETE FROM {self.table} WHERE document_id = :document_id"),
+                {"document_id": document_id},
+            )
+            return result.rowcount
+
+    def search(
+        self,
+        vector: np.ndarray,
+        k: int,
+        document_ids: Optional[Sequence[str]] = None,
+        collections: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[str, Document]]:
+        if not self._table_exists():
+            return []
+        # Only chunks of ready documents: a document being (re)ingested or
+        # deleted is never half-visible
+        conditions = "d.status = 'ready'"
+        params = {"query": _vector_literal(vector), "k": k}
+        if document_ids:
+            conditions += " AND c.document_id = ANY(:document_ids)"
+            params["document_ids"] = list(document_ids)
+        if collections is not None:
+            # Prunes the scan to these collections' partitions
+            conditions += " AND c.collection = ANY(:collections)"
+            params["collections"] = list(collections)
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    f"SELECT c.id, c.content, c.metadata FROM {self.table} c "
+                    f"JOIN documents d ON d.id = c.document_id "
+                    f"WHERE {conditions} "
+                    f"ORDER BY c.embedding <=> CAST(:query AS vector) LIMIT :k"
+                ),
+                params,
+            ).all()
+        return [(row.id, Document(page_content=row.content, metadata=row.metadata)) for row in rows]
+
+    def get(self, ids: Sequence[str]) -> List[Optional[Document]]:
+        if not ids or not self._table_exists():
+            return [None for _ in ids]
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, content, metadata FROM {self.table} WHERE id = ANY(:ids)"),
+                {"ids": list(ids)},
+            ).all()
+        found = {row.id: Document(page_content=row.content, metadata=row.metadata) for row in rows}
+        return [found.get(chunk_id) for chunk_id in ids]
+
+    def document_ids(self) -> Set[str]:
+        if not self._table_exists():
+            return set()
+        with self.engine.connect() as conn:
+            return set(conn.execute(text(f"SELECT DISTINCT document_id FROM {self.table}")).scalars())
+
+    def collection_sizes(self) -> Dict[str, int]:
+        if not self._table_exists():
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT collection, count(DISTINCT document_id) FROM {self.table} GROUP BY collection")
+            ).all()
+        return {collection: count for collection, count in rows}
+
+
+class PgvectorBackend(VectorBackend):
+    """
+    Generations as Postgres tables with pgvector HNSW indexes
+
+    Lives in the application database, so every API node shares the index
+    without syncing files, and chunk rows reference `documents`: deleting a
+    document deletes its chunks in the same transaction. Each generation is
+    a `vector_chunks_<n>` table sized for its model's dimension; manifests
+    and the live pointer are rows of `vector_generations`.
+    """
+
+    shared = True
+
+    def __init__(self):
+        url = make_url(settings.database_url)
+        if url.get_backend_name() != "postgresql":
+            raise RuntimeError(
+                "VECTOR_STORE=pgvector needs the Postgres database "
+                "(USE_POSTGRES=true or a postgresql DATABASE_URL)"
+            )
+        if settings.pgvector_iterative_scan and settings.pgvector_iterative_scan not in ITERATIVE_SCAN_MODES:
+            raise ValueError(
+                f"Unknown PGVECTOR_ITERATIVE_SCAN '{settings.pgvector_iterative_scan}'. "
+                f"Use one of {sorted(ITERATIVE_SCAN_MODES)}."
+            )
+        # Retrieval runs in worker threads, so this side uses a sync driver
+        self.engine = create_engine(
+            url.set(drivername="postgresql+psycopg2"),
+            pool_pre_ping=True,
+            pool_size=settings.pgvector_pool_size,
+            max_overflow=settings.pgvector_pool_size,
+            executemany_mode="values_plus_batch",
+        )
+        event.listen(self.engine, "connect", self._configure_connection)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.execute(
+                text(
+                    """
+                    CREATE TABLE IF NOT EXISTS vector_generations (
+                        generation integer PRIMARY KEY,
+                        manifest jsonb NOT NULL,
+                        live boolean NOT NULL DEFAULT false
+                    )
+                    """
+                )
+            )
+            conn.execute(
+                text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS ix_vector_generations_live "
+                    "ON vector_generations (live) WHERE live"
+                )
+            )
+
+    @staticmethod
+    def _configure_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET hnsw.ef_search = {int(settings.pgvector_ef_search)}")
+        if settings.pgvector_iterative_scan:
+            # Keeps scanning the graph when filters drop candidates (pgvector >= 0.8)
+            cursor.execute(f"SET hnsw.iterative_scan = {settings.pgvector_iterative_scan}")
+        cursor.close()
+        # Session settings made inside a transaction would be undone by its rollback
+        dbapi_connection.commit()
+
+    @staticmethod
+    def _table(generation: int) -> str:
+        return f"vector_chunks_{int(generation)}"
+
+    def read_current(self) -> int:
+        with self.engine.connect() as conn:
+            generation = conn.execute(
+                text("SELECT generation FROM vector_generations WHERE live")
+            ).scalar()
+        return generation or 0
+
+    def write_current(self, generation: int):
+        with self.engine.begin() as conn:
+            # Two statements, as the unique index is checked row by row
+            conn.execute(text("UPDATE vector_generations SET live = false WHERE live"))
+            conn.execute(
+                text("UPDATE vector_generations SET live = true WHERE generation = :generation"),
+                {"generation": generation},
+            )
+
+    def read_manifest(self, generation: int) -> Optional[dict]:
+        with self.engine.connect() as conn:
+            return conn.execute(
+                text("SELECT manifest FROM vector_generations WHERE generation = :generation"),
+                {"generation": generation},
+            ).scalar()
+
+    def write_manifest(self, generation: int, manifest: dict):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO vector_generations (generation, manifest) "
+                    "VALUES (:generation, CAST(:manifest AS jsonb)) "
+                    "ON CONFLICT (generation) DO UPDATE SET manifest = EXCLUDED.manifest"
+                ),
+                {"generation": generation, "manifest": json.dumps(manifest)},
+            )
+
+    def has_vectors(self, generation: int) -> bool:
+        return not PgvectorStore(self.engine, self._table(generation)).empty
+
+    def open(self, generation: int, embeddings) -> PgvectorStore:
+        return PgvectorStore(self.engine, self._table(generation))
+
+    def drop(self, generation: int):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {self._table(generation)}"))
+            conn.execute(
+                text("DELETE FROM vector_generations WHERE generation = :generation"),
+                {"generation": generation},
+            )
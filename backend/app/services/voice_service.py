@@ -1,12 +1,19 @@
-import asyncio
 import os
-import uuid
-from typing import Optional, Tuple
+from typing import AsyncGenerator, Dict, List, Optional
 
-from faster_whisper import WhisperModel
-import pyttsx3
+import numpy as np
+from faster_whisper.audio import decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 
 from config import settings
+from services.synthesis_pool import SynthesisPool, SynthesisUnavailable
+from services.transcription_pool import (
+    SAMPLE_RATE,
+    RemoteTranscriptionPool,
+    TranscriptionPool,
+    TranscriptionResult,
+    detect_device,
+)
 
 
 class VoiceService:
@@ -15,51 +22,209 @@ class VoiceService:
     def __init__(self):
         self.audio_dir = settings.absolute_audio_dir
         os.makedirs(self.audio_dir, exist_ok=True)
-        self.device, self.compute_type = self._detect_device()
-        self.whisper_model = WhisperModel(
-            settings.whisper_model,
-            device=self.device,
-            compute_type=self.compute_type,
+        if settings.model_server_socket:
+            # Whisper lives in the shared model server
+            self.transcription_pool = RemoteTranscriptionPool()
+        else:
+            self.device, self.compute_type = detect_device()
+            self.transcription_pool = TranscriptionPool(self.device, self.compute_type)
+        self.synthesis_pool = SynthesisPool(self.audio_dir)
+
+    async def transcribe(
+        self, file_path: str, language: Optional[str] = None
+    ) -> TranscriptionResult:
+        audio = await self.transcription_pool.run_in_executor(decode_audio, file_path)
+        return await self.transcription_pool.submit(audio, language=language)
+
+    async def transcribe_array(
+        self,
+        audio: np.ndarray,
+        language: Optional[str] = None,
+        beam_size: int = 5,
+        initial_prompt: Optional[str] = None,
+    ) -> str:
+        """Transcribe 16 kHz mono float32 samples already in memory"""
+        result = await self.transcription_pool.submit(
+            audio,
+            language=language,
+            beam_size=beam_size,
+            initial_prompt=initial_prompt,
         )
+        return result.text
 
-    def _detect_device(self) -> Tuple[str, str]:
-        try:
-            import torch
-
-            if torch.cuda.is_available():
-                return "cuda", "float16"
-        except Exception:
-            pass
-        return "cpu", "int8"
-
-    async def transcribe(self, file_path: str, language: Optional[str] = None):
-        def _run_transcription():
-            segments, info = self.whisper_model.transcribe(
-                file_path,
-                language=language,
-            )
-            text = " ".join(segment.text.strip() for segment in segments).strip()
-            return text, info.language, getattr(info, "duration", None)
+    def create_stream(
+        self, language: Optional[str] = None, sample_rate: int = SAMPLE_RATE
+    ) -> "StreamingTranscriber":
+        return StreamingTranscriber(self, language=language, sample_rate=sample_rate)
 
-        return await asyncio.to_thread(_run_transcription)
+    def synthesize_stream(
+        self, text: str, voice: Optional[str] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """Stream WAV audio for text, rendered sentence by sentence"""
+        return self.synthesis_pool.stream(text, voice=voice)
 
-    async def synthesize(self, text: str, voice: Optional[str] = None) -> str:
-        output_path = os.path.join(self.audio_dir, f"{uuid.uuid4()}.wav")
-
-        def _run_tts():
-            engine = pyttsx3.init()
-            if voice:
-                engine.setProperty("voice", voice)
-            engine.save_to_file(text, output_path)
-            engine.runAndWait()
+    async def start(self):
+        try:
+            await self.synthesis_pool.start()
+        except SynthesisUnavailable:
+            # Already logged; voice output returns 503 and everything else works
+            pass
 
-        await asyncio.to_thread(_run_tts)
-        return output_path
+    async def shutdown(self):
+        await self.transcription_pool.shutdown()
+        await self.synthesis_pool.shutdown()
 
     def cleanup_audio(self, path: str):
         if path and os.path.exists(path):
             os.remove(path)
 
 
+class StreamingTranscriber:
+    """
+    Incremental transcription of a live PCM stream
+
+    Audio is fed as 16-bit little-endian mono PCM. Voice activity detection
+    splits the stream into speech segments: an open segment is re-transcribed
+    with a fast greedy pass to produce partial text, and once it is followed
+    by enough silence (or grows too long) it is transcribed once more with
+    full beam search, emitted as final and dropped from the buffer. VAD only
+    re-scans audio near the end of what it has already seen.
+    """
+
+    def __init__(
+        self,
+        service: VoiceService,
+        language: Optional[str] = None,
+        sample_rate: int = SAMPLE_RATE,
+    ):
+        self.service = service
+        self.language = language
+        self.sample_rate = sample_rate
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.offset = 0  # samples already dropped from the buffer
+        self.pending = 0  # samples received since the last step
+        self.last_final: Optional[str] = None
+        self.vad_options = VadOptions(
+            min_silence_duration_ms=settings.voice_stream_min_silence_ms,
+            speech_pad_ms=100,
+        )
+        # Speech segments found so far and how much of the buffer VAD has seen
+        self.speech: List[Dict] = []
+        self.scanned = 0
+        # Audio before the end of the last scan that is scanned again, so a
+        # silence (or segment) straddling the boundary is measured whole
+        self.rescan_margin = (
+            (self.vad_options.min_silence_duration_ms + 2 * self.vad_options.speech_pad_ms)
+            * SAMPLE_RATE // 1000
+        )
+        self._odd_byte = b""  # half a sample left over from the previous frame
+
+    def feed(self, pcm: bytes):
+        pcm = self._odd_byte + pcm
+        usable = len(pcm) - len(pcm) % 2
+        self._odd_byte = pcm[usable:]
+        samples = np.frombuffer(pcm[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+        if self.sample_rate != SAMPLE_RATE and samples.size:
+            target = int(samples.size * SAMPLE_RATE / self.sample_rate)
+            samples = np.interp(
+                np.linspace(0, samples.size - 1, target),
+                np.arange(samples.size),
+                samples,
+            ).astype(np.float32)
+        self.buffer = np.concatenate([self.buffer, samples])
+        self.pending += samples.size
+
+    async def step(self) -> List[Dict]:
+        """Process buffered audio once enough has arrived since the last step"""
+        if self.pending < settings.voice_stream_partial_interval * SAMPLE_RATE:
+            return []
+        self.pending = 0
+
+        speech = await self._scan()
+        if not speech:
+            # Keep a short tail so speech starting at the boundary isn't clipped
+            self._drop(max(0, self.buffer.size - SAMPLE_RATE // 2))
+            return []
+
+        start, end = speech[0]["start"], speech[-1]["end"]
+        silence = self.buffer.size - end
+        too_long = end - start >= settings.voice_stream_max_segment_seconds * SAMPLE_RATE
+        if silence >= settings.voice_stream_min_silence_ms * SAMPLE_RATE // 1000 or too_long:
+            return await self._finalize(start, end)
+
+        text = await self.service.transcribe_array(
+            self.buffer[start:],
+            language=self.language,
+            beam_size=1,
+            initial_prompt=self.last_final,
+        )
+        if not text:
+            return []
+        return [self._event("partial", text, start, self.buffer.size)]
+
+    async def finish(self) -> List[Dict]:
+        """Flush whatever speech is left at the end of the stream"""
+        if not self.buffer.size:
+            return []
+        speech = await self._scan()
+        if not speech:
+            return []
+        return await self._finalize(speech[0]["start"], speech[-1]["end"])
+
+    async def _scan(self) -> List[Dict]:
+        """Speech segments in the buffer, running VAD only over audio it hasn't settled"""
+        resume = max(0, self.scanned - self.rescan_margin)
+        # Silero scores 512-sample windows; keep them aligned with earlier scans
+        resume -= resume % 512
+        kept = []
+        for segment in self.speech:
+            if segment["end"] > resume:
+                # A segment reaching into the re-scanned audio is detected again whole
+                resume = min(resume, segment["start"])
+                break
+            kept.append(segment)
+
+        found = await self.service.transcription_pool.run_in_executor(
+            get_speech_timestamps, self.buffer[resume:], self.vad_options
+        )
+        self.speech = kept + [
+            {"start": segment["start"] + resume, "end": segment["end"] + resume}
+            for segment in found
+        ]
+        self.scanned = self.buffer.size
+        return self.speech
+
+    async def _finalize(self, start: int, end: int) -> List[Dict]:
+        text = await self.service.transcribe_array(
+            self.buffer[start:end],
+            language=self.language,
+            initial_prompt=self.last_final,
+        )
+        event = self._event("final", text, start, end)
+        self._drop(end)
+        if text:
+            self.last_final = text
+            return [event]
+        return []
+
+    def _drop(self, samples: int):
+        self.buffer = self.buffer[samples:]
+        self.offset += samples
+        self.scanned = max(0, self.scanned - samples)
+        self.speech = [
+            {"start": max(0, segment["start"] - samples), "end": segment["end"] - samples}
+            for segment in self.speech
+            if segment["end"] > samples
+        ]
+
+    def _event(self, kind: str, text: str, start: int, end: int) -> Dict:
+        return {
+            "type": kind,
+            "text": text,
+            "start": round((self.offset + start) / SAMPLE_RATE, 2),
+            "end": round((self.offset + end) / SAMPLE_RATE, 2),
+        }
+
+
 voice_service = VoiceService()
 
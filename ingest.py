@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Bulk-ingest a directory of PDF/TXT documents into SolverAI"
+    )
+    parser.add_argument("directory", help="Directory to scan for .pdf and .txt files")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Parsing/embedding processes (default: one per CPU core)",
+    )
+    parser.add_argument(
+        "--batch-files", type=int, default=None,
+        help="Files per batched index write (default: INGEST_BATCH_FILES)",
+    )
+    parser.add_argument(
+        "--collection", default=None,
+        help="Collection (workspace) to ingest into (default: default)",
+    )
+    parser.add_argument(
+        "--no-recursive", action="store_true",
+        help="Only scan the top level of the directory",
+    )
+    return parser.parse_args()
+
+
+async def run(args):
+    from database import AsyncSessionLocal, init_db, close_db
+    from services.ingestion_service import ingestion_service
+    from services.vector_store import validate_collection
+
+    collection = validate_collection(args.collection)
+    await init_db()
+    try:
+        items = ingestion_service.discover_files(
+            args.directory, recursive=not args.no_recursive
+        )
+        async with AsyncSessionLocal() as db:
+            new_items = await ingestion_service.filter_new(db, items)
+            print(f"Found {len(items)} files, {len(new_items)} not yet ingested")
+
+            start = time.time()
+            counts = await ingestion_service.ingest(
+                db,
+                new_items,
+                workers=args.workers,
+                batch_files=args.batch_files,
+                collection=collection,
+            )
+            elapsed = time.time() - start
+
+        print(f"Ready: {counts['ready']}  Failed: {counts['error']}  ({elapsed:.1f}s)")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    # Same local defaults as run.py so the CLI writes to the dev database
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+    # Add backend/app to python path
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "app"))
+
+    asyncio.run(run(parse_args()))
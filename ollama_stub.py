@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Stub Ollama server for testing multi-replica routing
+
+Implements /api/tags and /api/generate (streaming and non-streaming). The
+reply names the replica that served it, so routing can be checked from
+the chat responses.
+
+    python ollama_stub.py --port 11501 --models llama3.1:8b &
+    python ollama_stub.py --port 11502 --models llama3.1:8b,llama3.2:1b &
+    OLLAMA_REPLICAS=http://127.0.0.1:11501,http://127.0.0.1:11502 \\
+        LLM_MOCK_MODE=false python run.py
+"""
+
+import argparse
+import asyncio
+import json
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(port: int, models: list, delay: float, reply: str = "") -> FastAPI:
+    app = FastAPI()
+    state = {"healthy": True}
+
+    @app.get("/api/tags")
+    async def tags():
+        if not state["healthy"]:
+            return JSONResponse({"error": "unhealthy"}, status_code=503)
+        return {"models": [{"name": name} for name in models]}
+
+    @app.post("/stub/health")
+    async def set_health(healthy: bool):
+        """Toggle failures to exercise ejection and recovery"""
+        state["healthy"] = healthy
+        return state
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        if not state["healthy"]:
+            return JSONResponse({"error": "unhealthy"}, status_code=503)
+        body = await request.json()
+        if body.get("model") not in models:
+            return JSONResponse({"error": f"model {body.get('model')} not found"}, status_code=404)
+
+        words = (reply or f"Reply from replica {port} using {body['model']}.").split()
+        if not body.get("stream", True):
+            await asyncio.sleep(delay)
+            return {"model": body["model"], "response": " ".join(words), "done": True}
+
+        async def stream():
+            for word in words:
+                await asyncio.sleep(delay / len(words))
+                yield json.dumps({"model": body["model"], "response": word + " ", "done": False}) + "\n"
+            yield json.dumps({"model": body["model"], "response": "", "done": True}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default="llama3.1:8b", help="Comma-separated model names")
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds per response")
+    parser.add_argument("--reply", default="", help="Fixed reply text (e.g. to trigger escalation)")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.port, args.models.split(","), args.delay, args.reply),
+        host="127.0.0.1",
+        port=args.port,
+    )